@@ -0,0 +1,45 @@
+# benchmarks/bench_capture.py
+"""Per-request cost of the SIEM request-capture hooks.
+
+Run from the repository root:
+    python -m benchmarks.bench_capture --requests 200000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-only-secret-key-0123456789")
+os.environ.setdefault("REQUEST_LOG_DIR", tempfile.mkdtemp())
+
+from flask import Response  # noqa: E402
+
+from flask_app.app import app  # noqa: E402
+from flask_app.security.capture import request_capture  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200_000)
+    args = parser.parse_args()
+
+    response = Response(b"[]", mimetype="application/json")
+    with app.test_request_context("/api/market/markets", environ_base={"REMOTE_ADDR": "10.0.0.1"}):
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            request_capture._start()
+            request_capture._record(response)
+        elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    request_capture.flush()
+    flushed = time.perf_counter() - start
+
+    print(f"hook overhead: {elapsed / args.requests * 1e6:.2f} us/request")
+    print(f"dropped:       {request_capture.dropped:,} (ring capacity {request_capture.ring.capacity:,})")
+    print(f"final flush:   {flushed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
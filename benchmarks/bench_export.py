@@ -0,0 +1,69 @@
+# benchmarks/bench_export.py
+"""Streamed trade export throughput and memory next to .all() + to_dict().
+
+Uses DATABASE_URL if set (point it at a scratch Postgres database), otherwise
+a throwaway SQLite file. Peak RSS only ever grows, so the streamed formats
+run first. Run from the repository root:
+    python -m benchmarks.bench_export --trades 2000000 --formats csv,parquet
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+from datetime import datetime
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-only-secret-key-0123456789")
+
+from flask_app.app import app  # noqa: E402
+from flask_app import export  # noqa: E402
+from flask_app.models import db, Market, Trade  # noqa: E402
+
+CHUNK = 50_000
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trades", type=int, default=1_000_000)
+    parser.add_argument("--formats", default=",".join(export.FORMATS))
+    parser.add_argument("--skip-all", action="store_true", help="don't run the .all() baseline")
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(Market(name="bench", description="benchmark market", created_by=1))
+        db.session.flush()
+        now = datetime.utcnow()
+        for offset in range(0, args.trades, CHUNK):
+            db.session.bulk_insert_mappings(Trade, [
+                {"user_id": i % 1000 + 1, "market_id": 1, "outcome": "yes" if i % 2 else "no",
+                 "amount": float(i % 50 + 1), "price": 0.5, "created_at": now}
+                for i in range(offset, min(offset + CHUNK, args.trades))
+            ])
+        db.session.commit()
+        db.session.expunge_all()
+        print(f"database: {os.environ['DATABASE_URL'].split(':')[0]}, {args.trades:,} trades, "
+              f"baseline RSS {peak_rss_mb():.0f} MB")
+
+        for fmt in args.formats.split(","):
+            start = time.perf_counter()
+            size = sum(len(chunk) for chunk in export.export("trades", fmt))
+            elapsed = time.perf_counter() - start
+            print(f"{fmt:>8}: {args.trades / elapsed:>10,.0f} rows/s  {size / 1e6:8.1f} MB out  "
+                  f"peak RSS {peak_rss_mb():.0f} MB")
+
+        if not args.skip_all:
+            start = time.perf_counter()
+            rows = [trade.to_dict() for trade in Trade.query.all()]
+            elapsed = time.perf_counter() - start
+            print(f"{'.all()':>8}: {len(rows) / elapsed:>10,.0f} rows/s  {'':>15}  peak RSS {peak_rss_mb():.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
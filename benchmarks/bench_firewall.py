@@ -0,0 +1,83 @@
+# benchmarks/bench_firewall.py
+"""Firewall rule matching cost as the rule count grows.
+
+Compiles rulesets of synthetic CIDR, route and claim rules and times
+`Ruleset.match` for random client addresses and tokens, next to a naive scan that checks
+every rule in turn. Run from the repository root:
+    python -m benchmarks.bench_firewall --rules 10000 --lookups 200000
+"""
+import argparse
+import ipaddress
+import random
+import time
+
+from flask_app.security.firewall import Ruleset
+
+ROUTES = ["/api/market/markets", "/api/trade/trade", "/api/trade/balance", "/api/auth/login"]
+METHODS = ["GET", "POST"]
+
+
+def make_rules(count, rng):
+    rules = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.85:
+            length = rng.choice([8, 12, 16, 20, 24, 24, 28, 32, 32, 32])
+            network = ipaddress.ip_network((rng.getrandbits(32), length), strict=False)
+            rules.append({"id": f"r{i}", "action": "deny", "cidr": str(network)})
+        elif kind < 0.95:
+            rules.append({"id": f"r{i}", "action": "allow", "route": rng.choice(ROUTES),
+                          "methods": [rng.choice(METHODS)],
+                          "cidr": str(ipaddress.ip_network((rng.getrandbits(32), 16), strict=False))})
+        else:
+            rules.append({"id": f"r{i}", "action": "deny", "route": rng.choice(ROUTES),
+                          "claims": {"sub": str(rng.randrange(1, 100000))}})
+    return rules
+
+
+def naive_match(ruleset, ip, route, method, get_claims):
+    address = ipaddress.ip_address(ip)
+    claims = get_claims()
+    return [rule for rule in ruleset.rules
+            if rule.applies_to(route, method)
+            and (rule.networks is None or any(address in network for network in rule.networks))
+            and (rule.claims is None or rule.claims_match(claims))]
+
+
+def time_lookups(fn, ruleset, requests):
+    start = time.perf_counter()
+    for ip, route, method, claims in requests:
+        # Walk every candidate, as a request that no rule decides would
+        for _ in fn(ruleset, ip, route, method, lambda: claims):
+            pass
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rules", type=int, default=10_000)
+    parser.add_argument("--lookups", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    requests = [(str(ipaddress.IPv4Address(rng.getrandbits(32))), rng.choice(ROUTES), rng.choice(METHODS),
+                 {"sub": str(rng.randrange(1, 100000))} if rng.random() < 0.5 else None)
+                for _ in range(args.lookups)]
+    naive_lookups = requests[:max(1, args.lookups // 100)]
+
+    print(f"{'rules':>8} {'compile':>10} {'match/s':>12} {'us/match':>9} {'naive us/match':>15}")
+    for count in sorted({100, 1000, args.rules}):
+        specs = make_rules(count, rng)
+        start = time.perf_counter()
+        ruleset = Ruleset(specs, default="allow")
+        compiled = time.perf_counter() - start
+
+        elapsed = time_lookups(Ruleset.match, ruleset, requests)
+        naive = time_lookups(naive_match, ruleset, naive_lookups)
+        print(f"{count:>8,} {compiled * 1000:>8.1f}ms {len(requests) / elapsed:>12,.0f} "
+              f"{elapsed / len(requests) * 1e6:>9.2f} {naive / len(naive_lookups) * 1e6:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# benchmarks/bench_journal.py
+"""Order placement latency with fills written synchronously vs through the trade journal.
+
+--threads clients each place --orders crossing limit orders (every second
+order fills against the one before) through the API, first with fills written
+to the database inside the request, then acknowledged once journaled and
+drained in the background. Uses DATABASE_URL if set (point it at a scratch
+Postgres database), otherwise a throwaway SQLite file; the journal lives in a
+temporary directory. Run from the repository root:
+    python -m benchmarks.bench_journal --threads 8 --orders 200
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-only-secret-key-0123456789")
+os.environ.setdefault("TRADE_JOURNAL_DIR", tempfile.mkdtemp())
+os.environ.setdefault("RATELIMIT_ENABLED", "false")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+from flask_app.app import app  # noqa: E402
+from flask_app.journal import trade_journal  # noqa: E402
+from flask_app.models import db, Market, Trade, User  # noqa: E402
+from flask_app.tokens import token_service  # noqa: E402
+
+
+def client_run(market_id, tokens, orders, latencies):
+    client = app.test_client()
+    for i in range(orders):
+        outcome, price, token = ("yes", 0.6, tokens[0]) if i % 2 == 0 else ("no", 0.45, tokens[1])
+        start = time.perf_counter()
+        response = client.post("/api/trade/trade", headers={"Authorization": f"Bearer {token}"},
+                               json={"market_id": market_id, "outcome": outcome, "amount": 1, "price": price})
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 201, response.get_data(as_text=True)
+
+
+def run(label, threads, orders, tokens, market_ids):
+    latencies = []
+    workers = [threading.Thread(target=client_run, args=(market_ids[i], tokens[i], orders, latencies))
+               for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    trade_journal.close()
+    latencies.sort()
+    print(f"{label:>8}: p50 {statistics.median(latencies) * 1000:7.2f} ms  "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.2f} ms  {len(latencies) / elapsed:7.0f} orders/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--orders", type=int, default=200, help="orders per thread")
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        users = [User(username=f"bench{i}", email=f"bench{i}@example.com", password_hash="x" * 60,
+                      balance=Decimal("1000000.00")) for i in range(2 * args.threads)]
+        markets = [Market(name=f"bench {i}", description="benchmark market", created_by=1)
+                   for i in range(args.threads)]
+        db.session.add_all(users + markets)
+        db.session.commit()
+        tokens = [(token_service.issue(users[2 * i].id)[0], token_service.issue(users[2 * i + 1].id)[0])
+                  for i in range(args.threads)]
+        market_ids = [market.id for market in markets]
+
+    print(f"database: {os.environ['DATABASE_URL'].split(':')[0]}, {args.threads} threads x {args.orders} orders")
+    trade_journal.enabled = False
+    run("sync", args.threads, args.orders, tokens, market_ids)
+    trade_journal.enabled = True
+    run("journal", args.threads, args.orders, tokens, market_ids)
+    with app.app_context():
+        print(f"{'':>8}  {Trade.query.count():,} trades in the database after draining")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# benchmarks/bench_orderbook.py
+"""Single-core throughput of the in-memory order book.
+
+Run from the repository root:
+    python -m benchmarks.bench_orderbook --orders 500000 --markets 16
+"""
+import argparse
+import random
+import time
+
+from flask_app.orderbook import OrderBooks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=500_000)
+    parser.add_argument("--markets", type=int, default=16)
+    parser.add_argument("--batch", type=int, default=500, help="fills per simulated DB flush")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    orders = [
+        (rng.randrange(1, 1000), rng.randrange(args.markets),
+         "yes" if rng.random() < 0.5 else "no",
+         round(rng.uniform(0.40, 0.60), 2), float(rng.randrange(1, 50)))
+        for _ in range(args.orders)
+    ]
+
+    written = []
+    books = OrderBooks(written.extend)
+
+    fills = 0
+    start = time.perf_counter()
+    for order_id, (user_id, market_id, outcome, price, amount) in enumerate(orders, 1):
+        _, order_fills, ticket = books.submit(order_id, user_id, market_id, outcome, price, amount)
+        fills += len(order_fills)
+        if ticket and ticket % args.batch == 0:
+            books.batcher.flush(ticket)
+    elapsed = time.perf_counter() - start
+
+    print(f"orders:      {args.orders:,} across {args.markets} markets")
+    print(f"fills:       {fills:,}")
+    print(f"elapsed:     {elapsed:.3f}s")
+    print(f"orders/sec:  {args.orders / elapsed:,.0f}")
+    print(f"us/order:    {elapsed / args.orders * 1e6:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# benchmarks/bench_search.py
+"""Market search latency: ILIKE scan vs the in-process BM25 index.
+
+Fills the markets table with --markets generated markets, their words drawn
+from a Zipf-distributed vocabulary of --vocabulary terms like real text. Then
+runs the same queries two ways: as an ILIKE '%word%' scan over name and
+description (the only option before the index), and through the search index,
+BM25 ranking included. Loading the matched records is left out of both.
+Uses DATABASE_URL if set (point it at a scratch Postgres database), otherwise
+a throwaway SQLite file. Run from the repository root:
+    python -m benchmarks.bench_search --markets 100000
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-only-secret-key-0123456789")
+
+from sqlalchemy import insert, or_, select  # noqa: E402
+
+from flask_app.app import app  # noqa: E402
+from flask_app.models import db, Market  # noqa: E402
+from flask_app.search import SearchIndex  # noqa: E402
+
+WORDS = ("election president senate bitcoin ethereum price rally crash inflation rates fed cut hike "
+         "champion final league season storm hurricane launch rocket mission merger earnings record "
+         "turnout vote poll approval strike deal treaty summit budget shutdown film award box office").split()
+QUERIES = ["election", "bitcoin price", "elec", "fed rates cut", "hurri", "box office record", "launch"]
+
+
+def vocabulary(size):
+    # The named words take the ranks after the 100 most common, like topical words in real text
+    filler = [f"w{rank}x" for rank in range(size - len(WORDS))]
+    return filler[:100] + WORDS + filler[100:]
+
+
+def text(rng, words, vocab, weights):
+    return " ".join(rng.choices(vocab, cum_weights=weights, k=words))
+
+
+def ilike(query):
+    clauses = [or_(Market.name.ilike(f"%{word}%"), Market.description.ilike(f"%{word}%"))
+               for word in query.split()]
+    return db.session.execute(select(Market.id).where(or_(*clauses))).all()
+
+
+def timed(fn, query, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(query)
+        latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--markets", type=int, default=100_000)
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per query and method")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    vocab = vocabulary(args.vocabulary)
+    weights = list(itertools.accumulate(1.0 / rank for rank in range(1, len(vocab) + 1)))
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for start in range(0, args.markets, 10_000):
+            db.session.execute(insert(Market), [
+                {"name": text(rng, 5, vocab, weights), "description": text(rng, 20, vocab, weights), "created_by": 1}
+                for _ in range(start, min(start + 10_000, args.markets))
+            ])
+        db.session.commit()
+
+        index = SearchIndex(refresh_interval=float("inf"))
+        start = time.perf_counter()
+        index.refresh()
+        print(f"{args.markets:,} markets, index built in {time.perf_counter() - start:.2f} s")
+
+        for query in QUERIES:
+            scan = timed(ilike, query, args.repeat)
+            indexed = timed(lambda q: index.search(q, limit=20), query, args.repeat * 20)
+            print(f"{query!r:>20}: ILIKE {scan * 1000:9.2f} ms  index {indexed * 1000:7.3f} ms  "
+                  f"{scan / indexed:7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# benchmarks/bench_serialize.py
+"""CPU per list response: ORM instances + to_dict() + jsonify vs projected records.
+
+Times one user's --trades trades and a page of --markets markets, built each
+way: the old path loads ORM instances, calls to_dict() and encodes with
+jsonify / json.dumps; the fast path selects the columns into plain records
+and encodes them with orjson, or the stdlib encoder when orjson is missing.
+Times are process CPU time, queries included. Run from the repository root:
+    python -m benchmarks.bench_serialize --trades 10000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-only-secret-key-0123456789")
+
+from flask import jsonify  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from flask_app.app import app  # noqa: E402
+from flask_app import serialize  # noqa: E402
+from flask_app.api.market import render_markets_page  # noqa: E402
+from flask_app.models import db, Market, Trade  # noqa: E402
+from flask_app.serialize import TradeRecord  # noqa: E402
+
+
+def cpu_per_call(fn, repeat):
+    fn()  # warm caches and compiled statements
+    start = time.process_time()
+    for _ in range(repeat):
+        size = len(fn())
+        db.session.expunge_all()
+    return (time.process_time() - start) / repeat, size
+
+
+def trades_orm():
+    trades = Trade.query.filter_by(user_id=1).order_by(Trade.id).all()
+    return jsonify([trade.to_dict() for trade in trades]).get_data()
+
+
+def trades_records():
+    return b"".join(serialize.stream_array(
+        serialize.iter_records(TradeRecord, Trade.user_id == 1, order_by=Trade.id)))
+
+
+def markets_orm(limit):
+    markets = Market.query.filter(Market.is_resolved.is_(False)).order_by(Market.id).limit(limit).all()
+    return json.dumps([market.to_dict() for market in markets], separators=(",", ":")).encode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trades", type=int, default=10_000)
+    parser.add_argument("--markets", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with app.app_context(), app.test_request_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(insert(Market), [
+            {"name": f"market {i}", "description": "benchmark market " * 4, "created_by": 1,
+             "pricing_mode": "book"} for i in range(args.markets)
+        ])
+        now = datetime.utcnow()
+        db.session.execute(insert(Trade), [
+            {"user_id": 1, "market_id": i % args.markets + 1, "outcome": "yes" if i % 2 else "no",
+             "amount": float(i % 50 + 1), "price": 0.5, "created_at": now} for i in range(args.trades)
+        ])
+        db.session.commit()
+        app.json.compact = True  # jsonify as in production, not debug's indented output
+
+        encoders = [("orjson", serialize.orjson), ("json", None)] if serialize.orjson else [("json", None)]
+        cases = [
+            (f"{args.trades:,} trades", trades_orm, trades_records),
+            (f"{args.markets:,} markets", lambda: markets_orm(args.markets),
+             lambda: render_markets_page(False, 0, 0, args.markets)[1]),
+        ]
+        for label, old, new in cases:
+            baseline, size = cpu_per_call(old, args.repeat)
+            print(f"{label}: ORM + to_dict {baseline * 1000:8.2f} ms CPU  ({size / 1000:.0f} kB)")
+            for name, module in encoders:
+                serialize.orjson = module
+                fast, size = cpu_per_call(new, args.repeat)
+                print(f"{'':>{len(label)}}  records + {name:<6} {fast * 1000:8.2f} ms CPU  "
+                      f"({size / 1000:.0f} kB)  {baseline / fast:.1f}x")
+            serialize.orjson = encoders[0][1]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# benchmarks/bench_settlement.py
+"""Time to resolve one market holding many synthetic trades.
+
+Uses DATABASE_URL if set (point it at a scratch Postgres database), otherwise
+a throwaway SQLite file. Run from the repository root:
+    python -m benchmarks.bench_settlement --trades 1000000 --users 20000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-only-secret-key-0123456789")
+
+from flask_app.app import app  # noqa: E402
+from flask_app.models import db, Market, Trade, User  # noqa: E402
+from flask_app.positions import apply_trades  # noqa: E402
+from flask_app.settlement import settle_market  # noqa: E402
+
+CHUNK = 50_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trades", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        start = time.perf_counter()
+        db.session.bulk_insert_mappings(User, [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password_hash": "x" * 60}
+            for i in range(1, args.users + 1)
+        ])
+        market = Market(name="bench", description="benchmark market", created_by=1)
+        db.session.add(market)
+        db.session.flush()
+
+        for offset in range(0, args.trades, CHUNK):
+            rows = [{"user_id": rng.randint(1, args.users), "market_id": market.id,
+                     "outcome": "yes" if rng.random() < 0.5 else "no",
+                     "amount": float(rng.randint(1, 100)), "price": round(rng.uniform(0.05, 0.95), 2)}
+                    for _ in range(min(CHUNK, args.trades - offset))]
+            db.session.bulk_insert_mappings(Trade, rows)
+            apply_trades(rows)
+        db.session.commit()
+        seeded = time.perf_counter() - start
+
+        start = time.perf_counter()
+        summary = settle_market(market.id, "yes")
+        db.session.commit()
+        settled = time.perf_counter() - start
+
+    print(f"database:   {os.environ['DATABASE_URL'].split(':')[0]}")
+    print(f"seeded:     {args.trades:,} trades / {args.users:,} users in {seeded:.1f}s")
+    print(f"winners:    {summary['winners']:,}, paid {summary['total_paid']:,.2f}")
+    print(f"settlement: {settled:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# benchmarks/bench_trade_batch.py
+"""Trade ingestion throughput: POST /api/trade/trade vs /api/trade/trades/batch.
+
+Uses DATABASE_URL if set (point it at a scratch Postgres database), otherwise
+a throwaway SQLite file. Run from the repository root:
+    python -m benchmarks.bench_trade_batch --trades 5000 --batch 500
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-only-secret-key-0123456789")
+os.environ.setdefault("RATELIMIT_ENABLED", "false")  # measure the endpoints, not the limiter
+
+from flask_app.app import app  # noqa: E402
+from flask_app.models import db, Market, Trade, User  # noqa: E402
+from flask_app.tokens import token_service  # noqa: E402
+
+
+def make_trades(rng, count, market_ids):
+    return [{"market_id": rng.choice(market_ids),
+             "outcome": "yes" if rng.random() < 0.5 else "no",
+             "amount": float(rng.randrange(1, 20))}
+            for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trades", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--markets", type=int, default=20)
+    parser.add_argument("--mode", choices=["lmsr", "book"], default="lmsr")
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        trader = User(username="bench", email="bench@example.com", password_hash="x" * 60, balance=10_000_000)
+        db.session.add(trader)
+        db.session.flush()
+        markets = [Market(name=f"bench {i}", description="benchmark market", created_by=trader.id,
+                          pricing_mode=args.mode, liquidity=100.0 if args.mode == "lmsr" else None,
+                          shares_yes=0.0, shares_no=0.0)
+                   for i in range(args.markets)]
+        db.session.add_all(markets)
+        db.session.commit()
+        market_ids = [m.id for m in markets]
+        headers = {"Authorization": "Bearer " + token_service.issue(trader.id)[0]}
+
+    client = app.test_client()
+    rng = random.Random(11)
+    trades = make_trades(rng, args.trades, market_ids)
+
+    start = time.perf_counter()
+    for trade in trades:
+        client.post("/api/trade/trade", json=trade, headers=headers)
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(0, len(trades), args.batch):
+        client.post("/api/trade/trades/batch", json=trades[i:i + args.batch], headers=headers)
+    batched = time.perf_counter() - start
+
+    with app.app_context():
+        rows = Trade.query.count()
+
+    print(f"database:        {os.environ['DATABASE_URL'].split(':')[0]}")
+    print(f"mode:            {args.mode}, trade rows written: {rows:,}")
+    print(f"single endpoint: {args.trades / single:,.0f} trades/sec ({single:.2f}s)")
+    print(f"batch endpoint:  {args.trades / batched:,.0f} trades/sec ({batched:.2f}s, batch={args.batch})")
+    print(f"speedup:         {single / batched:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
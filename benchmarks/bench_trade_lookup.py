@@ -0,0 +1,93 @@
+# benchmarks/bench_trade_lookup.py
+"""Per-user trade lookup latency with and without the (user_id, id) index.
+
+Runs get_trades' query (a user's trades in id order) against a trades table
+of --trades rows spread over --users users: first with the composite indexes
+dropped (a sequential scan per lookup), then with them built. Uses
+DATABASE_URL if set (point it at a scratch Postgres database), otherwise a
+throwaway SQLite file. Run from the repository root:
+    python -m benchmarks.bench_trade_lookup --trades 10000000 --users 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-only-secret-key-0123456789")
+
+from sqlalchemy import insert, select  # noqa: E402
+
+from flask_app.app import app  # noqa: E402
+from flask_app.models import db, Market, Trade  # noqa: E402
+
+CHUNK = 100_000
+MARKETS = 1000
+
+
+def lookup_latencies(users, lookups):
+    stmt = select(Trade).where(Trade.user_id == db.bindparam("user_id")).order_by(Trade.id)
+    latencies, rows = [], 0
+    for _ in range(lookups):
+        start = time.perf_counter()
+        rows += len(db.session.execute(stmt, {"user_id": random.randint(1, users)}).all())
+        latencies.append(time.perf_counter() - start)
+        db.session.expunge_all()
+    return latencies, rows / lookups
+
+
+def report(label, latencies, rows):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{label:>10}: p50 {statistics.median(latencies) * 1000:9.3f} ms  p99 {p99 * 1000:9.3f} ms  "
+          f"({len(latencies)} lookups, {rows:.0f} rows each)")
+    return statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trades", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--scan-lookups", type=int, default=5, help="lookups without the index (each scans the table)")
+    parser.add_argument("--lookups", type=int, default=2000, help="lookups with the index")
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(insert(Market), [
+            {"name": f"market {i}", "description": "benchmark market", "created_by": 1} for i in range(MARKETS)
+        ])
+        db.session.commit()
+        for index in Trade.__table__.indexes:
+            index.drop(db.engine)  # Load without indexes, as the table was before this change
+        now = datetime.utcnow()
+        start = time.perf_counter()
+        for offset in range(0, args.trades, CHUNK):
+            db.session.execute(insert(Trade), [
+                {"user_id": random.randint(1, args.users), "market_id": i % MARKETS + 1,
+                 "outcome": "yes" if i % 2 else "no", "amount": float(i % 50 + 1), "price": 0.5, "created_at": now}
+                for i in range(offset, min(offset + CHUNK, args.trades))
+            ])
+            db.session.commit()
+        print(f"database: {os.environ['DATABASE_URL'].split(':')[0]}, {args.trades:,} trades over "
+              f"{args.users:,} users, loaded in {time.perf_counter() - start:.0f}s")
+
+        scan = report("no index", *lookup_latencies(args.users, args.scan_lookups))
+        db.session.commit()
+        start = time.perf_counter()
+        for index in Trade.__table__.indexes:
+            index.create(db.engine)
+        if db.engine.dialect.name == "postgresql":
+            db.session.execute(db.text("ANALYZE trades"))
+            db.session.commit()
+        print(f"{'':>10}  indexes built in {time.perf_counter() - start:.1f}s")
+        indexed = report("indexed", *lookup_latencies(args.users, args.lookups))
+        print(f"{'speedup':>10}: {scan / indexed:,.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+# benchmarks/loadgen.py
+"""Mixed-endpoint HTTP load test for the whole API.
+
+Seeds users, markets and historical trades, serves `flask_app.app` from a
+threaded WSGI server in this process (or targets a running one with --url,
+which must share DATABASE_URL so the seeded accounts exist), then drives
+register, login, market listing and trade placement from --concurrency
+keep-alive client threads for --duration seconds. Prints p50/p90/p99 latency
+and throughput per scenario and writes them to JSON for comparing commits.
+
+Uses DATABASE_URL if set (point it at a scratch Postgres database), otherwise
+a throwaway SQLite file. Run from the repository root:
+    python -m benchmarks.loadgen --users 1000 --markets 100 --trades 200000 --concurrency 16
+    python -m benchmarks.loadgen --compare benchmarks/results/loadgen-<commit>-<time>.json
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import numpy as np
+
+PASSWORD = "BenchPassw0rd!"
+DEFAULT_MIX = "register=1,login=2,markets=10,trade=6"
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+SEED_CHUNK = 50_000
+TOKEN_POOL = 200
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}; choose from {sorted(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# --- scenarios: (rng, state) -> (method, path, body, headers) ---
+
+def register(rng, state):
+    n = next(state["counter"])
+    name = f"lg{state['run']}x{n}"
+    return "POST", "/api/auth/register", {"username": name, "email": f"{name}@example.com", "password": PASSWORD}, {}
+
+
+def login(rng, state):
+    i = rng.randrange(1, state["users"] + 1)
+    return "POST", "/api/auth/login", {"username_or_email": f"user{i}", "password": PASSWORD}, {}
+
+
+def markets(rng, state):
+    after = rng.choice([0, 0, 0, rng.randrange(0, state["markets"])])
+    return "GET", f"/api/market/markets?after={after}&limit=50", None, {}
+
+
+def trade(rng, state):
+    market_id = rng.randrange(1, state["markets"] + 1)
+    body = {"market_id": market_id, "outcome": rng.choice(("yes", "no")), "amount": float(rng.randrange(1, 20))}
+    if market_id not in state["lmsr"]:
+        body["price"] = round(rng.uniform(0.40, 0.60), 2)
+    return "POST", "/api/trade/trade", body, {"Authorization": "Bearer " + rng.choice(state["tokens"])}
+
+
+SCENARIOS = {"register": register, "login": login, "markets": markets, "trade": trade}
+
+
+def seed(app, args):
+    """Create users, markets and trades; returns the state the scenarios need."""
+    from flask_app.models import db, Market, Trade, User
+    from flask_app.passwords import password_hasher
+    from flask_app.positions import apply_trades
+    from flask_app.tokens import token_service
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        password_hash = password_hasher.hash(PASSWORD)
+        db.session.bulk_insert_mappings(User, [
+            {"username": f"user{i}", "email": f"user{i}@example.com",
+             "password_hash": password_hash, "balance": 1_000_000}
+            for i in range(1, args.users + 1)
+        ])
+        lmsr = set()
+        for i in range(1, args.markets + 1):
+            mode = "lmsr" if i % 2 else "book"
+            if mode == "lmsr":
+                lmsr.add(i)
+            db.session.add(Market(name=f"load market {i}", description="load test market", created_by=1,
+                                  pricing_mode=mode, liquidity=100.0 if mode == "lmsr" else None,
+                                  shares_yes=0.0, shares_no=0.0))
+        db.session.flush()
+        for offset in range(0, args.trades, SEED_CHUNK):
+            rows = [{"user_id": rng.randint(1, args.users), "market_id": rng.randint(1, args.markets),
+                     "outcome": rng.choice(("yes", "no")), "amount": float(rng.randint(1, 100)),
+                     "price": round(rng.uniform(0.05, 0.95), 2)}
+                    for _ in range(min(SEED_CHUNK, args.trades - offset))]
+            db.session.bulk_insert_mappings(Trade, rows)
+            apply_trades(rows)
+        db.session.commit()
+        tokens = [token_service.issue(rng.randint(1, args.users))[0] for _ in range(TOKEN_POOL)]
+
+    return {"users": args.users, "markets": args.markets, "lmsr": lmsr, "tokens": tokens,
+            "run": f"{int(time.time())}{os.getpid()}", "counter": _Counter()}
+
+
+class _Counter:
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def __next__(self):
+        with self._lock:
+            self._value += 1
+            return self._value
+
+
+def serve(app):
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="loadgen-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def worker(url, mix, state, seed, warm_until, deadline, samples):
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    connection = connection_class(parts.hostname, parts.port, timeout=60)
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    while True:
+        name = rng.choices(names, weights)[0]
+        method, path, body, headers = SCENARIOS[name](rng, state)
+        payload = json.dumps(body).encode() if body is not None else None
+        if payload is not None:
+            headers = dict(headers, **{"Content-Type": "application/json"})
+        start = time.perf_counter()
+        if start >= deadline:
+            break
+        try:
+            connection.request(method, path, body=payload, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            status = 0  # connection error
+        elapsed = time.perf_counter() - start
+        if start >= warm_until:
+            samples.append((name, status, elapsed))
+    connection.close()
+
+
+def run_load(url, mix, state, args):
+    start = time.perf_counter()
+    warm_until = start + args.warmup
+    deadline = warm_until + args.duration
+    per_thread = [[] for _ in range(args.concurrency)]
+    threads = [threading.Thread(target=worker, args=(url, mix, state, args.seed + i, warm_until, deadline, samples))
+               for i, samples in enumerate(per_thread)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [sample for samples in per_thread for sample in samples]
+
+
+def summarize(samples, duration):
+    by_scenario = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    for name, status, elapsed in samples:
+        by_scenario[name].append(elapsed)
+        statuses[name][status] += 1
+
+    results = {}
+    for name in sorted(by_scenario):
+        latencies = np.array(by_scenario[name]) * 1000
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        errors = sum(count for status, count in statuses[name].items() if not 200 <= status < 400)
+        results[name] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "statuses": {str(status): count for status, count in sorted(statuses[name].items())},
+            "rps": round(len(latencies) / duration, 1),
+            "p50_ms": round(float(p50), 2),
+            "p90_ms": round(float(p90), 2),
+            "p99_ms": round(float(p99), 2),
+            "max_ms": round(float(latencies.max()), 2)
+        }
+    total = len(samples)
+    results["total"] = {"requests": total, "rps": round(total / duration, 1),
+                        "errors": sum(r["errors"] for r in results.values())}
+    return results
+
+
+def print_report(results, baseline=None):
+    print(f"{'scenario':<10} {'requests':>9} {'errors':>7} {'rps':>9} {'p50 ms':>8} {'p90 ms':>8} "
+          f"{'p99 ms':>8} {'max ms':>8}")
+    for name, r in results.items():
+        if name == "total":
+            continue
+        print(f"{name:<10} {r['requests']:>9,} {r['errors']:>7,} {r['rps']:>9,.1f} {r['p50_ms']:>8.2f} "
+              f"{r['p90_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['max_ms']:>8.2f}")
+    total = results["total"]
+    print(f"{'total':<10} {total['requests']:>9,} {total['errors']:>7,} {total['rps']:>9,.1f}")
+
+    if baseline:
+        print(f"\nvs {baseline.get('commit', '?')[:12]} ({baseline.get('timestamp', '?')}):")
+        for name, r in results.items():
+            old = baseline["results"].get(name)
+            if not old or name == "total":
+                continue
+            print(f"{name:<10} rps {_delta(r['rps'], old['rps']):>8}   "
+                  f"p50 {_delta(r['p50_ms'], old['p50_ms']):>8}   p99 {_delta(r['p99_ms'], old['p99_ms']):>8}")
+
+
+def _delta(new, old):
+    return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--markets", type=int, default=100)
+    parser.add_argument("--trades", type=int, default=100_000, help="historical trades to seed")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds run before measuring")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"scenario weights (default {DEFAULT_MIX})")
+    parser.add_argument("--bcrypt-rounds", type=int, default=10)
+    parser.add_argument("--url", help="target a running server instead of starting one")
+    parser.add_argument("--out", default=RESULTS_DIR, help="directory for the JSON results")
+    parser.add_argument("--compare", help="earlier results JSON to diff against")
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+
+    # The app reads these at import time
+    os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "loadgen.db"))
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark-only-secret-key-0123456789")
+    os.environ.setdefault("RATELIMIT_ENABLED", "false")  # one client address would trip every limit
+    os.environ.setdefault("REQUEST_LOG_DIR", tempfile.mkdtemp())
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    from flask_app.app import app
+
+    start = time.perf_counter()
+    state = seed(app, args)
+    print(f"database: {os.environ['DATABASE_URL'].split(':')[0]}; seeded {args.users:,} users, "
+          f"{args.markets:,} markets, {args.trades:,} trades in {time.perf_counter() - start:.1f}s")
+
+    server = None
+    url = args.url
+    if url is None:
+        server, url = serve(app)
+    try:
+        print(f"driving {url} with {args.concurrency} clients for {args.duration:g}s "
+              f"(+{args.warmup:g}s warmup)\n")
+        samples = run_load(url, args.mix, state, args)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    results = summarize(samples, args.duration)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_report(results, baseline)
+
+    commit = git_commit()
+    record = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "database": os.environ["DATABASE_URL"].split(":")[0],
+        "config": {key: value for key, value in vars(args).items() if key not in ("out", "compare")},
+        "results": results
+    }
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"loadgen-{commit[:12]}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w") as results_file:
+        json.dump(record, results_file, indent=2)
+    print(f"\nresults written to {path}")
+
+
+if __name__ == "__main__":
+    main()
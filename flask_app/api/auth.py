@@ -1,19 +1,16 @@
 # flask_app/api/auth.py
-import os
 import re
-import bcrypt
-import jwt
-import datetime
-from datetime import timedelta
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, g
 from sqlalchemy.exc import SQLAlchemyError
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 from flask_app.models import db, User
+from flask_app.passwords import password_hasher, HasherBusy
+from flask_app.tokens import token_service, token_required
+from flask_app import ledger
+from flask_app.security.ratelimit import limiter
+from flask_app.dbrouting import read_only, use_primary
 
-# Initialize the blueprint and limiter
+# Initialize the blueprint
 auth_bp = Blueprint('auth', __name__)
-limiter = Limiter(key_func=get_remote_address)
 
 # --- Constants for validation (optional) ---
 MIN_PASSWORD_LENGTH = 12
@@ -28,6 +25,10 @@ def validate_input(email: str, password: str) -> tuple:
         return False, ("Password must contain: 12+ chars, uppercase, lowercase, number, special char")
     return True, ""
 
+def busy_response(error: HasherBusy):
+    """503 with Retry-After when the password hashing pool is saturated."""
+    return jsonify({"message": "Server busy, please retry shortly"}), 503, {"Retry-After": str(error.retry_after)}
+
 # --- Routes ---
 
 # Registration Form (GET) - for full-stack, you might render a template instead.
@@ -44,6 +45,7 @@ def register_page():
 
 # Registration Processing (POST)
 @auth_bp.route('/register', methods=['POST'])
+@limiter.limit("10 per hour")
 def register_user():
     try:
         # Handle JSON vs form explicitly (REMOVED THE REDUNDANT LINE)
@@ -69,12 +71,16 @@ def register_user():
         if User.query.filter((User.username == username) | (User.email == email)).first():
             return jsonify({"message": "Username or email already exists"}), 409
 
-        hashed_pw = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=12))
-        new_user = User(username=username, email=email, password_hash=hashed_pw.decode('utf-8'))
+        hashed_pw = password_hasher.hash(password)
+        new_user = User(username=username, email=email, password_hash=hashed_pw, balance=0)
         db.session.add(new_user)
+        db.session.flush()
+        ledger.credit(new_user.id, current_app.config.get('STARTING_BALANCE', 0), "signup")
         db.session.commit()
 
         return jsonify({"message": "User created successfully"}), 201
+    except HasherBusy as e:
+        return busy_response(e)
     except SQLAlchemyError as e:
         db.session.rollback()
         current_app.logger.error(f"Database error: {str(e)}")
@@ -97,6 +103,7 @@ def login_page():
 # Login Processing (POST)
 @auth_bp.route('/login', methods=['POST'])
 @limiter.limit("5 per minute", override_defaults=False)
+@read_only
 def login_user():
     try:
         # Explicit content type check (REMOVED THE REDUNDANT LINE)
@@ -114,23 +121,29 @@ def login_user():
         if not all([username_or_email, password]):
             return jsonify({"message": "Missing credentials"}), 400
 
-        user = User.query.filter((User.username == username_or_email) | (User.email == username_or_email)).first()
-        if not user or not bcrypt.checkpw(password.encode('utf-8'), user.password_hash.encode('utf-8')):
+        lookup = User.query.filter((User.username == username_or_email) | (User.email == username_or_email))
+        user = lookup.first()
+        if not user:
+            with use_primary():  # a replica may not have a just-registered account yet
+                user = lookup.first()
+        if not user or not password_hasher.check(password, user.password_hash):
             return jsonify({"message": "Invalid credentials"}), 401
 
-        secret = os.environ.get('JWT_SECRET_KEY')
-        if not secret:
-            raise ValueError("Missing JWT secret in environment")
+        # Upgrade hashes made with an old cost factor while we have the plaintext
+        if password_hasher.needs_rehash(user.password_hash):
+            try:
+                user.password_hash = password_hasher.hash(password)
+                db.session.commit()
+            except HasherBusy:
+                pass  # Try again on a later login rather than fail this one
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                current_app.logger.error(f"Rehash failed: {str(e)}")
 
-        token = jwt.encode({
-            'sub': user.id,
-            'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1),
-            'iss': 'your-app-name',
-            'aud': 'your-app-client'
-        }, secret, algorithm='HS256')
+        token, expires_in = token_service.issue(user.id)
 
 	# Return token only for successful login
-        return jsonify({"token": token, "expires_in": 3600}), 200
+        return jsonify({"token": token, "expires_in": expires_in}), 200
         
 
 	# we need to come back and edit this for HTTPSonly but am passing back JSON token for now
@@ -139,6 +152,20 @@ def login_user():
 
 
 
+    except HasherBusy as e:
+        return busy_response(e)
     except Exception as e:
         current_app.logger.error(f"Login error: {str(e)}")
-        return jsonify({"message": "Login failed"}), 500
\ No newline at end of file
+        return jsonify({"message": "Login failed"}), 500
+
+# Logout (POST) - revoke the presented token everywhere
+@auth_bp.route('/logout', methods=['POST'])
+@token_required
+def logout_user():
+    try:
+        token_service.revoke(g.token_claims)
+        return jsonify({"message": "Logged out"}), 200
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.error(f"Database error: {str(e)}")
+        return jsonify({"message": "Logout failed"}), 500
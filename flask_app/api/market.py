@@ -1,38 +1,262 @@
 # flask_app/api/market.py
-from flask import Blueprint, request, jsonify
+import hashlib
+import time
+from flask import Blueprint, Response, request, jsonify, url_for, current_app
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
 from flask_app.models import db, Market
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_app import lmsr, candles, serialize
+from flask_app.serialize import MarketRecord, QuotedMarketRecord
+from flask_app.cache import market_listing_cache
+from flask_app.pricefeed import price_feed
+from flask_app.settlement import settle_market
+from flask_app.api.trade import order_books, backlogged_response
+from flask_app.journal import trade_journal, JournalBacklogged
+from flask_app.orders import resting_orders
+from flask_app.shards import owned
+from flask_app.search import market_search
+from flask_app.tokens import token_required, get_token_identity
+from flask_app.dbrouting import read_only
+from flask_app.security.ratelimit import limiter, get_user_or_address
 
 market_bp = Blueprint('market', __name__)
 
+PRICING_MODES = ("book", "lmsr")
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+DEFAULT_CANDLES = 500
+MAX_CANDLES = 5000
+DEFAULT_SEARCH_RESULTS = 20
+MAX_SEARCH_RESULTS = 100
+
 # 🟢 POST: Create a new prediction market
 @market_bp.route('/markets', methods=['POST'])
-@jwt_required()
+@token_required
+@limiter.limit("20 per hour", key_func=get_user_or_address)
 def create_market():
     data = request.json
-    user_id = get_jwt_identity()
+    user_id = get_token_identity()
 
     required_fields = ["name", "description"]
     if not all(field in data for field in required_fields):
         return jsonify({"error": "Market name and description are required"}), 400
 
+    pricing_mode = data.get("pricing_mode", "book")
+    if pricing_mode not in PRICING_MODES:
+        return jsonify({"error": "Invalid pricing_mode, choose 'book' or 'lmsr'"}), 400
+
     new_market = Market(
         name=data["name"],
         description=data["description"],
         created_by=user_id,
         outcome_yes_price=data.get("outcome_yes_price", 0.5),  # Default to 50-50 probability
-        outcome_no_price=data.get("outcome_no_price", 0.5)
+        outcome_no_price=data.get("outcome_no_price", 0.5),
+        pricing_mode=pricing_mode,
+        shares_yes=0.0,
+        shares_no=0.0
     )
 
+    if pricing_mode == "lmsr":
+        try:
+            liquidity = float(data.get("liquidity", lmsr.DEFAULT_LIQUIDITY))
+            yes_price = float(new_market.outcome_yes_price)
+        except (TypeError, ValueError):
+            return jsonify({"error": "Liquidity and prices must be numbers"}), 400
+        if liquidity <= 0 or not 0 < yes_price < 1:
+            return jsonify({"error": "Liquidity must be positive and prices between 0 and 1"}), 400
+        # Seed the share imbalance so the market opens at the requested price
+        new_market.liquidity = liquidity
+        new_market.shares_yes = lmsr.shares_for_price(yes_price, liquidity)
+        new_market.outcome_yes_price = yes_price
+        new_market.outcome_no_price = 1.0 - yes_price
+
     db.session.add(new_market)
     db.session.commit()
+    market_listing_cache.invalidate()
+    market_search.add(new_market.id, new_market.name, new_market.description)
+    price_feed.publish_price(new_market.id, new_market.outcome_yes_price, new_market.outcome_no_price)
 
     return jsonify(new_market.to_dict()), 201
 
-# 🟢 GET: Fetch all markets (open & closed)
+# 🟢 POST: Resolve a market and pay out the winning side
+@market_bp.route('/markets/<int:market_id>/resolve', methods=['POST'])
+@token_required
+@limiter.limit("20 per hour", key_func=get_user_or_address)
+@owned(lambda kwargs: kwargs["market_id"])
+def resolve_market(market_id):
+    data = request.json or {}
+    user_id = get_token_identity()
+
+    outcome = data.get("outcome")
+    if outcome not in ["yes", "no"]:
+        return jsonify({"error": "Invalid outcome, choose 'yes' or 'no'"}), 400
+
+    market = Market.query.get(market_id)
+    if not market:
+        return jsonify({"error": "Market not found"}), 404
+    if market.created_by != user_id:
+        return jsonify({"error": "Only the market creator can resolve it"}), 403
+
+    # No new matches from here on; the fills already made (journaled ones included) are
+    # written before settling, so the positions are complete and `filled` is final
+    order_books.halt(market_id)
+    try:
+        order_books.batcher.flush_all()
+        trade_journal.wait_drained()
+        summary = settle_market(market_id, outcome)
+        summary["orders_released"] = resting_orders.release_market(market_id)
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        order_books.resume(market_id)
+        return jsonify({"error": str(e)}), 400
+    except JournalBacklogged as e:
+        order_books.resume(market_id)
+        return backlogged_response(e)
+    except (SQLAlchemyError, OSError) as e:
+        db.session.rollback()
+        order_books.resume(market_id)
+        current_app.logger.error(f"Could not resolve market {market_id}: {str(e)}")
+        return jsonify({"error": "Market could not be resolved"}), 500
+
+    order_books.close(market_id)
+    market_listing_cache.invalidate()
+    price_feed.publish_price(market_id, market.outcome_yes_price, market.outcome_no_price)
+
+    return jsonify(summary), 200
+
+# 🟢 GET: Fetch markets (open & closed), keyset-paginated by id when `after` or `limit` is given
 @market_bp.route('/markets', methods=['GET'])
+@limiter.limit("600 per minute")
+@read_only
 def get_markets():
     show_resolved = request.args.get("resolved", "false").lower() == "true"
-    
-    markets = Market.query.filter_by(is_resolved=show_resolved).all()
-    return jsonify([market.to_dict() for market in markets]), 200
\ No newline at end of file
+    quote_amount = request.args.get("quote", 0, type=float)
+    after = request.args.get("after", 0, type=int)
+    # Clients from before pagination send neither and expect every market in one array
+    if "after" in request.args or "limit" in request.args:
+        limit = min(max(request.args.get("limit", DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    else:
+        limit = None
+
+    key = (show_resolved, quote_amount, after, limit)
+    etag, body, next_cursor = market_listing_cache.get_or_set(
+        key, lambda: render_markets_page(show_resolved, quote_amount, after, limit)
+    )
+
+    # Polling clients that already hold this page skip serialization entirely
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, status=200, mimetype="application/json")
+    response.set_etag(etag)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+        response.headers["Link"] = '<{}>; rel="next"'.format(
+            url_for("market.get_markets", resolved=str(show_resolved).lower(),
+                    after=next_cursor, limit=limit, quote=quote_amount or None)
+        )
+    return response
+
+# 🟢 GET: Full-text search over market names and descriptions, best match first
+@market_bp.route('/search', methods=['GET'])
+@limiter.limit("600 per minute")
+@read_only
+def search_markets():
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "Query parameter q is required"}), 400
+    limit = min(max(request.args.get("limit", DEFAULT_SEARCH_RESULTS, type=int), 1), MAX_SEARCH_RESULTS)
+
+    ranked = market_search.search(query, limit)
+    records = {record.id: record for record in
+               serialize.select_records(MarketRecord, Market.id.in_([market_id for market_id, _ in ranked]))}
+    results = [records[market_id] for market_id, _ in ranked if market_id in records]
+    return Response(serialize.dumps(results), status=200, mimetype="application/json")
+
+# 🟢 GET: Server-sent stream of coalesced price and trade deltas
+@market_bp.route('/markets/stream', methods=['GET'])
+@limiter.limit("30 per minute")
+def stream_markets():
+    market_ids = None
+    if request.args.get("markets"):
+        try:
+            market_ids = [int(m) for m in request.args["markets"].split(",")]
+        except ValueError:
+            return jsonify({"error": "markets must be a comma-separated list of ids"}), 400
+
+    # Each stream holds a server thread until the client goes away
+    if not price_feed.reserve():
+        return jsonify({"error": "Too many open price streams, retry shortly"}), 503, {"Retry-After": "30"}
+    response = Response(
+        price_feed.subscribe(market_ids),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    response.call_on_close(price_feed.release)
+    return response
+
+# 🟢 GET: OHLCV candles of a market's YES price, as columns
+@market_bp.route('/markets/<int:market_id>/candles', methods=['GET'])
+@limiter.limit("600 per minute")
+@read_only
+def get_candles(market_id):
+    interval = candles.parse_interval(request.args.get("interval", "1m"))
+    if interval is None:
+        return jsonify({"error": "interval must look like 1s, 5m, 1h or 1d"}), 400
+    if not db.session.query(Market.id).filter_by(id=market_id).first():
+        return jsonify({"error": "Market not found"}), 404
+
+    limit = min(max(request.args.get("limit", DEFAULT_CANDLES, type=int), 1), MAX_CANDLES)
+    end = request.args.get("end", int(time.time()) + 1, type=int)
+    start = request.args.get("start", end - limit * interval, type=int)
+    start = max(start, end - MAX_CANDLES * interval)
+    columns = candles.series(market_id, interval, start, end)
+
+    if request.args.get("format") == "binary":
+        response = Response(candles.to_bytes(columns), mimetype="application/octet-stream")
+        response.headers["X-Candle-Columns"] = ",".join(f"{name}:{dtype}" for name, dtype in candles.COLUMNS)
+        response.headers["X-Candle-Count"] = str(len(columns["t"]))
+        response.headers["X-Candle-Interval"] = str(interval)
+        return response
+
+    body = {"market_id": market_id, "interval": interval}
+    body.update((name, columns[name].tolist()) for name, _ in candles.COLUMNS)
+    return jsonify(body), 200
+
+
+def render_markets_page(show_resolved, quote_amount, after, limit):
+    """Query and serialize one page (every market if `limit` is None); returns (etag, body, next_cursor)."""
+    query = (select(*serialize.columns(MarketRecord), Market.shares_yes, Market.shares_no)
+             .where(Market.is_resolved == show_resolved, Market.id > after)
+             .order_by(Market.id))
+    rows = serialize.execute(query if limit is None else query.limit(limit + 1)).all()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+
+    results = [MarketRecord(*row[:-2]) for row in rows]
+
+    # Quote every LMSR market in one vectorized pass
+    amm = [i for i, market in enumerate(results) if market.pricing_mode == "lmsr"]
+    if amm:
+        yes_prices, no_prices, yes_costs, no_costs = lmsr.quote_many(
+            [rows[i].shares_yes for i in amm],
+            [rows[i].shares_no for i in amm],
+            [results[i].liquidity for i in amm],
+            quote_amount
+        )
+        for j, i in enumerate(amm):
+            results[i].outcome_yes_price = float(yes_prices[j])
+            results[i].outcome_no_price = float(no_prices[j])
+            if yes_costs is not None:
+                results[i] = QuotedMarketRecord(**vars(results[i]), quote={
+                    "amount": quote_amount,
+                    "yes_cost": float(yes_costs[j]),
+                    "no_cost": float(no_costs[j])
+                })
+
+    body = serialize.dumps(results)
+    etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+    return etag, body, next_cursor
@@ -1,51 +1,539 @@
 # flask_app/api/trade.py
-from flask import Blueprint, request, jsonify
-from flask_app.models import db, Trade, Market
-from flask_jwt_extended import jwt_required, get_jwt_identity
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from flask import Blueprint, Response, request, jsonify, current_app, g, stream_with_context
+from sqlalchemy.exc import SQLAlchemyError
+from flask_app.models import db, Trade, Market, Position, RestingOrder, User
+from flask_app.orderbook import OrderBooks, MarketHalted, TICKS, from_ticks, to_ticks
+from flask_app import lmsr
+from flask_app.cache import market_listing_cache
+from flask_app.pricefeed import price_feed
+from flask_app.positions import apply_trades
+from flask_app import candles
+from flask_app import export
+from flask_app import serialize
+from flask_app.serialize import PositionRecord, TradeRecord
+from flask_app.dbrouting import read_only
+from flask_app.metrics import TRADES, TRADE_SHARES
+from flask_app.journal import trade_journal, JournalBacklogged
+from flask_app.shards import owned, owned_batch, lock_markets
+from flask_app import ledger
+from flask_app.ledger import InsufficientBalance
+from flask_app.orders import resting_orders, OrderHeldElsewhere
+from flask_app.tokens import token_required, get_token_identity
+from flask_app.security.ratelimit import limiter, get_user_or_address
 
 trade_bp = Blueprint('trade', __name__)
 
-# 🟢 POST: Place a bet
-@trade_bp.route('/trade', methods=['POST'])
-@jwt_required()
-def place_trade():
-    data = request.json
-    user_id = get_jwt_identity()
+REQUIRED_FIELDS = ["market_id", "outcome", "amount"]
+MAX_BATCH_SIZE = 1000
 
-    required_fields = ["market_id", "outcome", "amount"]
-    if not all(field in data for field in required_fields):
-        return jsonify({"error": "Missing required fields"}), 400
 
-    market = Market.query.get(data["market_id"])
+def write_fills(fills, before_commit=None):
+    """Persist a batch of fills, move each market to its last fill price, and
+    refund the takers' price improvement.
+
+    Fills in markets resolved in the meantime are dropped: resolution has
+    already refunded their orders' escrow and set the final prices.
+    `before_commit()`, if given, runs inside the same transaction (the trade
+    journal records how far it has been applied there).
+    """
+    try:
+        # Locked, so a resolution either sees these fills or they see it
+        resolved = {market_id for market_id, is_resolved in lock_markets(
+            db.session.query(Market.id, Market.is_resolved)
+            .filter(Market.id.in_({fill.market_id for fill in fills}))
+            .order_by(Market.id)
+        ).all() if is_resolved}
+        if resolved:
+            current_app.logger.warning(f"Dropping fills for resolved markets {sorted(resolved)}")
+            fills = [fill for fill in fills if fill.market_id not in resolved]
+
+        rows = []
+        last_fill = {}
+        refunds = defaultdict(float)
+        for fill in fills:
+            rows.extend(fill.trade_rows())
+            last_fill[fill.market_id] = fill
+            if fill.refund > 0:
+                refunds[fill.taker_user_id] += fill.refund
+
+        db.session.bulk_insert_mappings(Trade, rows)
+        apply_trades(rows)
+        resting_orders.apply_fills(fills)
+        for user_id, amount in refunds.items():
+            ledger.credit(user_id, amount, "refund")
+        candles.record([(fill.market_id, fill.ts, fill.yes_price, fill.amount) for fill in fills])
+        for market_id, fill in last_fill.items():
+            Market.query.filter_by(id=market_id).update(
+                {"outcome_yes_price": fill.yes_price, "outcome_no_price": fill.no_price},
+                synchronize_session=False
+            )
+        if before_commit is not None:
+            before_commit()
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+    TRADES.labels("book").inc(len(fills))
+    TRADE_SHARES.labels("book").inc(sum(fill.amount for fill in fills))
+    market_listing_cache.invalidate()
+    for fill in fills:
+        price_feed.publish_trade(fill.market_id, "yes", fill.amount, fill.yes_price)
+    for market_id, fill in last_fill.items():
+        price_feed.publish_price(market_id, fill.yes_price, fill.no_price)
+
+
+def persist_fills(fills):
+    """Make a batch of fills durable: in the trade journal if enabled, else straight to the database."""
+    if trade_journal.enabled:
+        trade_journal.append(fills)
+    else:
+        write_fills(fills)
+
+
+order_books = OrderBooks(persist_fills)
+
+
+def check_trade(data, market):
+    """Validate one trade request against its market.
+
+    Returns ({"outcome", "amount", "price"}, None) or (None, (error, status)).
+    """
     if not market:
-        return jsonify({"error": "Market not found"}), 404
+        return None, ("Market not found", 404)
 
     if market.is_resolved:
-        return jsonify({"error": "Market is already resolved"}), 400
+        return None, ("Market is already resolved", 400)
 
     if data["outcome"] not in ["yes", "no"]:
-        return jsonify({"error": "Invalid outcome, choose 'yes' or 'no'"}), 400
+        return None, ("Invalid outcome, choose 'yes' or 'no'", 400)
+
+    # Without an explicit limit the order is priced at the market's current quote
+    default_price = market.outcome_yes_price if data["outcome"] == "yes" else market.outcome_no_price
+    try:
+        amount = float(data["amount"])
+        price = float(data.get("price", default_price))
+    except (TypeError, ValueError):
+        return None, ("Amount and price must be numbers", 400)
+
+    if amount <= 0:
+        return None, ("Amount must be positive", 400)
+    if market.pricing_mode != "lmsr":
+        if not 1 <= to_ticks(price) <= TICKS - 1:
+            return None, ("Price must be between 0.01 and 0.99", 400)
+        if abs(price * TICKS - to_ticks(price)) > 1e-6:
+            return None, ("Price must be a multiple of 0.01", 400)
+        price = from_ticks(to_ticks(price))  # exactly the price the order rests and is escrowed at
+
+    return {"outcome": data["outcome"], "amount": amount, "price": price}, None
+
+
+def apply_lmsr(market, user_id, outcome, amount):
+    """Charge the user and move a locked LMSR market's share state; returns the cost.
+
+    The cost is rounded to cents once, so the ledger debit and the trade price
+    (and from it the position's cost basis) record the same amount.
+    Raises InsufficientBalance, leaving the market untouched, if the user can't pay.
+    """
+    cost, shares_yes, shares_no = lmsr.trade_cost(
+        market.shares_yes, market.shares_no, market.liquidity, outcome, amount
+    )
+    paid = float(ledger.debit(user_id, cost, "trade"))
+    market.shares_yes, market.shares_no = shares_yes, shares_no
+    market.outcome_yes_price = lmsr.price_yes(market.shares_yes, market.shares_no, market.liquidity)
+    market.outcome_no_price = 1.0 - market.outcome_yes_price
+    return paid
 
-    price = market.outcome_yes_price if data["outcome"] == "yes" else market.outcome_no_price
 
+def place_lmsr_trade(market_id, user_id, outcome, amount):
+    """Buy `amount` shares from the market maker at the LMSR cost.
+
+    The market row is locked for the read-modify-write of its share state,
+    unless this process is the market's shard owner and so its only writer.
+    """
+    market = lock_markets(Market.query).populate_existing().get(market_id)
+    try:
+        paid = apply_lmsr(market, user_id, outcome, amount)
+    except InsufficientBalance:
+        db.session.rollback()  # release the market lock
+        raise
+
+    executed = time.time()
     new_trade = Trade(
         user_id=user_id,
-        market_id=data["market_id"],
-        outcome=data["outcome"],
-        amount=data["amount"],
-        price=price
+        market_id=market_id,
+        outcome=outcome,
+        amount=amount,
+        price=paid / amount,  # average price paid per share
+        created_at=_utc(executed)
     )
-
     db.session.add(new_trade)
+    apply_trades([{"user_id": user_id, "market_id": market_id, "outcome": outcome,
+                   "amount": amount, "price": new_trade.price}])
+    candles.record([_candle_point(market_id, executed, outcome, new_trade.price, amount)])
     db.session.commit()
+    TRADES.labels("lmsr").inc()
+    TRADE_SHARES.labels("lmsr").inc(amount)
+    market_listing_cache.invalidate()
+    price_feed.publish_trade(market_id, outcome, amount, new_trade.price)
+    price_feed.publish_price(market_id, market.outcome_yes_price, market.outcome_no_price)
+    return new_trade, paid
+
+
+def place_order(user_id, market_id, trade):
+    """Escrow the order's limit cost and store it, commit, then match it.
+
+    Returns (order, fills, ticket). Nothing reaches the book unless the escrow
+    has committed; fills execute at the resting order's price, never worse
+    than our limit, and the difference is refunded when they are written.
+    Raises InsufficientBalance or SQLAlchemyError (rolled back, book untouched)
+    and MarketHalted (escrow refunded).
+    """
+    row = resting_orders.open(user_id, market_id, trade)
+    try:
+        db.session.flush()
+        order_id = row.id
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+    return resting_orders.submit(order_id, user_id, market_id, trade)
+
+
+def _utc(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+
+
+def _candle_point(market_id, ts, outcome, price, amount):
+    # Candles chart the YES price; a NO buy at p implies YES at 1 - p
+    return market_id, ts, price if outcome == "yes" else 1.0 - price, amount
+
+
+def backlogged_response(error):
+    """503 with Retry-After while the trade journal is too far ahead of the database."""
+    return jsonify({"error": "Trading is busy, please retry shortly"}), 503, {"Retry-After": str(error.retry_after)}
+
+
+def fills_pending_response(error, **body):
+    """503 when matched fills could not be saved (database or journal write failed).
+
+    The orders and their escrow are committed and the fills stay queued: the
+    next flush (another order, or the owner sweep) retries them. If this
+    process dies first, its orders are restored unfilled, escrow intact.
+    """
+    db.session.rollback()
+    current_app.logger.error(f"Fills could not be saved: {str(error)}")
+    body["error"] = "Order placed, but its fills could not be saved yet; they will be retried"
+    return jsonify(body), 503
+
+
+def _market_key(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _posted_market(kwargs):
+    data = request.get_json(silent=True)
+    return _market_key(data.get("market_id")) if isinstance(data, dict) else None
+
+
+def _order_market(kwargs):
+    return db.session.query(RestingOrder.market_id).filter_by(id=kwargs["order_id"]).scalar()
+
+
+def _item_market(item):
+    return _market_key(item.get("market_id")) if isinstance(item, dict) else None
+
+# 🟢 POST: Place a bet (limit order matched against the market's order book)
+@trade_bp.route('/trade', methods=['POST'])
+@token_required
+@limiter.limit("120 per minute", key_func=get_user_or_address)
+@owned(_posted_market)
+def place_trade():
+    data = request.json
+    user_id = get_token_identity()
+
+    if not all(field in data for field in REQUIRED_FIELDS):
+        return jsonify({"error": "Missing required fields"}), 400
+
+    market = Market.query.get(data["market_id"])
+    trade, error = check_trade(data, market)
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+    g.capture_amount = trade["amount"]
+
+    if market.pricing_mode == "lmsr":
+        try:
+            new_trade, paid = place_lmsr_trade(market.id, user_id, trade["outcome"], trade["amount"])
+        except InsufficientBalance:
+            return jsonify({"error": "Insufficient balance"}), 402
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            current_app.logger.error(f"Database error: {str(e)}")
+            return jsonify({"error": "Trade could not be recorded"}), 500
+        return jsonify(dict(new_trade.to_dict(), cost=paid)), 201
+
+    try:
+        trade_journal.throttle()
+        order, fills, ticket = place_order(user_id, market.id, trade)
+    except InsufficientBalance:
+        db.session.rollback()
+        return jsonify({"error": "Insufficient balance"}), 402
+    except MarketHalted:
+        return jsonify({"error": "Market is being resolved"}), 409
+    except JournalBacklogged as e:
+        return backlogged_response(e)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.error(f"Database error: {str(e)}")
+        return jsonify({"error": "Trade could not be recorded"}), 500
+
+    try:
+        if ticket:
+            order_books.batcher.flush(ticket)
+    except (SQLAlchemyError, OSError) as e:
+        return fills_pending_response(e, order=order.to_dict())
+
+    return jsonify({
+        "order": order.to_dict(),
+        "fills": [fill.to_dict() for fill in fills]
+    }), 201
+
+# 🟢 POST: Place many bets with one market lookup and one commit before matching
+@trade_bp.route('/trades/batch', methods=['POST'])
+@token_required
+@limiter.limit("30 per minute", key_func=get_user_or_address)
+@owned_batch(_item_market, MAX_BATCH_SIZE)
+def place_trades_batch():
+    data = request.json
+    user_id = get_token_identity()
+
+    items = data.get("trades") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Expected a non-empty list of trades"}), 400
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} trades per batch"}), 413
+
+    try:
+        trade_journal.throttle()
+    except JournalBacklogged as e:
+        return backlogged_response(e)
+
+    market_ids = {_market_key(item.get("market_id")) for item in items if isinstance(item, dict)}
+    market_ids.discard(None)
+    markets = {m.id: m for m in Market.query.filter(Market.id.in_(market_ids)).all()}
+    amm_ids = [m.id for m in markets.values() if m.pricing_mode == "lmsr" and not m.is_resolved]
+    if amm_ids:
+        locked = lock_markets(Market.query).populate_existing().filter(Market.id.in_(amm_ids)).all()
+        markets.update((m.id, m) for m in locked)
+
+    results = []
+    rows = []
+    points = []
+    orders = []  # (index, order row, trade), matched once their escrow has committed
+    ticket = 0
+    executed = time.time()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not all(field in item for field in REQUIRED_FIELDS):
+            results.append({"index": index, "status": 400, "error": "Missing required fields"})
+            continue
+
+        market = markets.get(_market_key(item["market_id"]))
+        trade, error = check_trade(item, market)
+        if error:
+            results.append({"index": index, "status": error[1], "error": error[0]})
+            continue
+        g.capture_amount = g.get('capture_amount', 0.0) + trade["amount"]
+
+        if market.pricing_mode == "lmsr":
+            try:
+                paid = apply_lmsr(market, user_id, trade["outcome"], trade["amount"])
+            except InsufficientBalance:
+                results.append({"index": index, "status": 402, "error": "Insufficient balance"})
+                continue
+            row = {
+                "user_id": user_id,
+                "market_id": market.id,
+                "outcome": trade["outcome"],
+                "amount": trade["amount"],
+                "price": paid / trade["amount"],
+                "created_at": _utc(executed)
+            }
+            rows.append(row)
+            points.append(_candle_point(market.id, executed, row["outcome"], row["price"], row["amount"]))
+            results.append({"index": index, "status": 201, "cost": paid,
+                            "trade": dict(row, created_at=row["created_at"].isoformat())})
+        else:
+            try:
+                orders.append((index, resting_orders.open(user_id, market.id, trade), trade))
+            except InsufficientBalance:
+                results.append({"index": index, "status": 402, "error": "Insufficient balance"})
+
+    try:
+        if rows:
+            db.session.bulk_insert_mappings(Trade, rows)
+            apply_trades(rows)
+            candles.record(points)
+        db.session.flush()
+        orders = [(index, row.id, row.market_id, trade) for index, row, trade in orders]
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.error(f"Database error: {str(e)}")
+        return jsonify({"error": "Trades could not be recorded"}), 500
+
+    if rows:
+        TRADES.labels("lmsr").inc(len(rows))
+        TRADE_SHARES.labels("lmsr").inc(sum(row["amount"] for row in rows))
+        market_listing_cache.invalidate()
+        for row in rows:
+            price_feed.publish_trade(row["market_id"], row["outcome"], row["amount"], row["price"])
+        for market_id in amm_ids:
+            market = markets[market_id]
+            price_feed.publish_price(market_id, market.outcome_yes_price, market.outcome_no_price)
+
+    # Escrow is committed; only now may the orders match
+    for index, order_id, market_id, trade in orders:
+        try:
+            order, fills, order_ticket = resting_orders.submit(order_id, user_id, market_id, trade)
+        except MarketHalted:
+            results.append({"index": index, "status": 409, "error": "Market is being resolved"})
+            continue
+        ticket = max(ticket, order_ticket)
+        results.append({
+            "index": index,
+            "status": 201,
+            "order": order.to_dict(),
+            "fills": [fill.to_dict() for fill in fills]
+        })
+    results.sort(key=lambda result: result["index"])
+
+    try:
+        if ticket:
+            order_books.batcher.flush(ticket)
+    except (SQLAlchemyError, OSError) as e:
+        return fills_pending_response(e, results=results)
+
+    return jsonify({"results": results}), 200
+
+# 🟢 GET: Order book depth for a market
+@trade_bp.route('/book/<int:market_id>', methods=['GET'])
+@limiter.limit("600 per minute")
+@owned(lambda kwargs: kwargs["market_id"])
+def get_order_book(market_id):
+    book = order_books.get(market_id)
+    if not book:
+        return jsonify({"market_id": market_id, "bids": [], "asks": [], "last_price": None}), 200
+    return jsonify(book.snapshot()), 200
+
+
+# 🟢 DELETE: Cancel a resting order and refund its unfilled escrow
+@trade_bp.route('/orders/<int:order_id>', methods=['DELETE'])
+@token_required
+@limiter.limit("120 per minute", key_func=get_user_or_address)
+@owned(_order_market)
+def cancel_order(order_id):
+    user_id = get_token_identity()
+    row = db.session.get(RestingOrder, order_id)
+    if row is None or row.user_id != user_id:
+        return jsonify({"error": "Order not found"}), 404
+    if row.status != "open":
+        return jsonify({"error": f"Order is already {row.status}"}), 409
+
+    try:
+        refund = resting_orders.cancel(row)
+    except OrderHeldElsewhere:
+        return jsonify({"error": "Order is held by another worker, retry shortly"}), 409
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.error(f"Database error: {str(e)}")
+        return jsonify({"error": "Order could not be cancelled"}), 500
+    if refund is None:
+        return jsonify({"error": "Order is already filled"}), 409
+    return jsonify({"id": order_id, "status": "cancelled", "refund": float(refund)}), 200
 
-    return jsonify(new_trade.to_dict()), 201
 
 # 🟢 GET: Fetch all bets by user
 @trade_bp.route('/trade', methods=['GET'])
-@jwt_required()
+@token_required
+@read_only
 def get_trades():
-    user_id = get_jwt_identity()
-    trades = Trade.query.filter_by(user_id=user_id).all()
-    
-    return jsonify([trade.to_dict() for trade in trades]), 200
+    user_id = get_token_identity()
+    records = serialize.iter_records(TradeRecord, Trade.user_id == user_id, order_by=Trade.id)
+
+    # Streamed a chunk at a time: a user's trade history is unbounded
+    return Response(stream_with_context(serialize.stream_array(records)), mimetype="application/json")
+
+# 🟢 GET: Stream the user's trades/transactions (or all markets) as CSV, Arrow or Parquet
+@trade_bp.route('/export/<table>', methods=['GET'])
+@token_required
+@limiter.limit("10 per hour", key_func=get_user_or_address)
+@read_only
+def export_table(table):
+    fmt = request.args.get("format", "csv")
+    if table not in export.EXPORTS:
+        return jsonify({"error": f"table must be one of {sorted(export.EXPORTS)}"}), 404
+    if fmt not in export.FORMATS:
+        return jsonify({"error": f"format must be one of {list(export.FORMATS)}"}), 400
+
+    try:
+        chunks = export.export(table, fmt, user_id=get_token_identity())
+    except export.FormatUnavailable as e:
+        return jsonify({"error": str(e)}), 501
+    filename = f"{table}.{export.EXTENSIONS[fmt]}"
+    return Response(
+        stream_with_context(chunks),
+        mimetype=export.MIMETYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# 🟢 GET: Current cash balance (a single row, kept current by the ledger)
+@trade_bp.route('/balance', methods=['GET'])
+@token_required
+def get_balance():
+    user_id = get_token_identity()
+    balance = db.session.query(User.balance).filter_by(id=user_id).scalar()
+
+    return jsonify({"balance": float(balance or 0)}), 200
+
+# 🟢 GET: Net holdings per market and outcome for the user
+@trade_bp.route('/positions', methods=['GET'])
+@token_required
+@read_only
+def get_positions():
+    user_id = get_token_identity()
+    positions = serialize.select_records(PositionRecord, Position.user_id == user_id)
+
+    return Response(serialize.dumps(positions), status=200, mimetype="application/json")
+
+# 🟢 GET: Mark-to-market P&L of the user's positions at current prices
+@trade_bp.route('/pnl', methods=['GET'])
+@token_required
+@read_only
+def get_pnl():
+    user_id = get_token_identity()
+    rows = (db.session.query(Position, Market.outcome_yes_price, Market.outcome_no_price)
+            .join(Market, Market.id == Position.market_id)
+            .filter(Position.user_id == user_id)
+            .all())
+
+    positions = []
+    total_cost = total_value = 0.0
+    for position, yes_price, no_price in rows:
+        mark = yes_price if position.outcome == "yes" else no_price
+        value = position.shares * mark
+        total_cost += position.cost_basis
+        total_value += value
+        positions.append(dict(position.to_dict(), mark_price=mark, market_value=value,
+                              unrealized_pnl=value - position.cost_basis))
+
+    return jsonify({
+        "positions": positions,
+        "cost_basis": total_cost,
+        "market_value": total_value,
+        "unrealized_pnl": total_value - total_cost
+    }), 200
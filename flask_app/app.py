@@ -1,13 +1,30 @@
 #app.py
+import click
 from flask import Flask, render_template
 from dotenv import load_dotenv
+import json
 import os
+import time
 from flask_migrate import Migrate
 from flask_app.api.auth import auth_bp  # Import the auth blueprint from the 'api' folder
 from flask_app.models import db  # Import the database instance
 from flask_app.api.market import market_bp  # Import the market blueprint
-from flask_app.api.trade import trade_bp  # Import the trade blueprint
-from flask_jwt_extended import JWTManager
+from flask_app.api.trade import trade_bp, write_fills, order_books  # Import the trade blueprint
+from flask_app.tokens import token_service
+from flask_app.ledger import snapshot_balances
+from flask_app import candles, export
+from flask_app.security.capture import request_capture
+from flask_app.security.anomaly import anomaly_detector
+from flask_app.security.ratelimit import limiter, default_storage_uri
+from flask_app.security.firewall import firewall
+from flask_app import dbrouting
+from flask_app.metrics import metrics
+from flask_app.journal import trade_journal
+from flask_app.queryprofile import query_profiler, format_report
+from flask_app.shards import market_shards, run_owners
+from flask_app.search import market_search
+from flask_app.pricefeed import price_feed
+from flask_app.orders import resting_orders
 
 # Load environment variables from .env file
 load_dotenv()
@@ -17,7 +34,23 @@ app = Flask(__name__)
 # PostgreSQL Database URI and configuration
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Connection pools (ignored for SQLite) and read replicas for @read_only endpoints
+app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 10))
+app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 20))
+app.config['DB_POOL_TIMEOUT'] = float(os.getenv('DB_POOL_TIMEOUT', 30))
+app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 1800))
+app.config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', 'true').lower() != 'false'
+app.config['DATABASE_REPLICA_URLS'] = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+app.config['MAX_REPLICA_LAG'] = float(os.getenv('MAX_REPLICA_LAG', 5))  # Seconds; staler replicas are skipped
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')
+app.config['JWT_ISSUER'] = os.getenv('JWT_ISSUER', 'your-app-name')
+app.config['JWT_AUDIENCE'] = os.getenv('JWT_AUDIENCE', 'your-app-client')
+app.config['JWT_ACCESS_TOKEN_EXPIRES'] = int(os.getenv('JWT_ACCESS_TOKEN_EXPIRES', 3600))
+app.config['JWT_REVOCATION_RESYNC'] = float(os.getenv('JWT_REVOCATION_RESYNC', 60))  # Seconds between full re-reads of revoked tokens
+
+app.config['STARTING_BALANCE'] = os.getenv('STARTING_BALANCE', '1000.00')  # Play money granted on signup
+app.config['CANDLE_1S_RETENTION'] = int(os.getenv('CANDLE_1S_RETENTION', 2 * 86400))  # Seconds of 1s candles kept by prune-candles
 
 app.config['DEBUG'] = True  # Run to check error mode DELETE for PRODCUTION
 
@@ -30,18 +63,130 @@ app.config.update(
     REMEMBER_COOKIE_HTTPONLY=True
 )
 
+# Write-behind trade journal: set a local directory to acknowledge order book fills once fsync'd there
+# and apply them to the database in the background, at most TRADE_JOURNAL_MAX_LAG seconds behind
+app.config['TRADE_JOURNAL_DIR'] = os.getenv('TRADE_JOURNAL_DIR')
+app.config['TRADE_JOURNAL_MAX_LAG'] = float(os.getenv('TRADE_JOURNAL_MAX_LAG', 2))
+app.config['TRADE_JOURNAL_DRAIN_BATCH'] = int(os.getenv('TRADE_JOURNAL_DRAIN_BATCH', 5000))
+
+# Resting orders: each process holding order books heartbeats every ORDER_OWNER_HEARTBEAT seconds;
+# the open orders of one silent for ORDER_OWNER_TIMEOUT seconds are taken over by another process
+app.config['ORDER_OWNER_HEARTBEAT'] = float(os.getenv('ORDER_OWNER_HEARTBEAT', 5))
+app.config['ORDER_OWNER_TIMEOUT'] = float(os.getenv('ORDER_OWNER_TIMEOUT', 30))
+
+# Price stream (SSE): each open stream holds a server thread or greenlet. The default suits an async worker
+# (gunicorn with gevent); under waitress keep it below --threads. Past the cap the page falls back to polling
+app.config['PRICE_FEED_MAX_SUBSCRIBERS'] = int(os.getenv('PRICE_FEED_MAX_SUBSCRIBERS', 1000))
+
+# Market search index: seconds before a worker picks up markets created by other workers, and between
+# full checks for markets a refresh missed (committed out of id order)
+app.config['MARKET_SEARCH_REFRESH'] = float(os.getenv('MARKET_SEARCH_REFRESH', 1))
+app.config['MARKET_SEARCH_RESYNC'] = float(os.getenv('MARKET_SEARCH_RESYNC', 300))
+
+# Market shards: with MARKET_SHARDS=N, trades, order books and resolution for a market run in one of
+# N owner processes (`flask market-shards`), reached over Unix sockets in MARKET_SHARD_DIR
+app.config['MARKET_SHARDS'] = int(os.getenv('MARKET_SHARDS', 0))
+app.config['MARKET_SHARD_DIR'] = os.getenv('MARKET_SHARD_DIR')  # Defaults to <instance>/shards
+app.config['MARKET_SHARD_TIMEOUT'] = float(os.getenv('MARKET_SHARD_TIMEOUT', 30))
+
+# Prometheus metrics at /metrics; set a shared directory when running several worker processes
+app.config['METRICS_MULTIPROC_DIR'] = os.getenv('METRICS_MULTIPROC_DIR') or os.getenv('PROMETHEUS_MULTIPROC_DIR')
+# Comma-separated CIDRs allowed to scrape /metrics (loopback only by default; add the Prometheus host's network)
+app.config['METRICS_ALLOWED_NETWORKS'] = os.getenv('METRICS_ALLOWED_NETWORKS', '127.0.0.0/8,::1/128')
+
+# SQL profiler: sample rate (default 1.0 in debug, 0.01 otherwise), slow query and N+1 thresholds,
+# report directory (defaults to <instance>/query_profile)
+app.config['QUERY_PROFILE_SAMPLE_RATE'] = os.getenv('QUERY_PROFILE_SAMPLE_RATE')
+app.config['QUERY_PROFILE_SLOW_MS'] = float(os.getenv('QUERY_PROFILE_SLOW_MS', 100))
+app.config['QUERY_PROFILE_N_PLUS_ONE'] = int(os.getenv('QUERY_PROFILE_N_PLUS_ONE', 5))
+app.config['QUERY_PROFILE_DIR'] = os.getenv('QUERY_PROFILE_DIR')
+
+# Request capture for the SIEM (defaults to <instance>/request_logs)
+app.config['REQUEST_LOG_DIR'] = os.getenv('REQUEST_LOG_DIR')
+
+# Rate limit counters: shm://<path> (all workers on this host, default <instance>/ratelimit.shm),
+# redis://host:port/db (shared across hosts) or memory:// (single process; the default without fcntl)
+app.config['RATELIMIT_STORAGE_URI'] = os.getenv('RATELIMIT_STORAGE_URI') or default_storage_uri(app.instance_path)
+app.config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', 'true').lower() != 'false'
+
+# Firewall rules (JSON, hot-reloaded; defaults to <instance>/firewall.json)
+app.config['FIREWALL_RULES_PATH'] = os.getenv('FIREWALL_RULES_PATH')
+
 # Register blueprints with unique prefixes
 app.register_blueprint(auth_bp, url_prefix='/api/auth')  # Auth Blueprint
 app.register_blueprint(market_bp, url_prefix='/api/market')  # Market Blueprint 
 app.register_blueprint(trade_bp, url_prefix='/api/trade')  # Trade Blueprint 
 
 # Initialize the database with the Flask app
+dbrouting.configure(app)
 db.init_app(app)
-jwt = JWTManager(app)
+dbrouting.replica_monitor.init_app(app)
+with app.app_context():
+    dbrouting.name_pools(db)
+metrics.init_app(app)
+query_profiler.init_app(app)
+token_service.init_app(app)
+request_capture.init_app(app)
+request_capture.add_listener(anomaly_detector.consume)
+limiter.init_app(app)
+firewall.init_app(app)
+trade_journal.init_app(app, write_fills)
+market_shards.init_app(app)
+market_search.init_app(app)
+price_feed.init_app(app)
+resting_orders.init_app(app, order_books)
 
 # Initialize Flask-Migrate
 migrate = Migrate(app, db)
 
+@app.cli.command('snapshot-balances')
+def snapshot_balances_command():
+    """Snapshot user balances against the transaction ledger."""
+    print(f"Snapshotted {snapshot_balances()} balances")
+
+@app.cli.command('prune-candles')
+def prune_candles_command():
+    """Delete 1s candles older than CANDLE_1S_RETENTION seconds."""
+    older_than = int(time.time()) - app.config['CANDLE_1S_RETENTION']
+    print(f"Pruned {candles.prune(1, older_than)} candles")
+
+@app.cli.command('export')
+@click.argument('table', type=click.Choice(sorted(export.EXPORTS)))
+@click.option('--format', 'fmt', type=click.Choice(export.FORMATS), default='csv')
+@click.option('--out', type=click.Path(dir_okay=False), required=True)
+@click.option('--chunk-size', type=int, default=export.DEFAULT_CHUNK_SIZE)
+def export_command(table, fmt, out, chunk_size):
+    """Stream a whole table to a CSV, Arrow or Parquet file."""
+    try:
+        chunks = export.export(table, fmt, chunk_size)
+    except export.FormatUnavailable as e:
+        raise click.ClickException(str(e))
+    written = 0
+    with open(out, 'wb') as output:
+        for chunk in chunks:
+            output.write(chunk)
+            written += len(chunk)
+    print(f"Wrote {written:,} bytes to {out}")
+
+@app.cli.command('query-report')
+@click.option('--top', type=int, default=10, help='Statements listed per endpoint')
+@click.option('--json', 'as_json', is_flag=True, help='Print the merged report as JSON')
+@click.option('--reset', is_flag=True, help='Clear the collected reports afterwards')
+def query_report_command(top, as_json, reset):
+    """Print the SQL profile (N+1 patterns, slow queries) per endpoint."""
+    report = query_profiler.load()
+    print(json.dumps(report, indent=2) if as_json else format_report(report, top))
+    if reset:
+        query_profiler.reset()
+
+@app.cli.command('market-shards')
+def market_shards_command():
+    """Run the MARKET_SHARDS market owner processes until interrupted."""
+    if not market_shards.count:
+        raise click.UsageError('Set MARKET_SHARDS to the number of owner processes')
+    print(f"Starting {market_shards.count} market shards in {market_shards.directory}")
+    run_owners(app, market_shards.count)
+
 # Home route to test database connectivity
 #@app.route('/')
 #def home():
@@ -62,4 +207,5 @@ def market():
     return render_template('market.html')
 
 if __name__ == '__main__':
+    resting_orders.ensure_started()
     app.run(debug=True)
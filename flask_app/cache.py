@@ -0,0 +1,68 @@
+# flask_app/cache.py
+"""Small in-process read-through cache with TTL and LRU eviction.
+
+Each worker process keeps its own copy, so the TTL bounds how stale another
+process can be after a write; `invalidate()` drops everything in this process
+immediately. A generation counter keeps a slow reader that started before an
+invalidation from storing its (now stale) result afterwards.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    def __init__(self, maxsize=256, ttl=5.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def get_or_set(self, key, build):
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        generation = self._generation
+        value = build()
+        with self._lock:
+            if generation == self._generation:
+                self._data[key] = (time.monotonic() + self.ttl, value)
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+        return value
+
+    @property
+    def generation(self):
+        """Bumped by every `invalidate()`."""
+        return self._generation
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Rendered GET /api/market/markets pages, invalidated on market and price writes
+market_listing_cache = TTLCache(
+    maxsize=int(os.getenv('MARKET_CACHE_SIZE', 256)),
+    ttl=float(os.getenv('MARKET_CACHE_TTL', 5))
+)
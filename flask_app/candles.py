@@ -0,0 +1,148 @@
+# flask_app/candles.py
+"""Pre-aggregated OHLCV candles of each market's YES price.
+
+Every code path that records trades also calls `record` with one
+(market_id, ts, yes_price, volume) point per execution before committing, and
+the points are folded into 1s, 1m and 1h candles with one upsert per batch.
+Chart queries read candles only: any interval is served from the widest
+stored resolution that divides it and downsampled in NumPy, so a month of
+hourly bars is ~720 rows no matter how many trades made them.
+"""
+import re
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy import case
+from sqlalchemy.dialects import postgresql, sqlite
+
+from flask_app.models import db, Candle
+
+RESOLUTIONS = (1, 60, 3600)
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+INTERVAL_REGEX = re.compile(r'^(\d+)([smhd])$')
+# Columns of a candle series, in order, with their binary encoding
+COLUMNS = (("t", "<i8"), ("o", "<f8"), ("h", "<f8"), ("l", "<f8"), ("c", "<f8"), ("v", "<f8"), ("n", "<i8"))
+
+_UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def parse_interval(value):
+    """'15s', '5m', '4h', '1d' or plain seconds -> seconds, or None if invalid."""
+    value = str(value).strip().lower()
+    if value.isdigit():
+        seconds = int(value)
+    else:
+        match = INTERVAL_REGEX.match(value)
+        if not match:
+            return None
+        seconds = int(match.group(1)) * UNITS[match.group(2)]
+    return seconds if seconds > 0 else None
+
+
+def record(points):
+    """Fold (market_id, ts, yes_price, volume) points into candles in the
+    current transaction."""
+    points = sorted(points, key=lambda point: point[1])
+    if not points:
+        return
+    candles = OrderedDict()
+    for market_id, ts, price, volume in points:
+        for resolution in RESOLUTIONS:
+            bucket = int(ts // resolution) * resolution
+            candle = candles.get((market_id, resolution, bucket))
+            if candle is None:
+                candles[(market_id, resolution, bucket)] = [price, price, price, price, volume, 1]
+            else:
+                candle[1] = max(candle[1], price)
+                candle[2] = min(candle[2], price)
+                candle[3] = price
+                candle[4] += volume
+                candle[5] += 1
+
+    values = [{"market_id": market_id, "resolution": resolution, "bucket": bucket,
+               "open": o, "high": h, "low": l, "close": c, "volume": v, "trades": n}
+              for (market_id, resolution, bucket), (o, h, l, c, v, n) in candles.items()]
+
+    insert = _UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+    if insert is None:
+        _record_one_by_one(values)
+        return
+
+    table = Candle.__table__
+    stmt = insert(table)
+    excluded = stmt.excluded
+    # Batches are committed in time order, so the stored open stands and the new close wins
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.market_id, table.c.resolution, table.c.bucket],
+        set_={"high": case((excluded.high > table.c.high, excluded.high), else_=table.c.high),
+              "low": case((excluded.low < table.c.low, excluded.low), else_=table.c.low),
+              "close": excluded.close,
+              "volume": table.c.volume + excluded.volume,
+              "trades": table.c.trades + excluded.trades}
+    )
+    db.session.execute(stmt, values)
+
+
+def _record_one_by_one(values):
+    # Portable fallback for databases without INSERT ... ON CONFLICT
+    for value in values:
+        candle = Candle.query.filter_by(
+            market_id=value["market_id"], resolution=value["resolution"], bucket=value["bucket"]
+        ).with_for_update().first()
+        if candle is None:
+            db.session.add(Candle(**value))
+        else:
+            candle.high = max(candle.high, value["high"])
+            candle.low = min(candle.low, value["low"])
+            candle.close = value["close"]
+            candle.volume += value["volume"]
+            candle.trades += value["trades"]
+
+
+def series(market_id, interval, start, end):
+    """Candles of `interval` seconds with bucket start in [start, end), as
+    columns (dict of NumPy arrays keyed like COLUMNS). Empty buckets are omitted."""
+    base = max(resolution for resolution in RESOLUTIONS if interval % resolution == 0)
+    start = start // interval * interval
+    rows = (db.session.query(Candle.bucket, Candle.open, Candle.high, Candle.low,
+                             Candle.close, Candle.volume, Candle.trades)
+            .filter(Candle.market_id == market_id, Candle.resolution == base,
+                    Candle.bucket >= start, Candle.bucket < end)
+            .order_by(Candle.bucket)
+            .all())
+    if not rows:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS}
+
+    t, o, h, l, c, v, n = (np.asarray(column) for column in zip(*rows))
+    t = t.astype(np.int64)
+    n = n.astype(np.int64)
+    if base == interval:
+        return {"t": t, "o": o, "h": h, "l": l, "c": c, "v": v, "n": n}
+
+    # Downsample: rows are sorted, so each output bucket is a contiguous run
+    buckets = t // interval * interval
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)] - 1
+    return {
+        "t": buckets[starts],
+        "o": o[starts],
+        "h": np.maximum.reduceat(h, starts),
+        "l": np.minimum.reduceat(l, starts),
+        "c": c[ends],
+        "v": np.add.reduceat(v, starts),
+        "n": np.add.reduceat(n, starts)
+    }
+
+
+def to_bytes(columns):
+    """Columns back to back, each little-endian as declared in COLUMNS."""
+    return b"".join(np.ascontiguousarray(columns[name], dtype=dtype).tobytes() for name, dtype in COLUMNS)
+
+
+def prune(resolution, older_than):
+    """Delete `resolution` candles whose bucket starts before `older_than` (epoch seconds)."""
+    deleted = (Candle.query
+               .filter(Candle.resolution == resolution, Candle.bucket < older_than)
+               .delete(synchronize_session=False))
+    db.session.commit()
+    return deleted
@@ -0,0 +1,232 @@
+# flask_app/dbrouting.py
+"""Engine pooling, read-replica routing and pool-wait timing.
+
+`engine_options` turns the DB_POOL_* settings into SQLAlchemy engine options
+for the primary and every replica. Replicas are listed in
+DATABASE_REPLICA_URLS and registered as binds named replica0, replica1, ...
+
+Endpoints decorated with `@read_only` have their queries routed by
+`RoutingSession` to one replica per request, as long as that replica's
+replication lag is within MAX_REPLICA_LAG seconds; lag is measured at most
+every REPLICA_LAG_CHECK_INTERVAL seconds. Writes, SELECT ... FOR UPDATE and
+everything after the session's first write go to the primary, so a request
+always reads its own writes. With no healthy replica everything falls back
+to the primary.
+
+Pools are `TimedQueuePool`s, which add the time each checkout spent waiting
+for a free connection to the request. The total and the route taken are
+reported in a Server-Timing header.
+"""
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.selectable import Select
+
+from flask_app.metrics import DB_POOL_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+REPLICA_PREFIX = "replica"
+POSTGRES_LAG_SQL = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class PoolStats:
+    """Process-wide checkout wait totals per pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pools = {}
+
+    def record(self, name, waited):
+        with self._lock:
+            stats = self.pools.setdefault(name, {"checkouts": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0})
+            stats["checkouts"] += 1
+            stats["wait_seconds"] += waited
+            stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(stats) for name, stats in self.pools.items()}
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            name = getattr(self, "_name", "primary")
+            pool_stats.record(name, waited)
+            DB_POOL_WAIT_SECONDS.labels(name).observe(waited)
+            if has_request_context():
+                g.db_pool_wait = g.get('db_pool_wait', 0.0) + waited
+
+    def recreate(self):
+        pool = super().recreate()
+        pool._name = getattr(self, "_name", "primary")
+        return pool
+
+
+def engine_options(url, config, name="primary"):
+    """Pool settings for one engine; SQLite keeps the defaults Flask-SQLAlchemy picks."""
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": int(config.get('DB_POOL_SIZE', 10)),
+        "max_overflow": int(config.get('DB_MAX_OVERFLOW', 20)),
+        "pool_timeout": float(config.get('DB_POOL_TIMEOUT', 30)),
+        "pool_recycle": int(config.get('DB_POOL_RECYCLE', 1800)),
+        "pool_pre_ping": bool(config.get('DB_POOL_PRE_PING', True)),
+        "logging_name": name,
+    }
+
+
+def configure(app):
+    """Fill SQLALCHEMY_ENGINE_OPTIONS/BINDS from the pool and replica settings (before db.init_app)."""
+    config = app.config
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(config['SQLALCHEMY_DATABASE_URI'] or "", config)
+    binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+    for i, url in enumerate(config.get('DATABASE_REPLICA_URLS') or []):
+        name = f"{REPLICA_PREFIX}{i}"
+        binds[name] = dict(engine_options(url, config, name), url=url)
+    config['SQLALCHEMY_BINDS'] = binds
+    app.after_request(_report_timing)
+
+
+def name_pools(db):
+    """Label each engine's pool for `pool_stats` (call inside an app context after db.init_app)."""
+    for key, engine in db.engines.items():
+        engine.pool._name = key or "primary"
+
+
+class ReplicaMonitor:
+    def __init__(self, max_lag=5.0, check_interval=5.0):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag = {}  # bind key -> seconds behind, None if unreachable
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._round_robin = itertools.count()
+
+    def init_app(self, app):
+        self.max_lag = float(app.config.get('MAX_REPLICA_LAG', self.max_lag))
+        self.check_interval = float(app.config.get('REPLICA_LAG_CHECK_INTERVAL', self.check_interval))
+
+    def healthy(self, engines):
+        now = time.monotonic()
+        if now - self._checked > self.check_interval and self._lock.acquire(blocking=False):
+            try:
+                self._checked = now
+                self._measure(engines)
+            finally:
+                self._lock.release()
+        return [key for key, lag in sorted(self.lag.items()) if lag is not None and lag <= self.max_lag]
+
+    def _measure(self, engines):
+        for key, engine in engines.items():
+            if not (key or "").startswith(REPLICA_PREFIX):
+                continue
+            try:
+                with engine.connect() as connection:
+                    if engine.dialect.name == "postgresql":
+                        lag = float(connection.execute(POSTGRES_LAG_SQL).scalar() or 0.0)
+                    else:
+                        connection.execute(text("SELECT 1"))
+                        lag = 0.0
+            except SQLAlchemyError as error:
+                logger.warning("Replica %s unavailable: %s", key, error)
+                lag = None
+            if lag is not None and lag > self.max_lag and (self.lag.get(key) or 0.0) <= self.max_lag:
+                logger.warning("Replica %s is %.1fs behind; reading from the primary", key, lag)
+            self.lag[key] = lag
+
+    def choose(self, engines):
+        healthy = self.healthy(engines)
+        if not healthy:
+            return None
+        return healthy[next(self._round_robin) % len(healthy)]
+
+
+replica_monitor = ReplicaMonitor()
+
+
+def read_only(fn):
+    """Route this endpoint's reads to a replica when one is healthy."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def use_primary():
+    """Read from the primary inside a read-only endpoint (e.g. to rule out replica lag)."""
+    previous = g.get('db_read_only', False)
+    g.db_read_only = False
+    try:
+        yield
+    finally:
+        g.db_read_only = previous
+
+
+def _is_write(clause):
+    if clause is None:
+        return False
+    if isinstance(clause, UpdateBase):
+        return True
+    if isinstance(clause, Select):
+        return clause._for_update_arg is not None
+    return not getattr(clause, "is_select", False)  # raw SQL: assume it writes
+
+
+class RoutingSession(Session):
+    _wrote = False
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._wrote and has_request_context() and g.get('db_read_only'):
+            if self._flushing or _is_write(clause):
+                self._wrote = True  # from here on this request reads its own writes
+            else:
+                key = g.get('db_replica', False)
+                if key is False:
+                    key = g.db_replica = replica_monitor.choose(self._db.engines)
+                if key is not None:
+                    return self._db.engines[key]
+        elif self._flushing or _is_write(clause):
+            self._wrote = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _report_timing(response):
+    waited = g.get('db_pool_wait')
+    replica = g.get('db_replica')
+    if waited is None and not replica:
+        return response
+    timings = []
+    if waited is not None:
+        timings.append(f"db-pool;dur={waited * 1000:.2f}")
+    if g.get('db_read_only'):
+        timings.append(f'db-route;desc="{replica or "primary"}"')
+    response.headers.add("Server-Timing", ", ".join(timings))
+    return response
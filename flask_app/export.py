@@ -0,0 +1,150 @@
+# flask_app/export.py
+"""Streaming export of trades, markets and transactions.
+
+Rows are read with `yield_per`, which streams them from a server-side cursor
+(a named cursor on PostgreSQL) in chunks of `chunk_size`, and each chunk is
+encoded and handed on before the next is fetched. Nothing is loaded into the
+session, so memory stays flat however many rows a table holds.
+
+Formats:
+- csv: header row, then one write per chunk.
+- arrow: an Arrow IPC stream, one record batch per chunk.
+- parquet: a Parquet file, one row group per chunk.
+
+Arrow and Parquet need pyarrow (requirements-optional.txt), which is only
+imported when they are used. `export` checks that it is installed before
+anything is streamed, so a missing pyarrow is an error up front rather than
+a broken download.
+"""
+import csv
+import importlib.util
+import io
+
+from sqlalchemy import select, types
+
+from flask_app.models import db, Market, Trade, Transaction
+
+EXPORTS = {"trades": Trade, "markets": Market, "transactions": Transaction}
+FORMATS = ("csv", "arrow", "parquet")
+MIMETYPES = {
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet"
+}
+EXTENSIONS = {"csv": "csv", "arrow": "arrows", "parquet": "parquet"}
+DEFAULT_CHUNK_SIZE = 10_000
+
+
+class FormatUnavailable(Exception):
+    """The format needs an optional dependency that is not installed."""
+
+
+def iter_chunks(name, chunk_size=DEFAULT_CHUNK_SIZE, user_id=None):
+    """Yield lists of row tuples from table `name` in id order.
+
+    `user_id` limits trades and transactions to that user's rows.
+    """
+    table = EXPORTS[name].__table__
+    stmt = select(table).order_by(table.c.id)
+    if user_id is not None and "user_id" in table.c:
+        stmt = stmt.where(table.c.user_id == user_id)
+    result = db.session.execute(stmt.execution_options(yield_per=chunk_size))
+    for partition in result.partitions():
+        yield [tuple(row) for row in partition]
+
+
+def export(name, fmt, chunk_size=DEFAULT_CHUNK_SIZE, user_id=None):
+    """Yield the encoded export of table `name` as byte chunks."""
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {FORMATS}")
+    if fmt != "csv" and importlib.util.find_spec("pyarrow") is None:
+        raise FormatUnavailable(f"{fmt} export needs pyarrow, which is not installed")
+    columns = EXPORTS[name].__table__.columns
+    chunks = iter_chunks(name, chunk_size, user_id)
+    if fmt == "csv":
+        return _csv(columns, chunks)
+    return _arrow(columns, chunks, parquet=fmt == "parquet")
+
+
+def _csv(columns, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.name for column in columns])
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")  # header of an empty table
+
+
+class _ChunkSink:
+    """Write-only file object that hands back what was written since the last drain."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _arrow_type(column, pa):
+    sql_type = column.type
+    if isinstance(sql_type, types.Boolean):
+        return pa.bool_()
+    if isinstance(sql_type, types.Integer):
+        return pa.int64()
+    if isinstance(sql_type, types.Float):
+        return pa.float64()
+    if isinstance(sql_type, types.Numeric):
+        return pa.decimal128(sql_type.precision or 38, sql_type.scale or 0)
+    if isinstance(sql_type, types.DateTime):
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def _arrow(columns, chunks, parquet=False):
+    import pyarrow as pa  # Only needed for columnar exports
+
+    schema = pa.schema([pa.field(column.name, _arrow_type(column, pa), nullable=column.nullable)
+                        for column in columns])
+    sink = _ChunkSink()
+    if parquet:
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    try:
+        for rows in chunks:
+            batch = pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)],
+                schema=schema
+            )
+            if parquet:
+                writer.write_batch(batch, row_group_size=len(rows))
+            else:
+                writer.write_batch(batch)
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
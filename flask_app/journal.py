@@ -0,0 +1,394 @@
+# flask_app/journal.py
+"""Write-behind journal for order book fills.
+
+With TRADE_JOURNAL_DIR set, the fill batcher no longer writes fills to the
+database before acknowledging them. It appends them to a journal file on local
+disk instead, with one write and one fsync per batch. The batch holds every
+fill queued by the requests that were waiting, which makes it a group commit.
+The request is answered as soon as that fsync returns. A background drainer
+then applies the journaled fills with the normal `write_fills` (trades,
+positions, candles, prices) in batches of up to TRADE_JOURNAL_DRAIN_BATCH
+fills. Each batch stores its journal position in `journal_checkpoints` in the
+same transaction, so a batch is applied exactly once.
+
+Each worker process journals into its own subdirectory and holds an flock on
+it while alive. When a worker starts, it takes over the directories whose
+owners have died (crashed, killed, or exited before draining). It replays
+them from their checkpoint, up to the first torn or corrupt record, and
+then deletes them. Segments roll over at TRADE_JOURNAL_SEGMENT_BYTES and are
+removed once fully applied.
+
+TRADE_JOURNAL_MAX_LAG bounds how far the database may fall behind. New
+orders wait while the oldest undrained fill is older than that. If the
+drainer still has not caught up after another TRADE_JOURNAL_MAX_LAG, they are
+refused with JournalBacklogged (503). Both checks happen before the order
+is matched, so nothing has changed when an order is refused.
+
+The journal needs flock, so on Windows it stays disabled and fills are
+written straight to the database.
+
+Reads are eventually consistent. A fill shows up in trades, positions,
+candles and the price feed once it has been drained, normally within
+milliseconds. Resolving a market waits for the drain (`wait_drained`), so
+settlement sees every fill this process made in it. Fills that still arrive
+for a resolved market, from another worker's journal, are dropped by
+`write_fills`; their orders' escrow was refunded in full at resolution.
+"""
+import atexit
+import glob
+import json
+import logging
+import math
+import os
+import shutil
+import socket
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock to tell live journals from dead ones, so the journal stays off
+    fcntl = None
+
+from flask_app.metrics import REGISTRY
+from flask_app.models import db, JournalCheckpoint
+from flask_app.orderbook import Fill
+
+logger = logging.getLogger(__name__)
+
+RECORD = struct.Struct("<II")  # payload length, crc32 of the payload
+SEGMENT_NAME = "segment-{:08d}.log"
+LOCK_NAME = "lock"
+fdatasync = getattr(os, "fdatasync", os.fsync)  # macOS and Windows have no fdatasync
+
+
+class JournalBacklogged(Exception):
+    """The drainer is more than the allowed lag behind; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"trade journal backlogged, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def encode(fills):
+    payload = json.dumps([[f.market_id, f.yes_user_id, f.no_user_id, f.amount, f.ticks, f.ts,
+                           f.yes_order_id, f.no_order_id, f.taker, f.refund] for f in fills],
+                         separators=(",", ":")).encode("utf-8")
+    return RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_segment(path, offset=0):
+    """Yield (end_offset, fills) for each intact record after `offset`; stops at a torn or corrupt one."""
+    with open(path, "rb") as segment:
+        segment.seek(offset)
+        while True:
+            header = segment.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            length, checksum = RECORD.unpack(header)
+            payload = segment.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                logger.warning("Journal %s: torn record at offset %d; ignoring the rest", path, offset)
+                return
+            offset += RECORD.size + length
+            yield offset, [Fill(*values) for values in json.loads(payload)]
+
+
+def _segments(directory):
+    return sorted((int(os.path.basename(path)[8:16]), path)
+                  for path in glob.glob(os.path.join(directory, "segment-*.log")))
+
+
+def _fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class TradeJournal:
+    def __init__(self, max_lag=2.0, segment_bytes=64 * 1024 * 1024, drain_batch=5000, drain_interval=0.01):
+        self.max_lag = max_lag
+        self.segment_bytes = segment_bytes
+        self.drain_batch = drain_batch
+        self.drain_interval = drain_interval
+        self.enabled = False
+        self.directory = None
+        self.name = None
+        self._app = None
+        self._write = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._append_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._progress = threading.Condition(self._lock)
+        self._queue = deque()  # (appended at, (segment, offset), fills) not yet in the database
+        self._fd = None
+        self._lock_fd = None
+        self._segment = 0
+        self._offset = 0
+
+    def init_app(self, app, write):
+        """`write(fills, before_commit)` applies fills in one transaction, calling `before_commit()` first."""
+        self.directory = app.config.get('TRADE_JOURNAL_DIR')
+        if not self.directory:
+            return
+        if fcntl is None:
+            logger.warning("TRADE_JOURNAL_DIR is set, but the trade journal needs flock; writing fills directly")
+            return
+        self.max_lag = float(app.config.get('TRADE_JOURNAL_MAX_LAG', self.max_lag))
+        self.segment_bytes = int(app.config.get('TRADE_JOURNAL_SEGMENT_BYTES', self.segment_bytes))
+        self.drain_batch = int(app.config.get('TRADE_JOURNAL_DRAIN_BATCH', self.drain_batch))
+        os.makedirs(self.directory, exist_ok=True)
+        self._app = app
+        self._write = write
+        self.enabled = True
+        REGISTRY.gauge("trade_journal_lag_seconds", "Age of the oldest journaled fill not yet in the database",
+                       self.lag)
+        REGISTRY.gauge("trade_journal_backlog", "Journaled fills not yet in the database", self.backlog)
+
+    # --- request path ---
+
+    def throttle(self):
+        """Wait while the database is more than `max_lag` behind; raises JournalBacklogged if it stays behind."""
+        if not self.enabled:
+            return
+        deadline = time.monotonic() + self.max_lag
+        with self._lock:
+            while self._queue and time.monotonic() - self._queue[0][0] > self.max_lag:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise JournalBacklogged(math.ceil(self.max_lag))
+                self._progress.wait(remaining)
+
+    def append(self, fills):
+        """Durably journal `fills` (one record, one fsync); they reach the database asynchronously.
+
+        On OSError nothing of the record is left behind, so the caller can retry the same fills.
+        """
+        self.ensure_started()
+        record = encode(fills)
+        with self._append_lock:
+            if self._offset and self._offset + len(record) > self.segment_bytes:
+                self._open_segment(self._segment + 1)
+            try:
+                view = memoryview(record)
+                while view:
+                    view = view[os.write(self._fd, view):]
+                fdatasync(self._fd)
+            except OSError:
+                self._discard_partial()
+                raise
+            self._offset += len(record)
+            position = (self._segment, self._offset)
+        with self._lock:
+            self._queue.append((time.monotonic(), position, fills))
+            self._progress.notify_all()
+
+    def wait_drained(self, timeout=None):
+        """Wait until every fill journaled so far is in the database.
+
+        Raises JournalBacklogged if that takes longer than `timeout` (default
+        twice `max_lag`).
+        """
+        if not self.enabled:
+            return
+        timeout = 2 * self.max_lag if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            if not self._queue:
+                return
+            target = self._queue[-1][1]
+            while self._queue and self._queue[0][1] <= target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise JournalBacklogged(math.ceil(self.max_lag))
+                self._progress.wait(remaining)
+
+    def lag(self):
+        with self._lock:
+            return time.monotonic() - self._queue[0][0] if self._queue else 0.0
+
+    def backlog(self):
+        with self._lock:
+            return sum(len(fills) for _, _, fills in self._queue)
+
+    # --- startup and recovery ---
+
+    def ensure_started(self):
+        """Open this process's journal and start its drainer (once per process, so forked workers get their own)."""
+        if not self.enabled or self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue.clear()
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)  # inherited from the parent, whose journal this is
+            with self._app.app_context():
+                self.recover()
+            self.name = f"{socket.gethostname()}-{os.getpid()}-{int(time.time() * 1000)}"
+            own = os.path.join(self.directory, self.name)
+            os.makedirs(own)
+            self._lock_fd = os.open(os.path.join(own, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            self._open_segment(0)
+            threading.Thread(target=self._drain_forever, name="trade-journal-drain", daemon=True).start()
+            atexit.register(self.close)
+            self._pid = os.getpid()
+
+    def recover(self):
+        """Replay and remove the journals of workers that are no longer running; returns fills applied."""
+        applied = 0
+        for directory in sorted(glob.glob(os.path.join(self.directory, "*", ""))):
+            applied += self._recover_directory(directory.rstrip(os.sep)) or 0
+        return applied
+
+    def recover_journal(self, name, wait=10.0):
+        """Replay and remove the journal `name` once its worker has exited, waiting up to `wait` seconds.
+
+        Returns False if the journal is still locked after that (its worker is alive, or
+        another worker's recovery is stuck), True once it is gone.
+        """
+        directory = os.path.join(self.directory, name)
+        deadline = time.monotonic() + wait
+        while os.path.isdir(directory):
+            if self._recover_directory(directory) is not None:
+                continue
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _recover_directory(self, directory):
+        # Fills replayed, or None if the directory's owner still holds its lock
+        try:
+            lock_fd = os.open(os.path.join(directory, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            return 0  # removed by another worker's recovery
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None  # owner still alive
+            return self._replay(directory) if os.path.isdir(directory) else 0
+        finally:
+            os.close(lock_fd)
+
+    def _replay(self, directory):
+        name = os.path.basename(directory)
+        checkpoint = JournalCheckpoint.query.filter_by(journal=name).first()
+        start = (checkpoint.segment, checkpoint.offset) if checkpoint else (0, 0)
+        applied = 0
+        batch, position = [], start
+        for segment, path in _segments(directory):
+            if segment < start[0]:
+                continue
+            for offset, fills in read_segment(path, start[1] if segment == start[0] else 0):
+                batch.extend(fills)
+                position = (segment, offset)
+                if len(batch) >= self.drain_batch:
+                    self._apply(name, batch, position)
+                    applied += len(batch)
+                    batch = []
+        if batch:
+            self._apply(name, batch, position)
+            applied += len(batch)
+        JournalCheckpoint.query.filter_by(journal=name).delete()
+        db.session.commit()
+        shutil.rmtree(directory)
+        if applied:
+            logger.warning("Trade journal %s: replayed %d unapplied fills", name, applied)
+        return applied
+
+    # --- drain ---
+
+    def _apply(self, name, fills, position):
+        def save_checkpoint():
+            checkpoint = JournalCheckpoint.query.filter_by(journal=name).first()
+            if checkpoint is None:
+                checkpoint = JournalCheckpoint(journal=name)
+                db.session.add(checkpoint)
+            checkpoint.segment, checkpoint.offset = position
+        self._write(fills, save_checkpoint)
+
+    def _drain_forever(self):
+        backoff = self.drain_interval
+        while True:
+            with self._lock:
+                while not self._queue:
+                    self._progress.wait()
+            time.sleep(self.drain_interval)  # let concurrent appends pile into one batch
+            try:
+                self.drain_once()
+                backoff = self.drain_interval
+            except Exception:
+                logger.exception("Trade journal %s: drain failed, retrying", self.name)
+                backoff = min(backoff * 2, 5.0)
+                time.sleep(backoff)
+
+    def drain_once(self):
+        """Apply the oldest journaled fills (up to `drain_batch`) to the database."""
+        with self._lock:
+            entries, count = [], 0
+            for entry in self._queue:
+                if entries and count + len(entry[2]) > self.drain_batch:
+                    break
+                entries.append(entry)
+                count += len(entry[2])
+        if not entries:
+            return 0
+        position = entries[-1][1]
+        with self._app.app_context():
+            self._apply(self.name, [fill for _, _, fills in entries for fill in fills], position)
+        with self._lock:
+            for _ in entries:
+                self._queue.popleft()
+            self._progress.notify_all()
+        self._remove_segments_before(position[0])
+        return count
+
+    def close(self, timeout=10.0):
+        """Wait (up to `timeout`) for the backlog to reach the database, e.g. at shutdown."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._queue and time.monotonic() < deadline:
+                self._progress.wait(deadline - time.monotonic())
+
+    # --- segments ---
+
+    def _open_segment(self, segment):
+        directory = os.path.join(self.directory, self.name)
+        fd = os.open(os.path.join(directory, SEGMENT_NAME.format(segment)),
+                     os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if self._fd is not None:
+            os.close(self._fd)  # only once the new one is open, so `_fd` never names a closed descriptor
+        self._fd = fd
+        _fsync_directory(directory)
+        self._segment, self._offset = segment, 0
+
+    def _discard_partial(self):
+        # A failed append may have left part (or all, unsynced) of its record behind. The caller
+        # retries those fills, so cut the segment back to the last acknowledged record; failing
+        # that, move on to a new segment, since replay of a segment stops at a torn record.
+        try:
+            os.ftruncate(self._fd, self._offset)
+        except OSError:
+            logger.exception("Trade journal %s: could not truncate segment %d", self.name, self._segment)
+            try:
+                self._open_segment(self._segment + 1)
+            except OSError:
+                logger.exception("Trade journal %s: could not open a new segment", self.name)
+
+    def _remove_segments_before(self, segment):
+        for number, path in _segments(os.path.join(self.directory, self.name)):
+            if number >= segment:
+                break
+            os.remove(path)
+
+
+trade_journal = TradeJournal()
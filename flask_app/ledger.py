@@ -0,0 +1,99 @@
+# flask_app/ledger.py
+"""Append-only balance ledger over `Transaction`.
+
+`users.balance` is the running total, so reads are a single row. Every change
+to it goes through `debit`/`credit`, which pair one UPDATE with one ledger row
+in the caller's transaction. Debits are a conditional UPDATE
+(`WHERE balance >= amount`) instead of SELECT ... FOR UPDATE, so concurrent
+trades from one account only hold the row lock for that statement's
+transaction rather than queueing behind each other's reads.
+
+`snapshot_balances` records each user's balance next to the last ledger row
+it includes, so audits replay only the ledger written since the last snapshot.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy import func, select, update
+
+from flask_app.models import db, BalanceSnapshot, Transaction, User
+
+CENT = Decimal('0.01')
+
+
+class InsufficientBalance(Exception):
+    pass
+
+
+def to_money(value):
+    return Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def debit(user_id, amount, transaction_type):
+    """Take `amount` from the user if the balance covers it, else raise InsufficientBalance.
+
+    Does not commit; a failed debit leaves the transaction untouched.
+    """
+    amount = to_money(amount)
+    if amount <= 0:
+        return amount
+    result = db.session.execute(
+        update(User)
+        .where(User.id == user_id, User.balance >= amount)
+        .values(balance=User.balance - amount)
+    )
+    if result.rowcount != 1:
+        raise InsufficientBalance(f"balance below {amount}")
+    db.session.add(Transaction(user_id=user_id, amount=-amount, transaction_type=transaction_type))
+    return amount
+
+
+def credit(user_id, amount, transaction_type):
+    """Add `amount` to the user's balance. Does not commit."""
+    amount = to_money(amount)
+    if amount <= 0:
+        return amount
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(balance=func.coalesce(User.balance, 0) + amount)
+    )
+    db.session.add(Transaction(user_id=user_id, amount=amount, transaction_type=transaction_type))
+    return amount
+
+
+def snapshot_balances():
+    """Snapshot every user with ledger activity since their last snapshot.
+
+    One INSERT ... SELECT, so the balances and ledger positions come from the
+    same statement-level view of the database. Returns the rows written.
+    """
+    last_tx = (select(Transaction.user_id, func.max(Transaction.id).label("last_id"))
+               .group_by(Transaction.user_id)
+               .subquery())
+    last_snap = (select(BalanceSnapshot.user_id, func.max(BalanceSnapshot.last_transaction_id).label("last_id"))
+                 .group_by(BalanceSnapshot.user_id)
+                 .subquery())
+    rows = (select(User.id, func.coalesce(User.balance, 0), last_tx.c.last_id, func.current_timestamp())
+            .join(last_tx, last_tx.c.user_id == User.id)
+            .outerjoin(last_snap, last_snap.c.user_id == User.id)
+            .where((last_snap.c.last_id.is_(None)) | (last_snap.c.last_id < last_tx.c.last_id)))
+    result = db.session.execute(
+        BalanceSnapshot.__table__.insert().from_select(
+            ["user_id", "balance", "last_transaction_id", "created_at"], rows
+        )
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def verify_balance(user_id):
+    """Replay the ledger since the latest snapshot; returns (stored, replayed)."""
+    snapshot = (BalanceSnapshot.query.filter_by(user_id=user_id)
+                .order_by(BalanceSnapshot.last_transaction_id.desc())
+                .first())
+    base, after = (snapshot.balance, snapshot.last_transaction_id) if snapshot else (Decimal('0.00'), 0)
+    delta = (db.session.query(func.coalesce(func.sum(Transaction.amount), 0))
+             .filter(Transaction.user_id == user_id, Transaction.id > after)
+             .scalar())
+    stored = db.session.query(User.balance).filter_by(id=user_id).scalar()
+    return to_money(stored or 0), to_money(base) + to_money(delta)
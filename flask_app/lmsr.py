@@ -0,0 +1,66 @@
+# flask_app/lmsr.py
+"""Logarithmic market scoring rule (LMSR) automated market maker.
+
+For outstanding shares q_yes, q_no and liquidity b the cost function is
+
+    C(q) = b * log(exp(q_yes / b) + exp(q_no / b))
+
+and the YES price is its derivative, exp(q_yes / b) / sum, i.e. a logistic of
+(q_yes - q_no) / b. All exponentials go through log-sum-exp with the max
+factored out so large share counts never overflow.
+"""
+import math
+
+import numpy as np
+
+DEFAULT_LIQUIDITY = 100.0
+
+
+def _logaddexp(a, b):
+    hi, lo = (a, b) if a >= b else (b, a)
+    return hi + math.log1p(math.exp(lo - hi))
+
+
+def cost(shares_yes, shares_no, liquidity):
+    return liquidity * _logaddexp(shares_yes / liquidity, shares_no / liquidity)
+
+
+def price_yes(shares_yes, shares_no, liquidity):
+    # logistic(x) written via tanh, which saturates instead of overflowing
+    return 0.5 * (1.0 + math.tanh((shares_yes - shares_no) / (2.0 * liquidity)))
+
+
+def trade_cost(shares_yes, shares_no, liquidity, outcome, amount):
+    """Cost of buying `amount` shares of `outcome`, and the new share state."""
+    if outcome == "yes":
+        new_yes, new_no = shares_yes + amount, shares_no
+    else:
+        new_yes, new_no = shares_yes, shares_no + amount
+    paid = cost(new_yes, new_no, liquidity) - cost(shares_yes, shares_no, liquidity)
+    return paid, new_yes, new_no
+
+
+def shares_for_price(yes_price, liquidity):
+    """Initial YES share imbalance that makes the market open at `yes_price`."""
+    return liquidity * math.log(yes_price / (1.0 - yes_price))
+
+
+def quote_many(shares_yes, shares_no, liquidity, amount=0.0):
+    """Vectorized prices (and optional cost of `amount` shares) for many markets.
+
+    Returns (yes_prices, no_prices, yes_costs, no_costs) as NumPy arrays; the
+    cost arrays are None when `amount` is 0.
+    """
+    qy = np.asarray(shares_yes, dtype=np.float64)
+    qn = np.asarray(shares_no, dtype=np.float64)
+    b = np.asarray(liquidity, dtype=np.float64)
+
+    yes_prices = 0.5 * (1.0 + np.tanh((qy - qn) / (2.0 * b)))
+    no_prices = 1.0 - yes_prices
+    if not amount:
+        return yes_prices, no_prices, None, None
+
+    base = b * np.logaddexp(qy / b, qn / b)
+    yes_costs = b * np.logaddexp((qy + amount) / b, qn / b) - base
+    no_costs = b * np.logaddexp(qy / b, (qn + amount) / b) - base
+    return yes_prices, no_prices, yes_costs, no_costs
@@ -0,0 +1,431 @@
+# flask_app/metrics.py
+"""Prometheus metrics with per-thread shards, merged when /metrics is scraped.
+
+Updating a metric only touches a dict owned by the calling thread, so hot
+paths never take a lock. A scrape merges every thread's shard; shards of
+threads that have exited are folded into one retired shard so short-lived
+request threads don't pile up. /metrics only answers clients in
+METRICS_ALLOWED_NETWORKS (loopback by default) and gives everyone else a 403.
+
+With METRICS_MULTIPROC_DIR set, each worker process also writes its merged
+values to `metrics-<pid>.db` in that directory every METRICS_FLUSH_INTERVAL
+seconds: a memory-mapped file holding a sequence number and a JSON payload,
+rewritten seqlock-style so readers retry instead of seeing a torn write. A
+scrape served by any worker adds up every process's file, so counters and
+histograms cover the whole server (other workers' values are at most one
+flush interval old). Callback gauges only count processes still alive.
+"""
+import bisect
+import glob
+import ipaddress
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import weakref
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+HEADER = struct.Struct("<QQ")  # sequence number (odd while writing), payload length
+
+
+class _Shard:
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        self.counters = {}    # (name, label values) -> value
+        self.histograms = {}  # (name, label values) -> [bucket counts..., +Inf count, sum]
+
+    def merge(self, counters, histograms):
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0.0) + value
+        for key, values in histograms.items():
+            mine = self.histograms.get(key)
+            if mine is None:
+                self.histograms[key] = list(values)
+            else:
+                for i, value in enumerate(values):
+                    mine[i] += value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.gauges = {}
+        self._local = threading.local()
+        self._shards = {}  # id(shard) -> (weakref to owning thread, shard)
+        self._retired = _Shard()
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Duplicate metric {metric.name}")
+        self.metrics[metric.name] = metric
+
+    def gauge(self, name, documentation, callback):
+        """Report `callback()` (a number) as a gauge on every scrape."""
+        self.gauges[name] = (documentation, callback)
+
+    def shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards[id(shard)] = (weakref.ref(threading.current_thread()), shard)
+            return shard
+
+    def collect(self):
+        """This process's values: (counters, histograms, gauges)."""
+        merged = _Shard()
+        with self._lock:
+            for key, (thread_ref, shard) in list(self._shards.items()):
+                thread = thread_ref()
+                if thread is None or not thread.is_alive():
+                    # The thread can't write any more, so its shard is safe to fold in
+                    self._retired.merge(shard.counters, shard.histograms)
+                    del self._shards[key]
+                else:
+                    merged.merge(shard.counters.copy(), {k: list(v) for k, v in shard.histograms.copy().items()})
+            merged.merge(self._retired.counters, self._retired.histograms)
+        gauges = {}
+        for name, (_, callback) in self.gauges.items():
+            try:
+                gauges[name] = float(callback())
+            except Exception:
+                pass  # a broken callback must not break the scrape
+        return merged.counters, merged.histograms, gauges
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._registry = registry
+        self._children = {}
+        registry.register(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._child((self.name, tuple(str(v) for v in values)))
+        return child
+
+
+class _CounterChild:
+    __slots__ = ("_key", "_registry")
+
+    def __init__(self, key, registry):
+        self._key = key
+        self._registry = registry
+
+    def inc(self, amount=1.0):
+        counters = self._registry.shard().counters
+        counters[self._key] = counters.get(self._key, 0.0) + amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _child(self, key):
+        return _CounterChild(key, self._registry)
+
+    def inc(self, amount=1.0):
+        self.labels().inc(amount)
+
+
+class _HistogramChild:
+    __slots__ = ("_key", "_registry", "_buckets")
+
+    def __init__(self, key, registry, buckets):
+        self._key = key
+        self._registry = registry
+        self._buckets = buckets
+
+    def observe(self, value):
+        histograms = self._registry.shard().histograms
+        values = histograms.get(self._key)
+        if values is None:
+            values = histograms[self._key] = [0] * (len(self._buckets) + 1) + [0.0]
+        values[bisect.bisect_left(self._buckets, value)] += 1
+        values[-1] += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _child(self, key):
+        return _HistogramChild(key, self._registry, self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+# --- multiprocess files ---
+class _ProcessFile:
+    """One process's snapshot in a memory-mapped file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._size = 0
+        self._map = None
+        self._sequence = 0
+
+    def write(self, payload):
+        needed = HEADER.size + len(payload)
+        if needed > self._size:
+            self._size = max(needed, 2 * self._size, mmap.PAGESIZE)
+            os.ftruncate(self._fd, self._size)
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._fd, self._size)
+        self._sequence += 1  # odd: readers retry
+        HEADER.pack_into(self._map, 0, self._sequence, len(payload))
+        self._map[HEADER.size:needed] = payload
+        self._sequence += 1
+        HEADER.pack_into(self._map, 0, self._sequence, len(payload))
+
+
+def read_process_file(path, attempts=5):
+    with open(path, "rb") as handle:
+        size = os.fstat(handle.fileno()).st_size
+        if size < HEADER.size:
+            return None
+        with mmap.mmap(handle.fileno(), size, access=mmap.ACCESS_READ) as mapped:
+            for _ in range(attempts):
+                sequence, length = HEADER.unpack_from(mapped, 0)
+                if sequence % 2 or HEADER.size + length > size:
+                    time.sleep(0.001)
+                    continue
+                payload = mapped[HEADER.size:HEADER.size + length]
+                if HEADER.unpack_from(mapped, 0)[0] == sequence:
+                    return json.loads(payload) if payload else None
+    return None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Metrics:
+    def __init__(self, registry=REGISTRY, flush_interval=1.0):
+        self.registry = registry
+        self.flush_interval = flush_interval
+        self.directory = None
+        self.allowed_networks = []
+        self._file = None
+        self._pid = None
+        self._flusher_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.directory = app.config.get('METRICS_MULTIPROC_DIR')
+        self.flush_interval = float(app.config.get('METRICS_FLUSH_INTERVAL', self.flush_interval))
+        networks = app.config.get('METRICS_ALLOWED_NETWORKS', "127.0.0.0/8,::1/128")
+        self.allowed_networks = [ipaddress.ip_network(cidr.strip(), strict=False)
+                                 for cidr in networks.split(",") if cidr.strip()]
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self._start)
+        app.after_request(self._record)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+    # --- request path ---
+
+    def _start(self):
+        g.metrics_start = time.perf_counter()
+        g.db_queries = 0
+        g.db_time = 0.0
+        if self.directory and self._pid != os.getpid():
+            self._start_flusher()
+
+    def _record(self, response):
+        start = g.get('metrics_start')
+        if start is None:
+            return response
+        endpoint = request.endpoint or "unmatched"
+        REQUEST_SECONDS.labels(endpoint, request.method).observe(time.perf_counter() - start)
+        REQUESTS.labels(endpoint, request.method, response.status_code).inc()
+        DB_QUERIES_PER_REQUEST.labels(endpoint).observe(g.db_queries)
+        DB_SECONDS_PER_REQUEST.labels(endpoint).observe(g.db_time)
+        return response
+
+    # --- multiprocess flush ---
+
+    def _start_flusher(self):
+        # Started lazily (and again after a fork) so every worker writes its own file
+        with self._flusher_lock:
+            if self._pid == os.getpid():
+                return
+            self._file = _ProcessFile(os.path.join(self.directory, f"metrics-{os.getpid()}.db"))
+            threading.Thread(target=self._run, name="metrics-flush", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        if self._file is None:
+            return
+        counters, histograms, gauges = self.registry.collect()
+        self._file.write(json.dumps({
+            "pid": os.getpid(),
+            "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+            "histograms": [[name, labels, values] for (name, labels), values in histograms.items()],
+            "gauges": gauges
+        }, separators=(",", ":")).encode("utf-8"))
+
+    def gather(self):
+        """Values summed over this process and, in multiprocess mode, every other one."""
+        merged = _Shard()
+        counters, histograms, gauges = self.registry.collect()
+        merged.merge(counters, histograms)
+        gauges = dict(gauges)
+        if self.directory:
+            own = f"metrics-{os.getpid()}.db"
+            for path in glob.glob(os.path.join(self.directory, "metrics-*.db")):
+                if os.path.basename(path) == own:
+                    continue
+                try:
+                    snapshot = read_process_file(path)
+                except (OSError, ValueError):
+                    continue
+                if not snapshot:
+                    continue
+                merged.merge({(name, tuple(labels)): value for name, labels, value in snapshot["counters"]},
+                             {(name, tuple(labels)): values for name, labels, values in snapshot["histograms"]})
+                if _pid_alive(snapshot["pid"]):
+                    for name, value in snapshot["gauges"].items():
+                        gauges[name] = gauges.get(name, 0.0) + value
+        return merged.counters, merged.histograms, gauges
+
+    def render(self):
+        counters, histograms, gauges = self.gather()
+        by_metric = {}
+        for (name, labels), value in counters.items():
+            by_metric.setdefault(name, []).append((labels, value))
+        for (name, labels), values in histograms.items():
+            by_metric.setdefault(name, []).append((labels, values))
+
+        lines = []
+        for name, metric in self.registry.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(by_metric.get(name, ())):
+                pairs = list(zip(metric.labelnames, labels))
+                if metric.kind == "counter":
+                    lines.append(f"{name}_total{_labels(pairs)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), value[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(pairs + [('le', _number(bound))])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(pairs)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(pairs)} {cumulative}")
+        for name, (documentation, _) in self.registry.gauges.items():
+            if name in gauges:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_number(gauges[name])}")
+        return "\n".join(lines) + "\n"
+
+    def view(self):
+        # Scrapes only from METRICS_ALLOWED_NETWORKS: the metrics name every route and its traffic
+        try:
+            address = ipaddress.ip_address(request.remote_addr or "")
+        except ValueError:
+            address = None
+        if address is None or not any(address in network for network in self.allowed_networks):
+            return Response("Forbidden\n", status=403, content_type=CONTENT_TYPE)
+        return Response(self.render(), content_type=CONTENT_TYPE)
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# --- SQLAlchemy hooks (every engine) ---
+_query_listeners = []
+
+
+def add_query_listener(callback):
+    """Call `callback(statement, parameters, executemany, elapsed)` after every SQL statement."""
+    _query_listeners.append(callback)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("metrics_query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    operation = statement.lstrip()[:6].upper()
+    DB_QUERY_SECONDS.labels(operation if operation in SQL_OPERATIONS else "OTHER").observe(elapsed)
+    if has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+        g.db_time = g.get('db_time', 0.0) + elapsed
+    for callback in _query_listeners:
+        callback(statement, parameters, executemany, elapsed)
+
+
+SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+REQUESTS = Counter("http_requests", "HTTP requests by endpoint, method and status", ("endpoint", "method", "status"))
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time to produce a response", ("endpoint", "method"))
+DB_QUERIES_PER_REQUEST = Histogram("http_request_db_queries", "SQL statements run per request", ("endpoint",),
+                                   buckets=COUNT_BUCKETS)
+DB_SECONDS_PER_REQUEST = Histogram("http_request_db_seconds", "Time spent in SQL per request", ("endpoint",))
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "SQL statement execution time", ("operation",))
+DB_POOL_WAIT_SECONDS = Histogram("db_pool_wait_seconds", "Time waiting for a pooled connection", ("pool",))
+BCRYPT_SECONDS = Histogram("bcrypt_duration_seconds", "bcrypt work per call", ("operation",),
+                           buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+BCRYPT_QUEUE_SECONDS = Histogram("bcrypt_queue_wait_seconds", "Time bcrypt jobs waited for a worker")
+BCRYPT_REJECTED = Counter("bcrypt_rejected", "bcrypt jobs turned away with 503 (pool saturated)")
+TRADES = Counter("trades", "Executed trades (book fills or LMSR purchases)", ("pricing_mode",))
+TRADE_SHARES = Counter("trade_shares", "Shares traded", ("pricing_mode",))
+
+metrics = Metrics()
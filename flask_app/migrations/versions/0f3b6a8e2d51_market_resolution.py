@@ -0,0 +1,26 @@
+"""Market resolution outcome
+
+Revision ID: 0f3b6a8e2d51
+Revises: e5a0c7d29f13
+Create Date: 2026-10-18 13:55:32.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0f3b6a8e2d51'
+down_revision = 'e5a0c7d29f13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('markets', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('resolved_outcome', sa.String(length=3), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('markets', schema=None) as batch_op:
+        batch_op.drop_column('resolved_outcome')
@@ -0,0 +1,32 @@
+"""LMSR pricing mode for markets
+
+Revision ID: 4c2e8f1a9b07
+Revises: d7ff0cc97ec6
+Create Date: 2026-10-18 10:02:11.481352
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c2e8f1a9b07'
+down_revision = 'd7ff0cc97ec6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('markets', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('pricing_mode', sa.String(length=10), nullable=False, server_default='book'))
+        batch_op.add_column(sa.Column('liquidity', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('shares_yes', sa.Float(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('shares_no', sa.Float(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('markets', schema=None) as batch_op:
+        batch_op.drop_column('shares_no')
+        batch_op.drop_column('shares_yes')
+        batch_op.drop_column('liquidity')
+        batch_op.drop_column('pricing_mode')
@@ -0,0 +1,32 @@
+"""Trade journal checkpoints
+
+Revision ID: 5b7e2a9c4d10
+Revises: a4e8c1d6f092
+Create Date: 2026-10-18 21:12:54.330871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e2a9c4d10'
+down_revision = 'a4e8c1d6f092'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('journal_checkpoints',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('journal', sa.String(length=120), nullable=False),
+    sa.Column('segment', sa.Integer(), nullable=False),
+    sa.Column('offset', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('journal')
+    )
+
+
+def downgrade():
+    op.drop_table('journal_checkpoints')
@@ -0,0 +1,37 @@
+"""Balance snapshots for the transaction ledger
+
+Revision ID: 7d94b2f6c3e8
+Revises: 0f3b6a8e2d51
+Create Date: 2026-10-18 15:07:48.650391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d94b2f6c3e8'
+down_revision = '0f3b6a8e2d51'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('balance_snapshots',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('balance', sa.Numeric(precision=10, scale=2), nullable=False),
+    sa.Column('last_transaction_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('balance_snapshots', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_balance_snapshots_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('balance_snapshots', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_balance_snapshots_user_id'))
+
+    op.drop_table('balance_snapshots')
@@ -0,0 +1,55 @@
+"""Stored resting orders and their owner processes
+
+Revision ID: 8c2d5f1e7a43
+Revises: 5b7e2a9c4d10
+Create Date: 2026-10-19 10:04:17.512903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c2d5f1e7a43'
+down_revision = '5b7e2a9c4d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('orders',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('market_id', sa.Integer(), nullable=False),
+    sa.Column('outcome', sa.String(length=3), nullable=False),
+    sa.Column('price', sa.Float(), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.Column('filled', sa.Float(), nullable=False),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('owner', sa.String(length=120), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['market_id'], ['markets.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_orders_market_id'), ['market_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_orders_user_id'), ['user_id'], unique=False)
+        batch_op.create_index('ix_orders_owner_status', ['owner', 'status'], unique=False)
+
+    op.create_table('book_owners',
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.Column('journal', sa.String(length=120), nullable=True),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('book_owners')
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_index('ix_orders_owner_status')
+        batch_op.drop_index(batch_op.f('ix_orders_user_id'))
+        batch_op.drop_index(batch_op.f('ix_orders_market_id'))
+
+    op.drop_table('orders')
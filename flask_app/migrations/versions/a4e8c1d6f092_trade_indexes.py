@@ -0,0 +1,49 @@
+"""Composite trade indexes for the per-user and per-market lookups
+
+Revision ID: a4e8c1d6f092
+Revises: c3f91d07a2b6
+Create Date: 2026-10-18 19:41:07.502318
+
+get_trades filters on trades.user_id, which had no index, so every call was a
+sequential scan of the largest table. (user_id, id) and (market_id, id) serve
+the per-user and per-market lookups and return rows already in id order.
+
+On PostgreSQL the indexes are built CONCURRENTLY, so trading carries on while
+they build.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e8c1d6f092'
+down_revision = 'c3f91d07a2b6'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'ix_trades_user_id_id': ['user_id', 'id'],
+    'ix_trades_market_id_id': ['market_id', 'id']
+}
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        for name, columns in INDEXES.items():
+            op.create_index(name, 'trades', columns, unique=False)
+        return
+
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES.items():
+            op.create_index(name, 'trades', columns, unique=False,
+                            postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        for name in INDEXES:
+            op.drop_index(name, table_name='trades')
+        return
+
+    with op.get_context().autocommit_block():
+        for name in INDEXES:
+            op.drop_index(name, table_name='trades', postgresql_concurrently=True, if_exists=True)
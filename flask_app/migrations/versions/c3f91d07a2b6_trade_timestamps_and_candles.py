@@ -0,0 +1,45 @@
+"""Trade timestamps and OHLCV candles
+
+Revision ID: c3f91d07a2b6
+Revises: 7d94b2f6c3e8
+Create Date: 2026-10-18 16:02:31.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f91d07a2b6'
+down_revision = '7d94b2f6c3e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Trades recorded before this revision have no timestamp and stay out of the candles
+    with op.batch_alter_table('trades', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=True))
+
+    op.create_table('candles',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('market_id', sa.Integer(), nullable=False),
+    sa.Column('resolution', sa.Integer(), nullable=False),
+    sa.Column('bucket', sa.BigInteger(), nullable=False),
+    sa.Column('open', sa.Float(), nullable=False),
+    sa.Column('high', sa.Float(), nullable=False),
+    sa.Column('low', sa.Float(), nullable=False),
+    sa.Column('close', sa.Float(), nullable=False),
+    sa.Column('volume', sa.Float(), nullable=False),
+    sa.Column('trades', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['market_id'], ['markets.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('market_id', 'resolution', 'bucket', name='uq_candles_market_resolution_bucket')
+    )
+
+
+def downgrade():
+    op.drop_table('candles')
+
+    with op.batch_alter_table('trades', schema=None) as batch_op:
+        batch_op.drop_column('created_at')
@@ -0,0 +1,41 @@
+"""Positions aggregate
+
+Revision ID: e5a0c7d29f13
+Revises: b81d5e3c0a42
+Create Date: 2026-10-18 12:41:09.337580
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a0c7d29f13'
+down_revision = 'b81d5e3c0a42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('positions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('market_id', sa.Integer(), nullable=False),
+    sa.Column('outcome', sa.String(length=3), nullable=False),
+    sa.Column('shares', sa.Float(), nullable=False),
+    sa.Column('cost_basis', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['market_id'], ['markets.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'market_id', 'outcome', name='uq_positions_user_market_outcome')
+    )
+
+    # Backfill from the trades recorded so far
+    op.execute(
+        "INSERT INTO positions (user_id, market_id, outcome, shares, cost_basis) "
+        "SELECT user_id, market_id, outcome, SUM(amount), SUM(amount * price) "
+        "FROM trades GROUP BY user_id, market_id, outcome"
+    )
+
+
+def downgrade():
+    op.drop_table('positions')
@@ -0,0 +1,73 @@
+"""Backfill starting balances for users created before the ledger
+
+Revision ID: e6a0d3b9f5c2
+Revises: 8c2d5f1e7a43
+Create Date: 2026-10-19 11:26:40.218734
+
+"""
+import os
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6a0d3b9f5c2'
+down_revision = '8c2d5f1e7a43'
+branch_labels = None
+depends_on = None
+
+users = sa.table('users', sa.column('id', sa.Integer), sa.column('balance', sa.Numeric(10, 2)))
+transactions = sa.table(
+    'transactions',
+    sa.column('user_id', sa.Integer),
+    sa.column('amount', sa.Numeric(10, 2)),
+    sa.column('transaction_type', sa.String(15)),
+    sa.column('created_at', sa.DateTime),
+    sa.column('transaction_id', sa.String(36)),
+)
+
+
+def upgrade():
+    # Users from before the ledger have a NULL (or untracked) balance and no signup grant,
+    # so every debit would fail. Record what they hold as an opening entry, then grant the
+    # starting balance a new user gets, each with its ledger row so the balances verify.
+    bind = op.get_bind()
+    starting = Decimal(os.getenv('STARTING_BALANCE', '1000.00')).quantize(Decimal('0.01'))
+    now = datetime.utcnow()
+    unledgered = bind.execute(
+        sa.select(users.c.id, sa.func.coalesce(users.c.balance, 0))
+        .where(~sa.exists().where(transactions.c.user_id == users.c.id))
+    ).all()
+
+    entries = []
+    for user_id, balance in unledgered:
+        if balance:
+            entries.append({"user_id": user_id, "amount": balance, "transaction_type": "opening",
+                            "created_at": now, "transaction_id": str(uuid.uuid4())})
+        if starting:
+            entries.append({"user_id": user_id, "amount": starting, "transaction_type": "signup",
+                            "created_at": now, "transaction_id": str(uuid.uuid4())})
+    if entries:
+        op.bulk_insert(transactions, entries)
+        ids = [user_id for user_id, _ in unledgered]
+        for start in range(0, len(ids), 1000):
+            bind.execute(
+                users.update().where(users.c.id.in_(ids[start:start + 1000]))
+                .values(balance=sa.func.coalesce(users.c.balance, 0) + starting)
+            )
+
+    op.execute(users.update().where(users.c.balance.is_(None)).values(balance=0))
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.alter_column('balance', existing_type=sa.Numeric(precision=10, scale=2),
+                              nullable=False, server_default='0.00')
+
+
+def downgrade():
+    # The granted balances and their ledger rows are kept; they are indistinguishable from use since
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.alter_column('balance', existing_type=sa.Numeric(precision=10, scale=2),
+                              nullable=True, server_default=None)
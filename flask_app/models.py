@@ -3,8 +3,9 @@ from datetime import datetime
 from decimal import Decimal
 import uuid
 from flask_sqlalchemy import SQLAlchemy
+from flask_app.dbrouting import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 class User(db.Model):
     __tablename__ = 'users'  # MUST BE PLURAL
@@ -12,7 +13,7 @@ class User(db.Model):
     username = db.Column(db.String(100), unique=True, nullable=False, index=True)
     email = db.Column(db.String(100), unique=True, nullable=False, index=True)
     password_hash = db.Column(db.String(60), nullable=False)  # BCrypt only
-    balance = db.Column(db.Numeric(10, 2), default=Decimal('0.00'))
+    balance = db.Column(db.Numeric(10, 2), nullable=False, default=Decimal('0.00'), server_default='0.00')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Market(db.Model):
@@ -21,9 +22,14 @@ class Market(db.Model):
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=False)
     is_resolved = db.Column(db.Boolean, default=False)
+    resolved_outcome = db.Column(db.String(3), nullable=True)  # "yes" or "no" once resolved
     outcome_yes_price = db.Column(db.Float, default=0.5)  # Probabilities start at 50%
     outcome_no_price = db.Column(db.Float, default=0.5)
     created_by = db.Column(db.Integer, nullable=False)
+    pricing_mode = db.Column(db.String(10), nullable=False, default="book")  # "book" or "lmsr"
+    liquidity = db.Column(db.Float, nullable=True)  # LMSR b parameter
+    shares_yes = db.Column(db.Float, nullable=False, default=0.0)  # LMSR outstanding shares
+    shares_no = db.Column(db.Float, nullable=False, default=0.0)
     trades = db.relationship('Trade', backref='market', lazy=True)
 
     def to_dict(self):
@@ -32,8 +38,11 @@ class Market(db.Model):
             "name": self.name,
             "description": self.description,
             "is_resolved": self.is_resolved,
+            "resolved_outcome": self.resolved_outcome,
             "outcome_yes_price": self.outcome_yes_price,
-            "outcome_no_price": self.outcome_no_price
+            "outcome_no_price": self.outcome_no_price,
+            "pricing_mode": self.pricing_mode,
+            "liquidity": self.liquidity
         }
 
 class Bet(db.Model):
@@ -55,14 +64,93 @@ class Transaction(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     transaction_id = db.Column(db.String(36), unique=True, nullable=False, default=lambda: str(uuid.uuid4()))
 
+class BalanceSnapshot(db.Model):
+    __tablename__ = 'balance_snapshots'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    balance = db.Column(db.Numeric(10, 2), nullable=False)
+    last_transaction_id = db.Column(db.Integer, nullable=False)  # Last ledger row included in balance
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Position(db.Model):
+    __tablename__ = 'positions'
+    __table_args__ = (db.UniqueConstraint('user_id', 'market_id', 'outcome', name='uq_positions_user_market_outcome'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    market_id = db.Column(db.Integer, db.ForeignKey('markets.id'), nullable=False)
+    outcome = db.Column(db.String(3), nullable=False)  # "yes" or "no"
+    shares = db.Column(db.Float, nullable=False, default=0.0)
+    cost_basis = db.Column(db.Float, nullable=False, default=0.0)  # Total paid for the shares held
+
+    def to_dict(self):
+        return {
+            "market_id": self.market_id,
+            "outcome": self.outcome,
+            "shares": self.shares,
+            "cost_basis": self.cost_basis
+        }
+
+class Candle(db.Model):
+    __tablename__ = 'candles'
+    __table_args__ = (db.UniqueConstraint('market_id', 'resolution', 'bucket', name='uq_candles_market_resolution_bucket'),)
+    id = db.Column(db.Integer, primary_key=True)
+    market_id = db.Column(db.Integer, db.ForeignKey('markets.id'), nullable=False)
+    resolution = db.Column(db.Integer, nullable=False)  # Bucket width in seconds
+    bucket = db.Column(db.BigInteger, nullable=False)  # Bucket start, epoch seconds (UTC)
+    open = db.Column(db.Float, nullable=False)  # YES price
+    high = db.Column(db.Float, nullable=False)
+    low = db.Column(db.Float, nullable=False)
+    close = db.Column(db.Float, nullable=False)
+    volume = db.Column(db.Float, nullable=False, default=0.0)  # Shares traded
+    trades = db.Column(db.Integer, nullable=False, default=0)
+
+class JournalCheckpoint(db.Model):
+    __tablename__ = 'journal_checkpoints'
+    id = db.Column(db.Integer, primary_key=True)
+    journal = db.Column(db.String(120), unique=True, nullable=False)  # One per worker process
+    segment = db.Column(db.Integer, nullable=False)  # Journal position applied up to
+    offset = db.Column(db.BigInteger, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class RestingOrder(db.Model):
+    __tablename__ = 'orders'
+    __table_args__ = (db.Index('ix_orders_owner_status', 'owner', 'status'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    market_id = db.Column(db.Integer, db.ForeignKey('markets.id'), nullable=False, index=True)
+    outcome = db.Column(db.String(3), nullable=False)  # "yes" or "no"
+    price = db.Column(db.Float, nullable=False)  # Limit price, escrowed per share
+    amount = db.Column(db.Float, nullable=False)
+    filled = db.Column(db.Float, nullable=False, default=0.0)  # As of the fills written so far
+    status = db.Column(db.String(10), nullable=False, default="open")  # "open", "filled" or "cancelled"
+    owner = db.Column(db.String(120), nullable=False)  # Process whose order book holds it
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class BookOwner(db.Model):
+    __tablename__ = 'book_owners'
+    name = db.Column(db.String(120), primary_key=True)  # One per process holding order books
+    journal = db.Column(db.String(120), nullable=True)  # Its trade journal, if enabled
+    heartbeat_at = db.Column(db.DateTime, nullable=False)
+
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_tokens'
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(36), unique=True, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
 class Trade(db.Model):
     __tablename__ = 'trades'
+    __table_args__ = (
+        db.Index('ix_trades_user_id_id', 'user_id', 'id'),  # A user's trades, in order
+        db.Index('ix_trades_market_id_id', 'market_id', 'id'),  # A market's trades, in order
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, nullable=False)
     market_id = db.Column(db.Integer, db.ForeignKey('markets.id'), nullable=False)
     outcome = db.Column(db.String(3), nullable=False)  # "yes" or "no"
     amount = db.Column(db.Float, nullable=False)
     price = db.Column(db.Float, nullable=False)  # Price at the time of bet
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def to_dict(self):
         return {
@@ -71,5 +159,6 @@ class Trade(db.Model):
             "market_id": self.market_id,
             "outcome": self.outcome,
             "amount": self.amount,
-            "price": self.price
+            "price": self.price,
+            "created_at": self.created_at.isoformat() if self.created_at else None
         }
\ No newline at end of file
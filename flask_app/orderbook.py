@@ -0,0 +1,335 @@
+# flask_app/orderbook.py
+"""In-memory limit order book for yes/no prediction markets.
+
+Each market has one book quoted in YES price ticks. A "yes" order at price p
+is a bid at p; a "no" order at price q is the mirror ask at 1 - q, so a yes
+and a no order cross whenever their prices add up to at least 1. Every side is
+a ladder of price levels kept in a heap (best price on top) with a FIFO queue
+per level, which gives price-time priority. Fills execute at the resting
+(maker) order's price.
+
+Books live in this process. Orders are stored (with their escrow) before
+they reach a book, and fills are handed to a FillBatcher that writes them in
+batches; flask_app/orders.py rebuilds the books from the stored orders when
+their process goes away. Each fill carries the taker's price improvement,
+which is refunded when the fill is written.
+"""
+import heapq
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+TICKS = 100  # 1 tick = 0.01 of probability
+EPSILON = 1e-9
+
+
+def to_ticks(price):
+    return int(round(price * TICKS))
+
+
+def from_ticks(ticks):
+    return ticks / TICKS
+
+
+class MarketHalted(Exception):
+    """The market's book is closed to new orders (it is being resolved)."""
+
+
+class Order:
+    __slots__ = ("id", "user_id", "market_id", "outcome", "ticks", "amount", "remaining")
+
+    def __init__(self, order_id, user_id, market_id, outcome, price, amount, remaining=None):
+        self.id = order_id
+        self.user_id = user_id
+        self.market_id = market_id
+        self.outcome = outcome
+        # Price on the YES ladder: bids for "yes", mirrored asks for "no"
+        self.ticks = to_ticks(price) if outcome == "yes" else TICKS - to_ticks(price)
+        self.amount = amount
+        self.remaining = amount if remaining is None else remaining
+
+    @property
+    def price(self):
+        ticks = self.ticks if self.outcome == "yes" else TICKS - self.ticks
+        return from_ticks(ticks)
+
+    @property
+    def status(self):
+        if self.remaining <= EPSILON:
+            return "filled"
+        return "partial" if self.remaining < self.amount else "open"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "market_id": self.market_id,
+            "outcome": self.outcome,
+            "price": self.price,
+            "amount": self.amount,
+            "remaining": max(self.remaining, 0.0),
+            "status": self.status
+        }
+
+
+class Fill:
+    __slots__ = ("market_id", "yes_user_id", "no_user_id", "amount", "ticks", "ts",
+                 "yes_order_id", "no_order_id", "taker", "refund")
+
+    def __init__(self, market_id, yes_user_id, no_user_id, amount, ticks, ts=None,
+                 yes_order_id=None, no_order_id=None, taker=None, refund=0.0):
+        self.market_id = market_id
+        self.yes_user_id = yes_user_id
+        self.no_user_id = no_user_id
+        self.amount = amount
+        self.ticks = ticks
+        self.ts = time.time() if ts is None else ts  # execution time, epoch seconds
+        self.yes_order_id = yes_order_id
+        self.no_order_id = no_order_id
+        self.taker = taker  # "yes" or "no": the side whose order arrived last
+        self.refund = refund  # escrow the taker gets back: its limit price minus the fill price
+
+    @property
+    def taker_user_id(self):
+        return self.yes_user_id if self.taker == "yes" else self.no_user_id
+
+    @property
+    def yes_price(self):
+        return from_ticks(self.ticks)
+
+    @property
+    def no_price(self):
+        return from_ticks(TICKS - self.ticks)
+
+    def trade_rows(self):
+        """Both legs of the fill as `Trade` column mappings."""
+        created_at = datetime.fromtimestamp(self.ts, timezone.utc).replace(tzinfo=None)
+        return (
+            {"user_id": self.yes_user_id, "market_id": self.market_id, "outcome": "yes",
+             "amount": self.amount, "price": self.yes_price, "created_at": created_at},
+            {"user_id": self.no_user_id, "market_id": self.market_id, "outcome": "no",
+             "amount": self.amount, "price": self.no_price, "created_at": created_at},
+        )
+
+    def to_dict(self):
+        return {
+            "market_id": self.market_id,
+            "amount": self.amount,
+            "yes_price": self.yes_price,
+            "no_price": self.no_price
+        }
+
+
+class _Ladder:
+    """One side of the book: a heap of price levels, each a FIFO of orders."""
+
+    def __init__(self, descending):
+        self._sign = -1 if descending else 1
+        self._heap = []
+        self._levels = {}
+
+    def __len__(self):
+        return len(self._levels)
+
+    def best(self):
+        return self._sign * self._heap[0] if self._heap else None
+
+    def front(self, ticks):
+        return self._levels[ticks]
+
+    def add(self, order):
+        level = self._levels.get(order.ticks)
+        if level is None:
+            level = self._levels[order.ticks] = deque()
+            heapq.heappush(self._heap, self._sign * order.ticks)
+        level.append(order)
+
+    def drop_best(self):
+        del self._levels[self._sign * heapq.heappop(self._heap)]
+
+    def remove(self, order):
+        level = self._levels[order.ticks]
+        level.remove(order)
+        if not level:
+            # Cancels are rare next to matches, so an O(levels) re-heapify is fine
+            del self._levels[order.ticks]
+            self._heap.remove(self._sign * order.ticks)
+            heapq.heapify(self._heap)
+
+    def depth(self, limit):
+        return [(from_ticks(self._sign * key), sum(o.remaining for o in self._levels[self._sign * key]))
+                for key in heapq.nsmallest(limit, self._heap)]
+
+
+class OrderBook:
+    def __init__(self, market_id):
+        self.market_id = market_id
+        self.lock = threading.Lock()
+        self.bids = _Ladder(descending=True)   # yes buyers
+        self.asks = _Ladder(descending=False)  # no buyers, as YES asks
+        self.resting = {}  # order id -> Order
+        self.last_ticks = None
+
+    def match(self, order):
+        """Cross `order` against the opposite side, rest any remainder.
+
+        Callers must hold `self.lock`.
+        """
+        if order.outcome == "yes":
+            opposite, crosses = self.asks, lambda best: best <= order.ticks
+            own = self.bids
+        else:
+            opposite, crosses = self.bids, lambda best: best >= order.ticks
+            own = self.asks
+
+        fills = []
+        best = opposite.best()
+        while order.remaining > EPSILON and best is not None and crosses(best):
+            level = opposite.front(best)
+            maker = level[0]
+            qty = min(order.remaining, maker.remaining)
+            maker.remaining -= qty
+            order.remaining -= qty
+            refund = qty * abs(order.ticks - best) / TICKS
+            if order.outcome == "yes":
+                fills.append(Fill(self.market_id, order.user_id, maker.user_id, qty, best,
+                                  yes_order_id=order.id, no_order_id=maker.id, taker="yes", refund=refund))
+            else:
+                fills.append(Fill(self.market_id, maker.user_id, order.user_id, qty, best,
+                                  yes_order_id=maker.id, no_order_id=order.id, taker="no", refund=refund))
+            if maker.remaining <= EPSILON:
+                del self.resting[maker.id]
+                level.popleft()
+                if not level:
+                    opposite.drop_best()
+                    best = opposite.best()
+
+        if fills:
+            self.last_ticks = fills[-1].ticks
+        if order.remaining > EPSILON:
+            own.add(order)
+            self.resting[order.id] = order
+        return fills
+
+    def cancel(self, order_id):
+        """Take a resting order off the book; returns it, or None if it is no longer resting."""
+        with self.lock:
+            order = self.resting.pop(order_id, None)
+            if order is not None:
+                (self.bids if order.outcome == "yes" else self.asks).remove(order)
+            return order
+
+    def snapshot(self, depth=10):
+        with self.lock:
+            return {
+                "market_id": self.market_id,
+                "bids": self.bids.depth(depth),
+                "asks": self.asks.depth(depth),
+                "last_price": from_ticks(self.last_ticks) if self.last_ticks is not None else None
+            }
+
+
+class FillBatcher:
+    """Group-commits fills from concurrent requests.
+
+    `add` queues fills and returns a ticket; `flush(ticket)` returns once that
+    ticket is durable. Whoever holds the flush lock writes everything queued so
+    far in a single `write(batch)` call, so requests that arrive while a write
+    is in flight are persisted together by the next writer.
+    """
+
+    def __init__(self, write):
+        self._write = write
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        self._queued = 0
+        self._flushed = 0
+
+    def add(self, fills):
+        with self._lock:
+            self._pending.extend(fills)
+            self._queued += 1
+            return self._queued
+
+    def flush(self, ticket):
+        with self._flush_lock:
+            if self._flushed >= ticket:
+                return
+            with self._lock:
+                batch, self._pending = self._pending, []
+                upto = self._queued
+            try:
+                if batch:
+                    self._write(batch)
+            except Exception:
+                with self._lock:
+                    self._pending[:0] = batch
+                raise
+            self._flushed = upto
+
+    def flush_all(self):
+        """Return once every fill queued so far is durable."""
+        with self._lock:
+            ticket = self._queued
+        self.flush(ticket)
+
+
+class OrderBooks:
+    """Registry of per-market books sharing one fill batcher."""
+
+    def __init__(self, write):
+        self._books = {}
+        self._halted = set()
+        self._lock = threading.Lock()
+        self.batcher = FillBatcher(write)
+
+    def get(self, market_id):
+        return self._books.get(market_id)
+
+    def book(self, market_id):
+        book = self._books.get(market_id)
+        if book is None:
+            with self._lock:
+                book = self._books.setdefault(market_id, OrderBook(market_id))
+        return book
+
+    def halt(self, market_id):
+        """Refuse new orders for a market (MarketHalted) until `resume` or `close`."""
+        with self._lock:
+            self._halted.add(market_id)
+        book = self._books.get(market_id)
+        if book is not None:
+            with book.lock:  # wait out a match in progress
+                pass
+
+    def resume(self, market_id):
+        with self._lock:
+            self._halted.discard(market_id)
+
+    def close(self, market_id):
+        """Drop a halted market's book; its resting orders are refunded by the caller."""
+        with self._lock:
+            return self._books.pop(market_id, None)
+
+    def reset(self):
+        """Drop every book (their orders are now held by another process)."""
+        with self._lock:
+            self._books = {}
+
+    def submit(self, order_id, user_id, market_id, outcome, price, amount, remaining=None):
+        """Match an order (a new one, or a stored one being restored); returns (order, fills, ticket)."""
+        order = Order(order_id, user_id, market_id, outcome, price, amount, remaining)
+        book = self.book(market_id)
+        with book.lock:
+            if market_id in self._halted:
+                raise MarketHalted(market_id)
+            fills = book.match(order)
+            # Queued under the book lock so fills stay in match order per market
+            ticket = self.batcher.add(fills) if fills else 0
+        return order, fills, ticket
+
+    def cancel(self, market_id, order_id):
+        """Take a resting order off its book; returns it, or None if it is not resting here."""
+        book = self._books.get(market_id)
+        return book.cancel(order_id) if book is not None else None
@@ -0,0 +1,302 @@
+# flask_app/orders.py
+"""Stored resting orders and the escrow behind them.
+
+Placing a book order debits its escrow (amount * limit price) and stores it
+in `orders` in one commit, before the order reaches a book. Fills written to
+the database add to `orders.filled` and refund the taker's price improvement.
+Whatever is not filled goes back to the user through the ledger ("cancel"),
+whichever way the order leaves its book:
+- `cancel` takes it off the book (DELETE /api/trade/orders/<id>).
+- `release_market` refunds every open order of a market being resolved.
+  An order that reached another process's book while the market was being
+  resolved is released by that process's next sweep.
+- A process that stops (crash, restart, shard owner restart) leaves its
+  orders stored with `owner` set to its name. Every process holding books
+  heartbeats in `book_owners` every ORDER_OWNER_HEARTBEAT seconds. Once an
+  owner has been silent for ORDER_OWNER_TIMEOUT seconds, or marked itself
+  gone at exit, the next sweep in another process replays the owner's trade
+  journal, so `filled` is current. It then claims the owner's open orders
+  and puts them back on its own books. In shard mode an owner process only
+  claims orders for its own markets, and web workers claim none.
+
+A process whose own heartbeat row has been taken over (it was silent for
+too long) drops its books, since another process now holds those orders,
+and registers again under a new name.
+"""
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, bindparam, case, update
+
+from flask_app import ledger
+from flask_app.journal import trade_journal
+from flask_app.models import db, BookOwner, Market, RestingOrder
+from flask_app.orderbook import EPSILON, MarketHalted
+from flask_app.shards import market_shards
+
+logger = logging.getLogger(__name__)
+
+GONE = datetime(1970, 1, 1)  # heartbeat of an owner that exited cleanly
+
+
+class OrderHeldElsewhere(Exception):
+    """The order rests on a book in another live process."""
+
+
+class RestingOrders:
+    def __init__(self, heartbeat=5.0, timeout=30.0):
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        self.name = None
+        self._app = None
+        self._books = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+
+    def init_app(self, app, order_books):
+        self.heartbeat = float(app.config.get('ORDER_OWNER_HEARTBEAT', self.heartbeat))
+        self.timeout = float(app.config.get('ORDER_OWNER_TIMEOUT', self.timeout))
+        self._app = app
+        self._books = order_books
+        market_shards.on_start(self.ensure_started)
+        market_shards.on_stop(self.retire)
+
+    # --- placing and cancelling ---
+
+    def open(self, user_id, market_id, trade):
+        """Debit the escrow for a book order and add its row; returns the row (unflushed).
+
+        Raises InsufficientBalance. The caller flushes for the id and commits before matching.
+        """
+        self.ensure_started()
+        ledger.debit(user_id, trade["amount"] * trade["price"], "order")
+        row = RestingOrder(user_id=user_id, market_id=market_id, outcome=trade["outcome"],
+                           price=trade["price"], amount=trade["amount"], filled=0.0,
+                           status="open", owner=self.name)
+        db.session.add(row)
+        return row
+
+    def submit(self, row_id, user_id, market_id, trade):
+        """Match a committed order; returns (order, fills, ticket), or refunds it and re-raises MarketHalted."""
+        try:
+            return self._books.submit(row_id, user_id, market_id, trade["outcome"], trade["price"], trade["amount"])
+        except MarketHalted:
+            self._release(RestingOrder.query.filter_by(id=row_id).all())
+            db.session.commit()
+            raise
+
+    def cancel(self, row):
+        """Cancel a stored open order and refund its unfilled escrow; commits.
+
+        Returns the refund, or None if the order is no longer resting (it has
+        been filled; the fills are still being written). Raises
+        OrderHeldElsewhere if another live process holds it.
+        """
+        if row.owner == self.name:
+            order = self._books.cancel(row.market_id, row.id)
+            if order is None:
+                return None
+            try:
+                refund = self._refund(row, order.remaining)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                # Put it back rather than lose it
+                self._books.submit(row.id, row.user_id, row.market_id, row.outcome, row.price, row.amount,
+                                   order.remaining)
+                raise
+            return refund
+
+        owner = db.session.get(BookOwner, row.owner)
+        if owner is not None and not self._is_stale(owner):
+            raise OrderHeldElsewhere(row.owner)
+        if owner is not None and not self._recover_journal(owner):
+            raise OrderHeldElsewhere(row.owner)
+        claimed = db.session.execute(
+            update(RestingOrder)
+            .where(RestingOrder.id == row.id, RestingOrder.owner == row.owner, RestingOrder.status == "open")
+            .values(owner=self.name)
+        ).rowcount
+        if not claimed:
+            db.session.rollback()
+            raise OrderHeldElsewhere(row.owner)  # taken over by another process meanwhile
+        db.session.refresh(row)
+        refund = self._refund(row, row.amount - row.filled)
+        db.session.commit()
+        return refund
+
+    def release_market(self, market_id):
+        """Refund the unfilled escrow of every open order in a market being resolved. Does not commit.
+
+        The caller halts the market's book and writes its pending fills first,
+        so `filled` is final for the orders held here.
+        """
+        return self._release(RestingOrder.query.filter_by(market_id=market_id, status="open").all())
+
+    def _release(self, rows):
+        refunds = defaultdict(float)
+        for row in rows:
+            # Conditional, so an order is only ever released once
+            if db.session.execute(
+                update(RestingOrder).where(RestingOrder.id == row.id, RestingOrder.status == "open")
+                .values(status="cancelled")
+            ).rowcount:
+                refunds[row.user_id] += max(row.amount - row.filled, 0.0) * row.price
+        for user_id, amount in refunds.items():
+            ledger.credit(user_id, amount, "cancel")
+        return len(refunds)
+
+    def _refund(self, row, remaining):
+        row.status = "cancelled"
+        return ledger.credit(row.user_id, max(remaining, 0.0) * row.price, "cancel")
+
+    # --- fills ---
+
+    @staticmethod
+    def apply_fills(fills):
+        """Add written fills to their orders' `filled`, inside the caller's transaction."""
+        filled = defaultdict(float)
+        for fill in fills:
+            for order_id in (fill.yes_order_id, fill.no_order_id):
+                if order_id is not None:
+                    filled[order_id] += fill.amount
+        if not filled:
+            return
+        table = RestingOrder.__table__
+        total = table.c.filled + bindparam("fill_amount")
+        db.session.execute(
+            update(table)
+            .where(table.c.id == bindparam("order_id"))
+            .values(filled=total, status=case(
+                (and_(table.c.status == "open", total >= table.c.amount - EPSILON), "filled"),
+                else_=table.c.status
+            )),
+            [{"order_id": order_id, "fill_amount": amount} for order_id, amount in filled.items()]
+        )
+
+    # --- ownership ---
+
+    def ensure_started(self):
+        """Register this process as a book owner and start its heartbeat (once per process).
+
+        Called at startup (app.py, or a shard owner's start), and again by `open`
+        in a forked worker, which does not inherit the heartbeat thread.
+        """
+        if self._pid == os.getpid() or market_shards.forwarding:
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            trade_journal.ensure_started()
+            with self._app.app_context():
+                self._register()
+                self.sweep()
+            threading.Thread(target=self._run, name="order-owner", daemon=True).start()
+            atexit.register(self.retire)
+            self._pid = os.getpid()
+
+    def _register(self):
+        self.name = f"{socket.gethostname()}-{os.getpid()}-{int(time.time() * 1000)}"
+        db.session.add(BookOwner(name=self.name, journal=trade_journal.name if trade_journal.enabled else None,
+                                 heartbeat_at=datetime.utcnow()))
+        db.session.commit()
+
+    def retire(self):
+        """Mark this process gone, so another one takes over its orders right away."""
+        if self._pid != os.getpid():
+            return
+        with self._app.app_context():
+            BookOwner.query.filter_by(name=self.name).update({"heartbeat_at": GONE})
+            db.session.commit()
+
+    def _run(self):
+        while True:
+            time.sleep(self.heartbeat)
+            try:
+                with self._app.app_context():
+                    self.sweep()
+            except Exception:
+                logger.exception("Order owner %s: sweep failed", self.name)
+
+    def sweep(self):
+        """Heartbeat, then take over the open orders of owners that went silent."""
+        with self._sweep_lock:
+            if not BookOwner.query.filter_by(name=self.name).update({"heartbeat_at": datetime.utcnow()}):
+                logger.error("Order owner %s was taken over; dropping its books", self.name)
+                self._books.reset()
+                self._register()
+            db.session.commit()
+            self._books.batcher.flush_all()  # retries fills a failed write left queued
+            self._release_resolved()
+
+            cutoff = datetime.utcnow() - timedelta(seconds=self.timeout)
+            for owner in BookOwner.query.filter(BookOwner.name != self.name, BookOwner.heartbeat_at < cutoff).all():
+                if not self._recover_journal(owner):
+                    continue
+                claim = (update(RestingOrder)
+                         .where(RestingOrder.owner == owner.name, RestingOrder.status == "open")
+                         .values(owner=self.name)
+                         .returning(RestingOrder.id, RestingOrder.user_id, RestingOrder.market_id,
+                                    RestingOrder.outcome, RestingOrder.price, RestingOrder.amount,
+                                    RestingOrder.filled))
+                if market_shards.owner_index is not None:
+                    claim = claim.where(RestingOrder.market_id % market_shards.count == market_shards.owner_index)
+                claimed = db.session.execute(claim).all()
+                if not RestingOrder.query.filter_by(owner=owner.name, status="open").first():
+                    db.session.delete(owner)
+                db.session.commit()
+                if claimed:
+                    self._restore(sorted(claimed))
+                    logger.warning("Order owner %s: took over %d orders from %s", self.name, len(claimed), owner.name)
+
+    def _release_resolved(self):
+        # Orders that reached a book here while their market was being resolved elsewhere
+        rows = (RestingOrder.query.join(Market, Market.id == RestingOrder.market_id)
+                .filter(RestingOrder.owner == self.name, RestingOrder.status == "open", Market.is_resolved)
+                .all())
+        if not rows:
+            return
+        for market_id in {row.market_id for row in rows}:
+            self._books.halt(market_id)
+            self._books.close(market_id)
+        self._release(rows)
+        db.session.commit()
+        logger.warning("Order owner %s: released %d orders in resolved markets", self.name, len(rows))
+
+    def _restore(self, rows):
+        ticket = 0
+        for order_id, user_id, market_id, outcome, price, amount, filled in rows:
+            if amount - filled <= EPSILON:
+                # Filled by fills replayed from the journal after it was last updated
+                db.session.execute(update(RestingOrder).where(RestingOrder.id == order_id,
+                                                              RestingOrder.status == "open")
+                                   .values(status="filled"))
+                continue
+            try:
+                _, _, order_ticket = self._books.submit(order_id, user_id, market_id, outcome, price, amount,
+                                                        amount - filled)
+            except MarketHalted:
+                continue  # being resolved here, which releases it
+            ticket = max(ticket, order_ticket)
+        db.session.commit()
+        if ticket:
+            self._books.batcher.flush(ticket)
+
+    def _is_stale(self, owner):
+        return owner.heartbeat_at < datetime.utcnow() - timedelta(seconds=self.timeout)
+
+    def _recover_journal(self, owner):
+        # Its fills must be in the database before its orders' `filled` can be trusted
+        if not owner.journal or not trade_journal.enabled:
+            return True
+        return trade_journal.recover_journal(owner.journal)
+
+
+resting_orders = RestingOrders()
@@ -0,0 +1,124 @@
+# flask_app/passwords.py
+"""Concurrency limit for bcrypt hashing and verification.
+
+This is admission control, not offloading: the request thread still waits
+for its hash. bcrypt releases the GIL while it works, so `workers` pool
+threads hash in parallel, and at most `max_queue` more requests wait their
+turn. Past `workers + max_queue` jobs in flight, callers get HasherBusy (a
+503) at once, without waiting, so a login burst holds at most that many
+server threads and the rest keep serving other requests.
+"""
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from flask_app.metrics import REGISTRY, BCRYPT_QUEUE_SECONDS, BCRYPT_REJECTED, BCRYPT_SECONDS
+
+OPERATIONS = {"hashpw": "hash", "checkpw": "check"}
+
+
+class HasherBusy(Exception):
+    """The hashing pool is saturated; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"password hasher saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    def __init__(self, rounds=12, workers=None, max_queue=None):
+        self.rounds = rounds
+        self.workers = workers or os.cpu_count() or 2
+        self.max_queue = self.workers * 4 if max_queue is None else max_queue
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._jobs = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._hash_total = 0.0
+        self._hash_max = 0.0
+
+    def _retry_after(self):
+        # Time for the current backlog to drain, rounded up to whole seconds
+        with self._stats_lock:
+            average = self._hash_total / self._jobs if self._jobs else 0.25
+            backlog = self._in_flight
+        return max(1, math.ceil(backlog * average / self.workers))
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self._rejected += 1
+            BCRYPT_REJECTED.inc()
+            raise HasherBusy(self._retry_after())
+
+        def job():
+            started = time.perf_counter()
+            result = fn(*args)
+            return result, started, time.perf_counter()
+
+        with self._stats_lock:
+            self._in_flight += 1
+        submitted = time.perf_counter()
+        try:
+            # Blocks this request thread until the hash is done; the slots above bound how many do
+            result, started, finished = self._pool.submit(job).result()
+        finally:
+            self._slots.release()
+            with self._stats_lock:
+                self._in_flight -= 1
+
+        wait, spent = started - submitted, finished - started
+        with self._stats_lock:
+            self._jobs += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            self._hash_total += spent
+            self._hash_max = max(self._hash_max, spent)
+        BCRYPT_SECONDS.labels(OPERATIONS.get(fn.__name__, fn.__name__)).observe(spent)
+        BCRYPT_QUEUE_SECONDS.observe(wait)
+        return result
+
+    def hash(self, password):
+        hashed = self._run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(rounds=self.rounds))
+        return hashed.decode('utf-8')
+
+    def check(self, password, hashed):
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        """True when `hashed` was made with a different cost than configured."""
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def stats(self):
+        with self._stats_lock:
+            jobs = self._jobs or 1
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "jobs": self._jobs,
+                "rejected": self._rejected,
+                "queue_wait_avg": self._wait_total / jobs,
+                "queue_wait_max": self._wait_max,
+                "hash_time_avg": self._hash_total / jobs,
+                "hash_time_max": self._hash_max
+            }
+
+
+password_hasher = PasswordHasher(
+    rounds=int(os.getenv('BCRYPT_ROUNDS', 12)),
+    workers=int(os.getenv('BCRYPT_WORKERS', 0)) or None,
+    max_queue=int(os.environ['BCRYPT_MAX_QUEUE']) if os.getenv('BCRYPT_MAX_QUEUE') else None
+)
+REGISTRY.gauge("bcrypt_in_flight", "bcrypt jobs running or queued", lambda: password_hasher.stats()["in_flight"])
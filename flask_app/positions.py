@@ -0,0 +1,57 @@
+# flask_app/positions.py
+"""Incremental maintenance of the per-user `positions` aggregate.
+
+Every code path that inserts trades calls `apply_trades` with the same rows
+before committing, so positions always agree with the trades table and reads
+cost O(markets held) instead of O(trades).
+"""
+from collections import defaultdict
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from flask_app.models import db, Position
+
+_UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def apply_trades(rows):
+    """Fold trade rows (dicts with user_id, market_id, outcome, amount, price)
+    into positions inside the current transaction."""
+    deltas = defaultdict(lambda: [0.0, 0.0])
+    for row in rows:
+        delta = deltas[(int(row["user_id"]), row["market_id"], row["outcome"])]
+        delta[0] += row["amount"]
+        delta[1] += row["amount"] * row["price"]
+    if not deltas:
+        return
+
+    values = [{"user_id": user_id, "market_id": market_id, "outcome": outcome,
+               "shares": shares, "cost_basis": cost}
+              for (user_id, market_id, outcome), (shares, cost) in deltas.items()]
+
+    insert = _UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+    if insert is None:
+        _apply_one_by_one(values)
+        return
+
+    table = Position.__table__
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.market_id, table.c.outcome],
+        set_={"shares": table.c.shares + stmt.excluded.shares,
+              "cost_basis": table.c.cost_basis + stmt.excluded.cost_basis}
+    )
+    db.session.execute(stmt, values)
+
+
+def _apply_one_by_one(values):
+    # Portable fallback for databases without INSERT ... ON CONFLICT
+    for value in values:
+        position = Position.query.filter_by(
+            user_id=value["user_id"], market_id=value["market_id"], outcome=value["outcome"]
+        ).with_for_update().first()
+        if position is None:
+            db.session.add(Position(**value))
+        else:
+            position.shares += value["shares"]
+            position.cost_basis += value["cost_basis"]
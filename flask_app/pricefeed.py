@@ -0,0 +1,154 @@
+# flask_app/pricefeed.py
+"""In-process pub/sub fan-out of market price and trade deltas.
+
+Writers call `publish_price`/`publish_trade` after they commit. Updates are
+coalesced per market into a pending frame; a ticker thread seals that frame
+every `interval` seconds, encodes each market's delta to JSON once, and wakes
+all subscribers. Subscribers block on a condition variable between ticks, so
+idle connections cost no CPU and nothing here ever touches the database.
+A subscriber that falls behind skips straight to the newest frame.
+
+Each open stream holds a WSGI server thread (or greenlet) for as long as the
+client stays connected. Idle streams are cheap, so PRICE_FEED_MAX_SUBSCRIBERS
+defaults to 1000 and is sized for a server with a thread or greenlet per
+connection (e.g. gunicorn with gevent) serving the stream. Under a fixed
+thread pool such as waitress (4 threads by default) set it below
+`--threads`, or the streams starve every other request. Past the cap the
+stream answers 503 and the market page falls back to polling.
+"""
+import json
+import threading
+import time
+
+from flask_app.metrics import REGISTRY
+
+
+class PriceFeed:
+    def __init__(self, interval=0.25, keepalive=15.0, max_subscribers=1000):
+        self.interval = interval
+        self.keepalive = keepalive
+        self.max_subscribers = max_subscribers
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._frame = {}
+        self._ticker = None
+        self.subscribers = 0
+        self.relaying = False  # Shard owners hand their deltas back to web workers instead of ticking
+
+    def init_app(self, app):
+        self.max_subscribers = int(app.config.get('PRICE_FEED_MAX_SUBSCRIBERS', self.max_subscribers))
+        REGISTRY.gauge("price_feed_subscribers", "Open price stream connections in this process",
+                       lambda: self.subscribers)
+
+    # --- publishing ---
+
+    def _delta(self, market_id):
+        delta = self._pending.get(market_id)
+        if delta is None:
+            delta = self._pending[market_id] = {"market_id": market_id, "trades": 0, "volume": 0.0}
+        return delta
+
+    def publish_price(self, market_id, yes_price, no_price):
+        with self._pending_lock:
+            delta = self._delta(market_id)
+            delta["outcome_yes_price"] = yes_price
+            delta["outcome_no_price"] = no_price
+        self._ensure_ticker()
+
+    def publish_trade(self, market_id, outcome, amount, price):
+        with self._pending_lock:
+            delta = self._delta(market_id)
+            delta["trades"] += 1
+            delta["volume"] += amount
+            delta["last_trade"] = {"outcome": outcome, "amount": amount, "price": price}
+        self._ensure_ticker()
+
+    def take_pending(self):
+        """Remove and return the deltas not yet sealed into a frame."""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        return list(pending.values())
+
+    def merge(self, deltas):
+        """Fold deltas published in another process (see `take_pending`) into the pending frame."""
+        with self._pending_lock:
+            for incoming in deltas:
+                delta = self._delta(incoming["market_id"])
+                delta["trades"] += incoming["trades"]
+                delta["volume"] += incoming["volume"]
+                delta.update((key, value) for key, value in incoming.items() if key not in ("trades", "volume"))
+        if deltas:
+            self._ensure_ticker()
+
+    # --- ticking ---
+
+    def _ensure_ticker(self):
+        if self._ticker is None and not self.relaying:
+            with self._cond:
+                if self._ticker is None:
+                    self._ticker = threading.Thread(target=self._run, name="price-feed", daemon=True)
+                    self._ticker.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.tick()
+
+    def tick(self):
+        """Seal the pending deltas into a frame and wake subscribers."""
+        with self._pending_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+        # Encode once per tick, shared by every subscriber
+        frame = {market_id: json.dumps(delta, separators=(",", ":")) for market_id, delta in pending.items()}
+        with self._cond:
+            self._frame = frame
+            self._seq += 1
+            self._cond.notify_all()
+
+    # --- subscribing ---
+
+    def reserve(self):
+        """Take a subscriber slot; False if `max_subscribers` streams are already open (0: no cap)."""
+        with self._cond:
+            if self.max_subscribers and self.subscribers >= self.max_subscribers:
+                return False
+            self.subscribers += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.subscribers -= 1
+
+    def subscribe(self, market_ids=None):
+        """Yield SSE-formatted chunks for `market_ids` (all markets if None).
+
+        The caller holds a slot from `reserve` and releases it when the response closes.
+        """
+        self._ensure_ticker()
+        with self._cond:
+            seen = self._seq
+        yield "retry: 2000\n\n"
+        while True:
+            with self._cond:
+                if self._seq == seen:
+                    self._cond.wait(self.keepalive)
+                if self._seq == seen:
+                    frame = None
+                else:
+                    seen, frame = self._seq, self._frame
+            if frame is None:
+                yield ": keepalive\n\n"
+                continue
+            if market_ids is None:
+                deltas = frame.values()
+            else:
+                deltas = [frame[m] for m in market_ids if m in frame]
+            if deltas:
+                yield "event: prices\ndata: [" + ",".join(deltas) + "]\n\n"
+
+
+price_feed = PriceFeed()
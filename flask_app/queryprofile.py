@@ -0,0 +1,262 @@
+# flask_app/queryprofile.py
+"""SQL profiler: slow queries, N+1 patterns and a per-endpoint report.
+
+It listens to the statement timings `flask_app.metrics` already collects from
+SQLAlchemy's cursor-execute events, so it adds no timing of its own.
+
+Every statement slower than QUERY_PROFILE_SLOW_MS is logged and counted, in
+every request. Everything else only happens for a sample of requests
+(QUERY_PROFILE_SAMPLE_RATE; all of them in debug mode, 1% otherwise), which
+keeps the cost in production to one float comparison per statement:
+
+- Statements are fingerprinted: literals become `?` and IN lists collapse to
+  `IN (...)`, so `WHERE id = 1` and `WHERE id = 2` count as the same query.
+- When one SELECT fingerprint runs QUERY_PROFILE_N_PLUS_ONE times in a single
+  request (typically a lazy relationship loaded inside a loop), it is logged
+  as an N+1 together with the line of app code that issued it.
+- Counts, times and findings are summed per endpoint. Each worker writes its
+  report to `profile-<pid>.json` in QUERY_PROFILE_DIR at most every
+  QUERY_PROFILE_DUMP_INTERVAL seconds; `flask query-report` merges and
+  prints them.
+"""
+import contextvars
+import functools
+import glob
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+import sqlalchemy
+from flask import g, has_request_context, request
+
+from flask_app.metrics import Counter, add_query_listener
+
+logger = logging.getLogger(__name__)
+
+MAX_STATEMENTS = 200  # fingerprints kept per endpoint; the cheapest are dropped beyond that
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+SQLALCHEMY_DIR = os.path.dirname(sqlalchemy.__file__) + os.sep
+OWN_FILES = {os.path.abspath(__file__), os.path.join(PACKAGE_DIR, "metrics.py")}
+
+_profile = contextvars.ContextVar("query_profile", default=None)  # set for sampled requests
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", re.IGNORECASE)
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|:\w+|\$\d+|\?|__\[POSTCOMPILE_\w+\]")
+_IN_LIST = re.compile(r"\bIN\s*\((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=4096)
+def fingerprint(statement):
+    """Normalize `statement` so queries differing only in literal values compare equal."""
+    sql = _STRING.sub("?", statement)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("IN (...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def _caller():
+    """Innermost frame outside SQLAlchemy and the instrumentation: the code that issued the query."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if SQLALCHEMY_DIR not in filename and os.path.abspath(filename) not in OWN_FILES:
+            if filename.startswith(PACKAGE_DIR):
+                filename = os.path.relpath(filename, os.path.dirname(PACKAGE_DIR))
+            return f"{filename}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def _endpoint_entry():
+    return {"requests": 0, "queries": 0, "seconds": 0.0, "n_plus_one": 0, "slow": 0, "statements": {}}
+
+
+def _statement_entry():
+    return {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "max_per_request": 0,
+            "n_plus_one": 0, "slow": 0, "location": None}
+
+
+class QueryProfiler:
+    def __init__(self, sample_rate=0.01, slow_ms=100.0, n_plus_one=5, dump_interval=30.0):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_ms / 1000
+        self.n_plus_one = n_plus_one
+        self.dump_interval = dump_interval
+        self.directory = None
+        self.report = {}  # endpoint -> totals and per-fingerprint stats
+        self._lock = threading.Lock()
+        self._dumped = time.monotonic()
+
+    def init_app(self, app):
+        rate = app.config.get('QUERY_PROFILE_SAMPLE_RATE')
+        self.sample_rate = (1.0 if app.debug else self.sample_rate) if rate is None else float(rate)
+        self.slow_seconds = float(app.config.get('QUERY_PROFILE_SLOW_MS', self.slow_seconds * 1000)) / 1000
+        self.n_plus_one = int(app.config.get('QUERY_PROFILE_N_PLUS_ONE', self.n_plus_one))
+        self.dump_interval = float(app.config.get('QUERY_PROFILE_DUMP_INTERVAL', self.dump_interval))
+        self.directory = app.config.get('QUERY_PROFILE_DIR') or os.path.join(app.instance_path, 'query_profile')
+        os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+        add_query_listener(self._on_query)
+
+    # --- request path ---
+
+    def _start(self):
+        if random.random() < self.sample_rate:
+            # fingerprint -> [count, seconds, max_seconds, N+1 location]; a context
+            # variable because `g` costs microseconds per lookup on this path
+            g.query_profile_token = _profile.set({})
+
+    def _on_query(self, statement, parameters, executemany, elapsed):
+        if elapsed >= self.slow_seconds and has_request_context():
+            self._slow(statement, elapsed)
+        profile = _profile.get()
+        if profile is None:
+            return
+        key = fingerprint(statement)
+        stats = profile.get(key)
+        if stats is None:
+            stats = profile[key] = [0, 0.0, 0.0, None]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+        if stats[0] == self.n_plus_one and not executemany and key[:6].upper() == "SELECT":
+            stats[3] = _caller() or "unknown caller"
+            logger.warning("N+1 in %s: %s ran %d+ times (%s)", request.endpoint, key, self.n_plus_one, stats[3])
+            N_PLUS_ONE.labels(request.endpoint or "unmatched").inc()
+
+    def _slow(self, statement, elapsed):
+        key = fingerprint(statement)
+        endpoint = request.endpoint or "unmatched"
+        logger.warning("Slow query in %s (%.1f ms): %s", endpoint, elapsed * 1000, key)
+        SLOW_QUERIES.labels(endpoint).inc()
+        with self._lock:
+            entry = self.report.setdefault(endpoint, _endpoint_entry())
+            entry["slow"] += 1
+            stats = entry["statements"].setdefault(key, _statement_entry())
+            stats["slow"] += 1
+            stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+
+    def _finish(self, response):
+        profile = _profile.get()
+        if profile is None:
+            return response
+        endpoint = request.endpoint or "unmatched"
+        with self._lock:
+            entry = self.report.setdefault(endpoint, _endpoint_entry())
+            entry["requests"] += 1
+            for key, (count, seconds, max_seconds, location) in profile.items():
+                entry["queries"] += count
+                entry["seconds"] += seconds
+                stats = entry["statements"].get(key)
+                if stats is None:
+                    if len(entry["statements"]) >= MAX_STATEMENTS:
+                        self._evict(entry["statements"])
+                    stats = entry["statements"][key] = _statement_entry()
+                stats["count"] += count
+                stats["seconds"] += seconds
+                stats["max_seconds"] = max(stats["max_seconds"], max_seconds)
+                stats["max_per_request"] = max(stats["max_per_request"], count)
+                if location is not None:
+                    entry["n_plus_one"] += 1
+                    stats["n_plus_one"] += 1
+                    stats["location"] = location
+            due = time.monotonic() - self._dumped >= self.dump_interval
+        if due:
+            self.dump()
+        return response
+
+    def _teardown(self, error=None):
+        token = g.pop('query_profile_token', None)
+        if token is not None:
+            _profile.reset(token)
+
+    @staticmethod
+    def _evict(statements):
+        cheapest = min(statements, key=lambda key: (statements[key]["n_plus_one"] + statements[key]["slow"] > 0,
+                                                    statements[key]["seconds"]))
+        del statements[cheapest]
+
+    # --- reporting ---
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps(self.report))
+
+    def dump(self):
+        """Write this process's report to `profile-<pid>.json` (atomically)."""
+        if self.directory is None:
+            return
+        self._dumped = time.monotonic()
+        path = os.path.join(self.directory, f"profile-{os.getpid()}.json")
+        with open(path + ".tmp", "w") as output:
+            json.dump(self.snapshot(), output)
+        os.replace(path + ".tmp", path)
+
+    def load(self):
+        """Reports of every process in QUERY_PROFILE_DIR (this one included), summed per endpoint."""
+        self.dump()
+        merged = {}
+        for path in glob.glob(os.path.join(self.directory, "profile-*.json")):
+            try:
+                with open(path) as source:
+                    report = json.load(source)
+            except (OSError, ValueError):
+                continue
+            for endpoint, entry in report.items():
+                target = merged.setdefault(endpoint, _endpoint_entry())
+                for field in ("requests", "queries", "seconds", "n_plus_one", "slow"):
+                    target[field] += entry[field]
+                for key, stats in entry["statements"].items():
+                    total = target["statements"].setdefault(key, _statement_entry())
+                    for field in ("count", "seconds", "n_plus_one", "slow"):
+                        total[field] += stats[field]
+                    for field in ("max_seconds", "max_per_request"):
+                        total[field] = max(total[field], stats[field])
+                    total["location"] = total["location"] or stats["location"]
+        return merged
+
+    def reset(self):
+        with self._lock:
+            self.report = {}
+        for path in glob.glob(os.path.join(self.directory, "profile-*.json")):
+            os.remove(path)
+
+
+def format_report(report, top=10):
+    """Human-readable per-endpoint summary, most SQL time first."""
+    lines = []
+    for endpoint, entry in sorted(report.items(), key=lambda item: -item[1]["seconds"]):
+        requests = entry["requests"]
+        per_request = f"{entry['queries'] / requests:.1f} queries, {entry['seconds'] / requests * 1000:.2f} ms SQL" \
+            if requests else "not sampled"
+        lines.append(f"{endpoint}: {requests} sampled requests, {per_request} per request; "
+                     f"{entry['n_plus_one']} N+1, {entry['slow']} slow")
+        statements = sorted(entry["statements"].items(), key=lambda item: -item[1]["seconds"])
+        for key, stats in statements[:top]:
+            flags = []
+            if stats["n_plus_one"]:
+                flags.append(f"N+1 x{stats['n_plus_one']} (up to {stats['max_per_request']}/request) "
+                             f"at {stats['location']}")
+            if stats["slow"]:
+                flags.append(f"{stats['slow']} slow")
+            lines.append(f"  {stats['count']:>7} x {stats['seconds'] * 1000:>9.2f} ms "
+                         f"(max {stats['max_seconds'] * 1000:.2f} ms)  {key[:160]}")
+            if flags:
+                lines.append(f"{'':>11}!! " + "; ".join(flags))
+    return "\n".join(lines) or "No queries profiled yet"
+
+
+N_PLUS_ONE = Counter("sql_n_plus_one", "Requests where one SELECT repeated past QUERY_PROFILE_N_PLUS_ONE", ("endpoint",))
+SLOW_QUERIES = Counter("sql_slow_queries", "Statements slower than QUERY_PROFILE_SLOW_MS", ("endpoint",))
+
+query_profiler = QueryProfiler()
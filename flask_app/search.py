@@ -0,0 +1,172 @@
+# flask_app/search.py
+"""In-process full-text index over market names and descriptions.
+
+Every worker keeps an inverted index (term -> {market_id: term frequency})
+plus a sorted term list. The last word of a query is also matched as a
+prefix, so "elec" finds "election". Results are ranked with BM25, and name
+words count NAME_WEIGHT times as much as description words. A query touches
+only the postings of its terms, so answering takes microseconds and never
+runs an ILIKE scan.
+
+The index is built on the first search, streaming the markets table by id.
+After that, `create_market` adds each new market in the worker that created
+it. Other workers pick new markets up within MARKET_SEARCH_REFRESH seconds by
+reading rows with an id above the last one indexed, minus ID_OVERLAP. That is
+a short primary-key range scan. Ids are allocated before commit, so a market
+can become visible after higher ids already have; the overlap re-reads the
+last ids to catch it. Every MARKET_SEARCH_RESYNC seconds, all market ids are
+compared with the index and any still missing are added. Markets are never
+renamed or deleted, so the index is never invalidated.
+"""
+import bisect
+import heapq
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from sqlalchemy import select
+
+from flask_app.models import Market
+from flask_app import serialize
+
+TOKEN = re.compile(r"\w+")
+NAME_WEIGHT = 2
+MAX_EXPANSIONS = 64  # terms a trailing prefix may expand to, most frequent first
+BUILD_CHUNK = 10_000
+ID_OVERLAP = 100  # ids below the highest indexed that each refresh reads again
+
+
+def tokenize(text):
+    return TOKEN.findall(text.casefold()) if text else []
+
+
+class SearchIndex:
+    def __init__(self, k1=1.2, b=0.75, refresh_interval=1.0, resync_interval=300.0):
+        self.k1 = k1
+        self.b = b
+        self.refresh_interval = refresh_interval
+        self.resync_interval = resync_interval
+        self._lock = threading.Lock()
+        self._postings = defaultdict(dict)  # term -> {market_id: weighted term frequency}
+        self._terms = []  # sorted, for prefix lookups
+        self._lengths = {}  # market_id -> weighted document length
+        self._total_length = 0  # kept as documents are added, for the average length BM25 needs
+        self._last_id = 0
+        self._built = False
+        self._refreshed = 0.0
+        self._resynced = 0.0
+
+    def init_app(self, app):
+        self.refresh_interval = float(app.config.get('MARKET_SEARCH_REFRESH', self.refresh_interval))
+        self.resync_interval = float(app.config.get('MARKET_SEARCH_RESYNC', self.resync_interval))
+
+    def __len__(self):
+        return len(self._lengths)
+
+    # --- indexing ---
+
+    def add(self, market_id, name, description):
+        """Index a market; a no-op until the index is built (the build will include it)."""
+        with self._lock:
+            if self._built:
+                self._add(market_id, name, description)
+
+    def _add(self, market_id, name, description):
+        if market_id in self._lengths:
+            return
+        counts = Counter(tokenize(description))
+        for term in tokenize(name):
+            counts[term] += NAME_WEIGHT
+        for term, count in counts.items():
+            postings = self._postings[term]
+            if not postings:
+                bisect.insort(self._terms, term)
+            postings[market_id] = count
+        length = sum(counts.values())
+        self._lengths[market_id] = length
+        self._total_length += length
+        self._last_id = max(self._last_id, market_id)
+
+    def refresh(self):
+        """Build the index on first use, then add markets other workers created since the last refresh."""
+        now = time.monotonic()
+        if self._built and now - self._refreshed < self.refresh_interval:
+            return
+        with self._lock:
+            if self._built and now - self._refreshed < self.refresh_interval:
+                return
+            after = self._last_id - ID_OVERLAP if self._built else 0
+            self._index_rows(Market.id > after)
+            if not self._built:
+                self._resynced = now
+            elif now - self._resynced >= self.resync_interval:
+                ids = serialize.execute(select(Market.id)).scalars()
+                missing = [market_id for market_id in ids if market_id not in self._lengths]
+                for start in range(0, len(missing), BUILD_CHUNK):
+                    self._index_rows(Market.id.in_(missing[start:start + BUILD_CHUNK]))
+                self._resynced = now
+            self._built = True
+            self._refreshed = time.monotonic()
+
+    def _index_rows(self, condition):
+        result = serialize.execute(
+            select(Market.id, Market.name, Market.description)
+            .where(condition)
+            .order_by(Market.id)
+            .execution_options(yield_per=BUILD_CHUNK)
+        )
+        for market_id, name, description in result:
+            self._add(market_id, name, description)
+
+    # --- querying ---
+
+    def search(self, query, limit=20):
+        """Return up to `limit` (market_id, score) pairs, best first."""
+        words = tokenize(query)
+        if not words:
+            return []
+        self.refresh()
+        with self._lock:
+            count = len(self._lengths)
+            if not count:
+                return []
+            average_length = self._total_length / count
+            # Copy only the postings this query reads, so scoring runs without the lock
+            matches = []
+            for position, word in enumerate(words):
+                if position == len(words) - 1:
+                    terms = self._expand(word)
+                else:
+                    terms = [word] if word in self._postings else []
+                matches.append([self._postings[term].copy() for term in terms])
+
+        # Documents are never removed, so every id in the copy has its length
+        lengths = self._lengths
+        base, per_length = self.k1 * (1.0 - self.b), self.k1 * self.b / average_length
+        scores = defaultdict(float)
+        for postings_lists in matches:
+            # A word scores through its best-matching term, so a prefix with many
+            # expansions doesn't outrank a whole-word match
+            best = {}
+            for postings in postings_lists:
+                weight = (self.k1 + 1.0) * math.log(1.0 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for market_id, frequency in postings.items():
+                    score = weight * frequency / (frequency + base + per_length * lengths[market_id])
+                    if score > best.get(market_id, 0.0):
+                        best[market_id] = score
+            for market_id, score in best.items():
+                scores[market_id] += score
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+
+    def _expand(self, prefix):
+        start = bisect.bisect_left(self._terms, prefix)
+        end = bisect.bisect_left(self._terms, prefix + "\U0010ffff", start)
+        terms = self._terms[start:end]
+        if len(terms) > MAX_EXPANSIONS:
+            terms = heapq.nlargest(MAX_EXPANSIONS, terms, key=lambda term: len(self._postings[term]))
+        return terms
+
+
+market_search = SearchIndex()
@@ -0,0 +1,233 @@
+# flask_app/security/anomaly.py
+"""Streaming anomaly detection over captured request records.
+
+Records are counted over a sliding window of `window` seconds that advances
+in `slides` steps. Every record is counted against its client IP and, when
+authenticated, its user, in a multi-channel count-min sketch (requests,
+errors, login failures, trade volume). Each step has its own sketch in a
+ring, and `sketch` holds their sum. Count-min sketches add up cell by cell,
+so the sum is the sketch of the whole window, and when the window slides
+the oldest step is subtracted from it. A burst that straddles a step boundary
+is therefore still counted in full in one window, where fixed windows would
+split it in two and could miss it. Keys whose estimates cross a heavy-hitter
+threshold become scoring candidates, capped at `max_candidates`, so memory
+is set by the sketch and candidate sizes rather than by how many distinct
+IPs show up.
+
+At every step the candidates are scored together in NumPy: each feature is
+turned into a z-score against an EWMA baseline of what heavy hitters
+normally look like, and keys above `threshold` raise alerts, at most one per
+key per window. Flagged keys are left out of the baseline update so an
+attack does not teach the detector that it is normal.
+"""
+import logging
+import threading
+from collections import deque
+
+import numpy as np
+
+from flask_app.security.capture import FIELDS
+
+logger = logging.getLogger(__name__)
+
+LOGIN_ROUTE = "/api/auth/login"
+FEATURES = ("rate", "error_ratio", "login_failures", "trade_volume")
+# Smallest spread assumed per feature so a quiet baseline can't make noise look extreme
+FEATURE_FLOORS = np.array([1.0, 0.05, 1.0, 10.0])
+MASK64 = (1 << 64) - 1
+
+
+class CountMinSketch:
+    """`channels` count-min sketches sharing one set of hash rows."""
+
+    def __init__(self, width=4096, depth=4, channels=1, seed=17):
+        self.bits = max(width - 1, 1).bit_length()
+        self.width = 1 << self.bits
+        self.depth = depth
+        rng = np.random.default_rng(seed)
+        # Odd multipliers for multiply-shift hashing of 64-bit key hashes
+        self._mult = rng.integers(0, 2 ** 63, size=depth, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._shift = np.uint64(64 - self.bits)
+        self._rows = np.arange(depth)[:, None]
+        self.table = np.zeros((channels, depth, self.width), dtype=np.float64)
+
+    def index(self, hashes):
+        """Column per hash row for each key hash: shape (depth, n)."""
+        return ((hashes[None, :] * self._mult[:, None]) >> self._shift).astype(np.intp)
+
+    def add(self, index, values):
+        """Add `values` (channels, n) at the columns from `index`."""
+        self.table += self.increments(index, values)
+
+    def increments(self, index, values):
+        """The table of `values` (channels, n) at the columns from `index`, to add to one or more sketches."""
+        table = np.empty_like(self.table)
+        for channel in range(table.shape[0]):
+            for row in range(self.depth):
+                table[channel, row] = np.bincount(index[row], weights=values[channel], minlength=self.width)
+        return table
+
+    def estimate(self, index):
+        """Estimated totals per channel: shape (channels, n)."""
+        return self.table[:, self._rows, index].min(axis=1)
+
+    def clear(self):
+        self.table.fill(0.0)
+
+
+def hash_keys(keys):
+    return np.fromiter((hash(key) & MASK64 for key in keys), dtype=np.uint64, count=len(keys))
+
+
+class AnomalyDetector:
+    def __init__(self, window=10.0, slides=5, width=4096, depth=4, max_candidates=1024,
+                 min_requests=10, min_login_failures=5, threshold=4.0, alpha=0.2, warmup=3):
+        self.window = window
+        self.slides = slides
+        self.step = window / slides
+        self.max_candidates = max_candidates
+        self.min_requests = min_requests
+        self.min_login_failures = min_login_failures
+        self.threshold = threshold
+        self.alpha = alpha  # per window; the baseline is updated every step
+        self._step_alpha = 1.0 - (1.0 - alpha) ** (1.0 / slides)
+        self.warmup = warmup  # windows
+        self.sketch = CountMinSketch(width, depth, channels=len(FEATURES))  # the whole window
+        self._steps = deque(np.zeros_like(self.sketch.table) for _ in range(slides))  # oldest first
+        self.candidates = {}  # key label -> 64-bit hash
+        self._alerted = {}  # key label -> step of its last alert
+        self.mean = np.zeros(len(FEATURES))
+        self.var = np.zeros(len(FEATURES))
+        self.windows_seen = 0
+        self.alerts = deque(maxlen=1000)
+        self._step_id = None
+        self._lock = threading.Lock()
+
+    def consume(self, records):
+        """Capture listener: ingest a batch of record tuples (see capture.FIELDS)."""
+        with self._lock:
+            start = 0
+            for i, record in enumerate(records):
+                step_id = int(record[0] // self.step)
+                if self._step_id is None:
+                    self._step_id = step_id
+                elif step_id > self._step_id:
+                    self._ingest(records[start:i])
+                    # Score and slide once per step passed; after a whole window of silence nothing is left
+                    for _ in range(min(step_id - self._step_id, self.slides)):
+                        self._close_step()
+                    self._step_id = step_id
+                    start = i
+            self._ingest(records[start:])
+
+    def consume_dicts(self, records):
+        """Ingest records as read back from capture segments."""
+        self.consume([tuple(record.get(field, 0) for field in FIELDS) for record in records])
+
+    def flush(self):
+        """Score the current window now and start over empty (end of a replay, shutdown)."""
+        with self._lock:
+            if self._step_id is not None:
+                self._close_step()
+                self.sketch.clear()
+                for table in self._steps:
+                    table.fill(0.0)
+                self.candidates = {}
+                self._step_id = None
+
+    def _ingest(self, records):
+        if not records:
+            return
+        keys = []
+        values = []
+        for ts, ip, method, route, status, latency_us, user_id, nbytes, amount in records:
+            row = (1.0, 1.0 if status >= 400 else 0.0,
+                   1.0 if status == 401 and route == LOGIN_ROUTE else 0.0, amount or 0.0)
+            keys.append(ip)
+            values.append(row)
+            if user_id:
+                keys.append(f"user:{user_id}")
+                values.append(row)
+
+        hashes = hash_keys(keys)
+        index = self.sketch.index(hashes)
+        increments = self.sketch.increments(index, np.asarray(values).T)
+        self.sketch.table += increments
+        self._steps[-1] += increments
+
+        # Promote heavy hitters seen in this batch to scoring candidates
+        _, first = np.unique(hashes, return_index=True)
+        estimates = self.sketch.estimate(index[:, first])
+        heavy = (estimates[0] >= self.min_requests) | (estimates[2] >= self.min_login_failures)
+        for j in np.flatnonzero(heavy):
+            self.candidates[keys[first[j]]] = hashes[first[j]]
+        if len(self.candidates) > self.max_candidates:
+            self._trim_candidates()
+
+    def _trim_candidates(self):
+        labels = list(self.candidates)
+        estimates = self.sketch.estimate(self.sketch.index(np.array([self.candidates[k] for k in labels])))
+        keep = np.argsort(-estimates[0])[:self.max_candidates]
+        self.candidates = {labels[i]: self.candidates[labels[i]] for i in keep}
+
+    def _close_step(self):
+        self._score()
+        # Slide: the oldest step leaves the window and its table is reused for the next one
+        oldest = self._steps.popleft()
+        self.sketch.table -= oldest
+        np.maximum(self.sketch.table, 0.0, out=self.sketch.table)  # float rounding
+        oldest.fill(0.0)
+        self._steps.append(oldest)
+        self._drop_quiet_candidates()
+        current = self._step_id
+        self._alerted = {key: step for key, step in self._alerted.items() if current - step < self.slides}
+
+    def _drop_quiet_candidates(self):
+        if not self.candidates:
+            return
+        labels = list(self.candidates)
+        estimates = self.sketch.estimate(self.sketch.index(np.array([self.candidates[k] for k in labels])))
+        heavy = (estimates[0] >= self.min_requests) | (estimates[2] >= self.min_login_failures)
+        self.candidates = {labels[i]: self.candidates[labels[i]] for i in np.flatnonzero(heavy)}
+
+    def _score(self):
+        if self.candidates:
+            labels = list(self.candidates)
+            estimates = self.sketch.estimate(self.sketch.index(np.array([self.candidates[k] for k in labels])))
+            requests = np.maximum(estimates[0], 1.0)
+            features = np.vstack([estimates[0] / self.window, estimates[1] / requests, estimates[2], estimates[3]])
+
+            flagged = np.zeros(len(labels), dtype=bool)
+            if self.windows_seen >= self.warmup * self.slides:
+                z = (features - self.mean[:, None]) / (np.sqrt(self.var)[:, None] + FEATURE_FLOORS[:, None])
+                scores = z.max(axis=0)
+                flagged = scores > self.threshold
+                for i in np.flatnonzero(flagged):
+                    # A key stays in the window for `slides` steps; report it once per window
+                    if self._step_id - self._alerted.get(labels[i], -self.slides) >= self.slides:
+                        self._alerted[labels[i]] = self._step_id
+                        self._alert(labels[i], scores[i], FEATURES[int(z[:, i].argmax())], features[:, i])
+
+            normal = features[:, ~flagged]
+            if normal.shape[1]:
+                if self.windows_seen == 0:
+                    self.mean, self.var = normal.mean(axis=1), normal.var(axis=1)
+                else:
+                    alpha = self._step_alpha
+                    self.mean = (1 - alpha) * self.mean + alpha * normal.mean(axis=1)
+                    self.var = (1 - alpha) * self.var + alpha * normal.var(axis=1)
+                self.windows_seen += 1
+
+    def _alert(self, key, score, reason, features):
+        alert = {
+            "window_start": (self._step_id - self.slides + 1) * self.step,
+            "key": key,
+            "score": round(float(score), 2),
+            "reason": reason,
+            "features": {name: round(float(value), 3) for name, value in zip(FEATURES, features)}
+        }
+        self.alerts.append(alert)
+        logger.warning("Traffic anomaly: %s", alert)
+
+
+anomaly_detector = AnomalyDetector()
@@ -0,0 +1,183 @@
+# flask_app/security/capture.py
+"""Request capture for the SIEM pipeline.
+
+An `after_request` hook appends one compact tuple per request to a
+preallocated ring buffer; that is all the request path does. A background
+thread drains the ring in batches, hands each batch to any registered
+listeners (e.g. the anomaly detector) and appends it as NDJSON to size-rotated
+segment files. If the disk is slow and the writer falls a full ring behind,
+the oldest records are overwritten and counted as dropped; requests never wait
+on I/O.
+"""
+import glob
+import json
+import os
+import threading
+import time
+
+from flask import g, request
+
+# Field order of a captured record tuple
+FIELDS = ("ts", "ip", "method", "route", "status", "latency_us", "user_id", "bytes", "amount")
+
+
+class RingBuffer:
+    """Fixed-size overwrite-oldest buffer with a single consumer."""
+
+    def __init__(self, capacity):
+        # Round up to a power of two so slot lookup is a mask, not a modulo
+        self.capacity = 1 << max(capacity - 1, 1).bit_length()
+        self._mask = self.capacity - 1
+        self._slots = [None] * self.capacity
+        self._lock = threading.Lock()
+        self.written = 0  # sequence number of the next slot to write
+
+    def push(self, record):
+        with self._lock:
+            self._slots[self.written & self._mask] = record
+            self.written += 1
+
+    def drain(self, read):
+        """Copy records from sequence `read` on; returns (records, next_read, dropped)."""
+        end = self.written
+        start = max(read, end - self.capacity)
+        records = [self._slots[seq & self._mask] for seq in range(start, end)]
+        # Anything the producers lapped while we copied is no longer trustworthy
+        overrun = self.written - self.capacity - start
+        if overrun > 0:
+            records = records[overrun:]
+            start += overrun
+        return records, end, start - read
+
+
+class SegmentWriter:
+    """Appends NDJSON to `requests-*.ndjson` files, rotating by size."""
+
+    def __init__(self, directory, max_bytes, max_segments):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_segments = max_segments
+        self._file = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _rotate(self):
+        if self._file:
+            self._file.close()
+        name = f"requests-{time.time_ns()}-{os.getpid()}.ndjson"
+        self._file = open(os.path.join(self.directory, name), "ab")
+        segments = sorted(glob.glob(os.path.join(self.directory, "requests-*.ndjson")))
+        for old in segments[:-self.max_segments]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def write(self, records):
+        if self._file is None or self._file.tell() >= self.max_bytes:
+            self._rotate()
+        self._file.write("".join(
+            json.dumps(dict(zip(FIELDS, record)), separators=(",", ":")) + "\n" for record in records
+        ).encode("utf-8"))
+        self._file.flush()
+
+
+def read_segments(directory):
+    """Yield captured records (as dicts) from every segment, oldest first."""
+    for path in sorted(glob.glob(os.path.join(directory, "requests-*.ndjson"))):
+        with open(path, "rb") as segment:
+            for line in segment:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class RequestCapture:
+    def __init__(self, capacity=65536, flush_interval=1.0):
+        self.ring = RingBuffer(capacity)
+        self.flush_interval = flush_interval
+        self.listeners = []
+        self.dropped = 0
+        self._read = 0
+        self._writer = None
+        self._wake = threading.Event()
+        self._flusher = None
+        self._flusher_lock = threading.Lock()
+        self._pid = None
+
+    def init_app(self, app):
+        directory = app.config.get('REQUEST_LOG_DIR') or os.path.join(app.instance_path, 'request_logs')
+        self._writer = SegmentWriter(
+            directory,
+            max_bytes=int(app.config.get('REQUEST_LOG_SEGMENT_BYTES', 64 * 1024 * 1024)),
+            max_segments=int(app.config.get('REQUEST_LOG_MAX_SEGMENTS', 20))
+        )
+        app.before_request(self._start)
+        app.after_request(self._record)
+
+    def add_listener(self, listener):
+        """`listener(records)` is called from the flush thread with each batch."""
+        self.listeners.append(listener)
+
+    # --- request path ---
+
+    def _start(self):
+        g.capture_start = time.perf_counter()
+
+    def _record(self, response):
+        start = g.get('capture_start')
+        if start is None:
+            return response
+        now = time.perf_counter()
+        rule = request.url_rule
+        claims = g.get('token_claims')
+        self.ring.push((
+            time.time(),
+            request.remote_addr,
+            request.method,
+            rule.rule if rule is not None else request.path[:200],
+            response.status_code,
+            int((now - start) * 1e6),
+            int(claims['sub']) if claims else 0,
+            response.content_length or 0,
+            g.get('capture_amount', 0.0)  # trade size, set by the trade endpoints
+        ))
+        if self._pid != os.getpid():
+            self._start_flusher()
+        elif self.ring.written - self._read >= self.ring.capacity // 2:
+            self._wake.set()
+        return response
+
+    # --- flush thread ---
+
+    def _start_flusher(self):
+        # Started lazily (and again after a fork) so every worker has its own
+        with self._flusher_lock:
+            if self._pid == os.getpid():
+                return
+            self._flusher = threading.Thread(target=self._run, name="request-capture", daemon=True)
+            self._flusher.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        records, self._read, dropped = self.ring.drain(self._read)
+        self.dropped += dropped
+        if not records:
+            return
+        for listener in self.listeners:
+            try:
+                listener(records)
+            except Exception:
+                pass  # a broken consumer must not stop the log
+        if self._writer is not None:
+            try:
+                self._writer.write(records)
+            except OSError:
+                self.dropped += len(records)
+
+
+request_capture = RequestCapture()
@@ -0,0 +1,318 @@
+# flask_app/security/firewall.py
+"""Zero-trust API firewall evaluated before every request.
+
+Rules are declared in a JSON file (FIREWALL_RULES_PATH, default
+<instance>/firewall.json):
+
+    {
+      "default": "deny",
+      "rules": [
+        {"id": "office", "action": "allow", "cidr": ["10.20.0.0/16"]},
+        {"id": "scrapers", "action": "deny", "cidr": ["203.0.113.0/24"], "priority": -1},
+        {"id": "public-read", "action": "allow", "route": ["/api/market/markets"], "methods": ["GET"]},
+        {"id": "banned", "action": "deny", "claims": {"sub": ["13", "42"]}},
+        {"id": "trade-quota", "action": "quota", "route": "/api/trade/trade", "methods": ["POST"],
+         "limit": "300 per hour", "key": "user"}
+      ]
+    }
+
+Rules are tried by (priority, position in the file). Every field present must
+match: `cidr` (IPv4/IPv6 networks), `route` (Flask URL rules, as in
+`request.url_rule`), `methods`, and `claims` (bearer token claims: a value
+means equal, a list means one of, "authenticated" tests for a valid token).
+The first matching allow/deny decides; quota rules count the request against
+the rule's limit and only stop it once exhausted. Unmatched requests get
+`default` ("allow" if unset).
+
+A rule file is compiled into a `Ruleset`: CIDR rules go into per-version
+prefix tables (one hash map per prefix length in use), and rules without a
+CIDR into a dispatch table per (route, method); rules that only test one
+claim for equality are indexed by (claim, value). Matching a request is one
+lookup per distinct prefix length, one dispatch lookup and one lookup per
+indexed claim name, however many rules there are.
+
+Each worker re-stats the file every `reload_interval` seconds and swaps in a
+freshly compiled ruleset when it changes; a file that fails to parse is
+logged and the previous ruleset stays active.
+"""
+import heapq
+import ipaddress
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+import jwt
+from flask import jsonify, request
+from limits import parse as parse_limit
+
+from flask_app.security.ratelimit import limiter
+from flask_app.tokens import token_service
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ("allow", "deny", "quota")
+QUOTA_KEYS = ("ip", "user")
+ANY = "*"
+
+
+def _as_list(value):
+    if value is None:
+        return None
+    return [value] if isinstance(value, str) else list(value)
+
+
+class Rule:
+    __slots__ = ("id", "action", "priority", "order", "networks", "routes", "methods",
+                 "claims", "limit", "key")
+
+    def __init__(self, spec, order):
+        self.id = str(spec.get("id") or f"rule-{order}")
+        self.action = spec.get("action")
+        if self.action not in ACTIONS:
+            raise ValueError(f"{self.id}: action must be one of {ACTIONS}")
+        self.priority = int(spec.get("priority", 0))
+        self.order = order
+        cidrs = _as_list(spec.get("cidr"))
+        self.networks = [ipaddress.ip_network(cidr, strict=False) for cidr in cidrs] if cidrs else None
+        routes = _as_list(spec.get("route"))
+        self.routes = frozenset(routes) if routes else None
+        methods = _as_list(spec.get("methods"))
+        self.methods = frozenset(m.upper() for m in methods) if methods else None
+        self.claims = spec.get("claims") or None
+        self.limit = None
+        self.key = spec.get("key", "ip")
+        if self.action == "quota":
+            self.limit = parse_limit(spec.get("limit", ""))
+            if self.key not in QUOTA_KEYS:
+                raise ValueError(f"{self.id}: quota key must be one of {QUOTA_KEYS}")
+
+    def applies_to(self, route, method):
+        return ((self.routes is None or route in self.routes)
+                and (self.methods is None or method in self.methods))
+
+    def indexed_claim(self):
+        """(name, values) when the only condition besides route/method is one claim equality."""
+        if self.networks is not None or self.claims is None or len(self.claims) != 1:
+            return None
+        (name, expected), = self.claims.items()
+        values = expected if isinstance(expected, list) else [expected]
+        if name == "authenticated" or not all(isinstance(v, (str, int, bool)) for v in values):
+            return None
+        return name, values
+
+    def claims_match(self, claims):
+        for name, expected in self.claims.items():
+            if name == "authenticated":
+                if bool(expected) != (claims is not None):
+                    return False
+                continue
+            if claims is None or name not in claims:
+                return False
+            actual = claims[name]
+            if isinstance(expected, list):
+                if actual not in expected:
+                    return False
+            elif actual != expected:
+                return False
+        return True
+
+
+class Ruleset:
+    def __init__(self, specs, default="allow"):
+        if default not in ("allow", "deny"):
+            raise ValueError("default must be 'allow' or 'deny'")
+        self.default = default
+        rules = [Rule(spec, order) for order, spec in enumerate(specs)]
+        rules.sort(key=lambda rule: (rule.priority, rule.order))
+        self.rules = rules
+
+        # version -> {prefix length -> {network bits -> [rule index]}}
+        self._prefixes = {4: {}, 6: {}}
+        # (route, method) -> [rule index], "*" standing for any route/method
+        self._dispatch = {}
+        # (claim name, value) -> [rule index], for rules that only test one claim
+        self._claim_index = {}
+        for index, rule in enumerate(rules):
+            indexed = rule.indexed_claim()
+            if indexed is not None:
+                name, values = indexed
+                for value in values:
+                    self._claim_index.setdefault((name, value), []).append(index)
+                continue
+            if rule.networks is None:
+                for route in rule.routes or (ANY,):
+                    for method in rule.methods or (ANY,):
+                        self._dispatch.setdefault((route, method), []).append(index)
+                continue
+            for network in rule.networks:
+                table = self._prefixes[network.version].setdefault(network.prefixlen, {})
+                bits = int(network.network_address) >> (network.max_prefixlen - network.prefixlen)
+                table.setdefault(bits, []).append(index)
+
+        # Longest prefix first; order doesn't change the result but finds specific rules sooner
+        self._lengths = {version: sorted(tables, reverse=True) for version, tables in self._prefixes.items()}
+        self._claim_names = sorted({name for name, _ in self._claim_index})
+        self._methods = {method for _, method in self._dispatch} - {ANY}
+        # (route, method named by some rule, or None for any other) -> [rule index]
+        self._scoped = {}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get("rules", []), config.get("default", "allow"))
+
+    def _without_cidr(self, route, method):
+        # Methods no rule names share one entry, so arbitrary request methods can't grow the
+        # cache: it is bounded by the app's routes times the methods the rules name
+        if method not in self._methods:
+            method = None
+        key = (route, method)
+        indexes = self._scoped.get(key)
+        if indexes is None:
+            # Merged once per (route, method) seen, then served from the cache
+            indexes = sorted(set().union(*(
+                self._dispatch.get(k, ()) for k in ((route, method), (route, ANY), (ANY, method), (ANY, ANY))
+            )))
+            self._scoped[key] = indexes
+        return indexes
+
+    def match(self, ip, route, method, get_claims=None):
+        """Candidate rules for a request, lazily in evaluation order.
+
+        CIDR, route and method are already checked; claim predicates are left
+        to the caller. `get_claims()` is only called when single-claim rules
+        exist and returns the request's token claims or None.
+        """
+        indexes = self._without_cidr(route or ANY, method)
+        hits = []
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            address = None
+        if address is not None:
+            value = int(address)
+            width = address.max_prefixlen
+            tables = self._prefixes[address.version]
+            for length in self._lengths[address.version]:
+                for index in tables[length].get(value >> (width - length), ()):
+                    if self.rules[index].applies_to(route, method):
+                        hits.append(index)
+
+        claims = get_claims() if self._claim_names and get_claims else None
+        if claims:
+            for name in self._claim_names:
+                try:
+                    candidates = self._claim_index.get((name, claims.get(name)), ())
+                except TypeError:  # unhashable claim value (e.g. a list of roles)
+                    continue
+                hits.extend(i for i in candidates if self.rules[i].applies_to(route, method))
+        if hits:
+            # A rule whose networks overlap (10.0.0.0/8 and 10.1.0.0/16) hits once per match; count it once.
+            # Both lists are sorted; merging lazily stops at the first deciding rule
+            indexes = heapq.merge(indexes, sorted(set(hits)))
+        return (self.rules[i] for i in indexes)
+
+
+class Firewall:
+    def __init__(self, reload_interval=2.0):
+        self.reload_interval = reload_interval
+        self.ruleset = Ruleset([])
+        self.path = None
+        self._signature = None
+        self._checked = 0.0
+        self._reload_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.path = app.config.get('FIREWALL_RULES_PATH') or os.path.join(app.instance_path, 'firewall.json')
+        self.reload_interval = float(app.config.get('FIREWALL_RELOAD_INTERVAL', self.reload_interval))
+        self.reload()
+        app.before_request(self._check)
+
+    def load(self, config):
+        """Compile and activate a rules config (as it would appear in the JSON file)."""
+        self.ruleset = Ruleset.from_config(config)
+
+    def reload(self):
+        """Recompile the rule file if it changed since the last load."""
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            signature = None
+        if signature == self._signature:
+            return False
+        try:
+            if signature is None:
+                self.load({})
+            else:
+                with open(self.path) as rules_file:
+                    self.load(json.load(rules_file))
+        except (OSError, ValueError, TypeError) as error:
+            logger.error("Firewall rules in %s not loaded, keeping previous rules: %s", self.path, error)
+        self._signature = signature
+        return True
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval or not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._checked = now
+            self.reload()
+        finally:
+            self._reload_lock.release()
+
+    @staticmethod
+    def _verify_bearer():
+        header = request.headers.get('Authorization', '')
+        if not header.startswith('Bearer '):
+            return None
+        try:
+            return token_service.verify(header[7:])
+        except jwt.InvalidTokenError:
+            return None
+
+    def _check(self):
+        if self.path is not None:
+            self._maybe_reload()
+        ruleset = self.ruleset
+        ip = request.remote_addr or "127.0.0.1"
+        rule_string = request.url_rule.rule if request.url_rule is not None else None
+        verified = []
+
+        def get_claims():
+            # Only verify the token once, and only when a rule needs it
+            if not verified:
+                verified.append(self._verify_bearer())
+            return verified[0]
+
+        for rule in ruleset.match(ip, rule_string, request.method, get_claims):
+            if rule.claims is not None and not rule.claims_match(get_claims()):
+                continue
+            if rule.action == "quota":
+                if not limiter.enabled:
+                    continue
+                if rule.key == "user":
+                    claims = get_claims()
+                    subject = f"user:{claims['sub']}" if claims else ip
+                else:
+                    subject = ip
+                if not limiter.limiter.hit(rule.limit, "firewall", rule.id, subject):
+                    reset_at = limiter.limiter.get_window_stats(rule.limit, "firewall", rule.id, subject).reset_time
+                    retry_after = max(1, math.ceil(reset_at - time.time()))
+                    return jsonify({"error": "Quota exceeded"}), 429, {"Retry-After": str(retry_after)}
+                continue
+            if rule.action == "deny":
+                logger.info("Firewall rule %s denied %s %s from %s", rule.id, request.method, request.path, ip)
+                return jsonify({"error": "Forbidden"}), 403
+            return None
+
+        if ruleset.default == "deny":
+            logger.info("Firewall default deny for %s %s from %s", request.method, request.path, ip)
+            return jsonify({"error": "Forbidden"}), 403
+        return None
+
+
+firewall = Firewall()
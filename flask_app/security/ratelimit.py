@@ -0,0 +1,224 @@
+# flask_app/security/ratelimit.py
+"""Flask-Limiter setup, with counters shared by every worker on a host.
+
+`limiter` is a flask-limiter `Limiter` using the sliding window counter
+strategy: a hit is allowed when `previous_window * (1 - elapsed_fraction) +
+current_window` stays within the limit, which needs only two counters per
+key. RATELIMIT_STORAGE_URI picks where the counters live:
+
+- ``shm:///path`` (default: <instance>/ratelimit.shm): `SharedMemoryStorage`,
+  a fixed-size hash table in an mmap'd file that all worker processes on the
+  host map. Slots are grouped into buckets; each bucket is guarded by a
+  thread lock plus a POSIX byte-range lock on the file, so a check and its
+  increment are atomic across threads and processes.
+- ``redis://host:port/db``: the limits library's Redis storage, for limits
+  shared across hosts.
+- ``memory://``: one process only. It is the default where fcntl is missing
+  (Windows), since the shm storage cannot lock across processes there.
+"""
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from flask import g, jsonify, make_response
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+from limits.errors import ConfigurationError
+from limits.storage.base import SlidingWindowCounterSupport, Storage, TimestampedSlidingWindow
+
+try:
+    import fcntl
+except ImportError:  # Windows: no byte-range locks, so no shm storage
+    fcntl = None
+
+
+def default_storage_uri(instance_path):
+    if fcntl is None:
+        return "memory://"
+    return "shm://" + os.path.join(instance_path, 'ratelimit.shm')
+
+
+def get_user_or_address():
+    """Authenticated user id when a token was verified, client address otherwise."""
+    claims = g.get('token_claims')
+    return f"user:{claims['sub']}" if claims else get_remote_address()
+
+
+class SharedMemoryStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    """limits storage for ``shm:///path``: counters in an mmap'd hash table shared by every process."""
+
+    STORAGE_SCHEME = ["shm"]
+    SLOT = struct.Struct('<QdQ')  # key hash, expires at (epoch seconds), count
+    BUCKET_SLOTS = 8
+
+    def __init__(self, uri, wrap_exceptions=False, buckets=8192, stripes=256, **options):
+        if fcntl is None:
+            raise ConfigurationError("shm:// rate limit storage needs fcntl; use memory:// or redis://")
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.path = uri[len("shm://"):]
+        self.buckets = int(buckets)
+        self.stripes = int(stripes)
+        self._bucket_bytes = self.SLOT.size * self.BUCKET_SLOTS
+        size = self._bucket_bytes * self.buckets
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._locks = [threading.Lock() for _ in range(self.stripes)]
+
+    @property
+    def base_exceptions(self):
+        return OSError
+
+    @staticmethod
+    def _hash(key):
+        # Stable across processes (unlike hash()); 0 marks an empty slot
+        return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+
+    @contextmanager
+    def _locked(self, *buckets):
+        # Byte-range locks are per process, so threads also need the stripe locks.
+        # Stripes and then byte ranges are taken in ascending order, so two keys never deadlock.
+        buckets = sorted(set(buckets))
+        with ExitStack() as stack:
+            for stripe in sorted({bucket % self.stripes for bucket in buckets}):
+                stack.enter_context(self._locks[stripe])
+            for bucket in buckets:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, self._bucket_bytes, bucket * self._bucket_bytes)
+                stack.callback(fcntl.lockf, self._fd, fcntl.LOCK_UN, self._bucket_bytes,
+                               bucket * self._bucket_bytes)
+            yield
+
+    def _find(self, key_hash, bucket, now):
+        """Offset of the key's slot, or of the best slot to (re)claim for it."""
+        base = bucket * self._bucket_bytes
+        victim, victim_expiry = None, None
+        for i in range(self.BUCKET_SLOTS):
+            offset = base + i * self.SLOT.size
+            slot_hash, expires_at, _ = self.SLOT.unpack_from(self._map, offset)
+            if slot_hash == key_hash and expires_at > now:
+                return offset, True
+            if slot_hash == 0 or expires_at <= now:
+                if victim is None or victim_expiry > 0:
+                    victim, victim_expiry = offset, 0
+            elif victim is None or expires_at < victim_expiry:
+                # Bucket full of live keys: evict the one closest to expiring
+                victim, victim_expiry = offset, expires_at
+        return victim, False
+
+    def _locate(self, key):
+        key_hash = self._hash(key)
+        return key_hash, key_hash % self.buckets
+
+    def _read(self, key_hash, bucket, now):
+        """(count, expires at) of a live key, or (0, None). Caller holds the bucket lock."""
+        offset, found = self._find(key_hash, bucket, now)
+        if not found:
+            return 0, None
+        _, expires_at, count = self.SLOT.unpack_from(self._map, offset)
+        return count, expires_at
+
+    def _add(self, key_hash, bucket, now, expiry, amount):
+        """Add to a counter, starting it with `expiry` seconds to live. Caller holds the bucket lock."""
+        offset, found = self._find(key_hash, bucket, now)
+        if not found:
+            if amount <= 0:
+                return 0  # taking back a hit whose slot was evicted; don't evict another key for it
+            self.SLOT.pack_into(self._map, offset, key_hash, now + expiry, amount)
+            return amount
+        _, expires_at, count = self.SLOT.unpack_from(self._map, offset)
+        # Counts are unsigned, and a hit taken back after its slot was reclaimed would go below 0
+        count = max(count + amount, 0)
+        self.SLOT.pack_into(self._map, offset, key_hash, expires_at, count)
+        return count
+
+    def incr(self, key, expiry, amount=1):
+        key_hash, bucket = self._locate(key)
+        with self._locked(bucket):
+            return self._add(key_hash, bucket, time.time(), expiry, amount)
+
+    def decr(self, key, amount=1):
+        key_hash, bucket = self._locate(key)
+        with self._locked(bucket):
+            return self._add(key_hash, bucket, time.time(), 0, -amount)
+
+    def get(self, key):
+        key_hash, bucket = self._locate(key)
+        with self._locked(bucket):
+            return self._read(key_hash, bucket, time.time())[0]
+
+    def get_expiry(self, key):
+        key_hash, bucket = self._locate(key)
+        now = time.time()
+        with self._locked(bucket):
+            expires_at = self._read(key_hash, bucket, now)[1]
+        return expires_at if expires_at is not None else now
+
+    def clear(self, key):
+        key_hash, bucket = self._locate(key)
+        with self._locked(bucket):
+            offset, found = self._find(key_hash, bucket, time.time())
+            if found:
+                self.SLOT.pack_into(self._map, offset, 0, 0.0, 0)
+
+    def check(self):
+        return True
+
+    def reset(self):
+        now = time.time()
+        cleared = 0
+        for bucket in range(self.buckets):
+            with self._locked(bucket):
+                for i in range(self.BUCKET_SLOTS):
+                    offset = bucket * self._bucket_bytes + i * self.SLOT.size
+                    slot_hash, expires_at, _ = self.SLOT.unpack_from(self._map, offset)
+                    cleared += slot_hash != 0 and expires_at > now
+                    self.SLOT.pack_into(self._map, offset, 0, 0.0, 0)
+        return cleared
+
+    # --- sliding window counter ---
+
+    def _window(self, previous, current, expiry, now):
+        previous_count, _ = self._read(*previous, now)
+        current_count, _ = self._read(*current, now)
+        previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry if previous_count else 0.0
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        previous, current = (self._locate(k) for k in self.sliding_window_keys(key, expiry, now))
+        # Both windows are read and the hit counted under one lock, so racing workers can't overshoot
+        with self._locked(previous[1], current[1]):
+            previous_count, previous_ttl, current_count, _ = self._window(previous, current, expiry, now)
+            if math.floor(previous_count * previous_ttl / expiry + current_count) + amount > limit:
+                return False
+            self._add(*current, now, 2 * expiry, amount)
+            return True
+
+    def get_sliding_window(self, key, expiry):
+        now = time.time()
+        previous, current = (self._locate(k) for k in self.sliding_window_keys(key, expiry, now))
+        with self._locked(previous[1], current[1]):
+            return self._window(previous, current, expiry, now)
+
+    def clear_sliding_window(self, key, expiry):
+        for window_key in self.sliding_window_keys(key, expiry, time.time()):
+            self.clear(window_key)
+
+
+def rate_limit_exceeded(request_limit):
+    retry_after = max(1, math.ceil(request_limit.reset_at - time.time()))
+    return make_response(jsonify({"error": "Rate limit exceeded"}), 429, {"Retry-After": str(retry_after)})
+
+
+limiter = Limiter(key_func=get_remote_address, strategy="sliding-window-counter", on_breach=rate_limit_exceeded)
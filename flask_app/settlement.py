@@ -0,0 +1,67 @@
+# flask_app/settlement.py
+"""Set-based market resolution and payout.
+
+Each winning share pays 1.00. Payouts come straight from the `positions`
+aggregate, so the work is one UPDATE over users, one bulk INSERT of payout
+transactions and one UPDATE over bets, whatever the number of trades.
+"""
+import uuid
+from datetime import datetime
+
+from sqlalchemy import case, cast, func
+
+from flask_app.models import db, Bet, Market, Position, Transaction, User
+from flask_app.shards import lock_markets
+
+
+def settle_market(market_id, outcome):
+    """Resolve `market_id` to `outcome` inside the caller's transaction.
+
+    Does not commit. Raises ValueError if the market is already resolved.
+    """
+    market = lock_markets(Market.query).populate_existing().get(market_id)
+    if market.is_resolved:
+        raise ValueError("Market is already resolved")
+
+    market.is_resolved = True
+    market.resolved_outcome = outcome
+    market.outcome_yes_price = 1.0 if outcome == "yes" else 0.0
+    market.outcome_no_price = 1.0 - market.outcome_yes_price
+
+    winning = (Position.market_id == market_id, Position.outcome == outcome, Position.shares > 0)
+    payout = func.round(cast(Position.shares, db.Numeric(12, 2)), 2)
+
+    payouts = (db.session.query(Position.user_id, payout)
+               .join(User, User.id == Position.user_id)
+               .filter(*winning)
+               .all())
+
+    if payouts:
+        user_payout = (db.session.query(payout)
+                       .filter(Position.user_id == User.id, *winning)
+                       .scalar_subquery())
+        winners = db.session.query(Position.user_id).filter(*winning)
+        User.query.filter(User.id.in_(winners)).update(
+            {User.balance: func.coalesce(User.balance, 0) + user_payout},
+            synchronize_session=False
+        )
+
+        now = datetime.utcnow()
+        db.session.bulk_insert_mappings(Transaction, [
+            {"user_id": user_id, "amount": amount, "transaction_type": "payout",
+             "created_at": now, "transaction_id": str(uuid.uuid4())}
+            for user_id, amount in payouts
+        ])
+
+    bets_settled = Bet.query.filter(Bet.market_id == market_id, Bet.status == "pending").update(
+        {Bet.status: case((Bet.outcome == outcome, "won"), else_="lost")},
+        synchronize_session=False
+    )
+
+    return {
+        "market_id": market_id,
+        "outcome": outcome,
+        "winners": len(payouts),
+        "total_paid": float(sum(amount for _, amount in payouts)),
+        "bets_settled": bets_settled
+    }
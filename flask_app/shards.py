@@ -0,0 +1,368 @@
+# flask_app/shards.py
+"""Market-sharded owner processes.
+
+Order books only exist in the process that built them, so with several web
+workers an order can only match orders that reached the same worker. LMSR
+trades pay for row locks, and every worker keeps its own copy of market
+state. With MARKET_SHARDS=N, markets are assigned to N owner processes by
+`market_id % N`. The owners are started with `flask market-shards`. Views
+decorated with `@owned(...)` are not run by the web worker; it forwards them
+over a Unix socket in MARKET_SHARD_DIR to the owner of the market involved.
+
+Each owner is an actor. Connection threads put requests in one mailbox and a
+single thread runs them in arrival order. So every market has a single
+writer: its order book is complete, and LMSR share updates need no
+SELECT ... FOR UPDATE (`lock_markets` leaves the lock out in owners).
+Throughput scales with the number of shards, not with row-lock contention.
+
+The web worker has already authenticated the request and applied rate
+limits and the firewall. It forwards the token claims with the method, path,
+query string and body, and the owner calls the undecorated view. The reply
+carries the response together with the owner's price-feed deltas and
+listing-cache invalidations, which the worker replays locally. SSE
+subscribers and cached pages therefore behave as they do without shards.
+"""
+import json
+import logging
+import os
+import queue
+import signal
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+from flask import Response, g, jsonify, request
+
+from flask_app.cache import market_listing_cache
+from flask_app.journal import trade_journal
+from flask_app.models import db
+from flask_app.pricefeed import price_feed
+
+logger = logging.getLogger(__name__)
+
+FRAME = struct.Struct("<I")  # length of the JSON message that follows
+RELAYED_G = ("capture_amount",)  # request state set by views that the web worker's hooks read
+SKIPPED_HEADERS = {"content-length", "transfer-encoding", "connection"}
+
+
+class ShardUnavailable(Exception):
+    pass
+
+
+def _reply(status, error):
+    return {"status": status, "headers": [("Content-Type", "application/json")],
+            "body": json.dumps({"error": error}), "g": {}, "invalidate": False, "feed": []}
+
+
+def _send(sock, message):
+    payload = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    sock.sendall(FRAME.pack(len(payload)) + payload)
+
+
+def _receive(sock):
+    header = _read_exactly(sock, FRAME.size)
+    if header is None:
+        return None
+    payload = _read_exactly(sock, FRAME.unpack(header)[0])
+    if payload is None:
+        raise ConnectionError("connection closed mid-message")
+    return json.loads(payload)
+
+
+def _read_exactly(sock, size):
+    parts, remaining = [], size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1 << 20))
+        if not chunk:
+            if remaining == size:
+                return None
+            raise ConnectionError("connection closed mid-message")
+        parts.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(parts)
+
+
+class MarketShards:
+    def __init__(self, timeout=30.0):
+        self.count = 0
+        self.directory = None
+        self.timeout = timeout
+        self.owner_index = None  # set in owner processes
+        self.views = {}
+        self._on_start = []
+        self._on_stop = []
+        self._app = None
+        self._local = threading.local()
+
+    def init_app(self, app):
+        self.count = int(app.config.get('MARKET_SHARDS') or 0)
+        self.directory = app.config.get('MARKET_SHARD_DIR') or os.path.join(app.instance_path, 'shards')
+        self.timeout = float(app.config.get('MARKET_SHARD_TIMEOUT', self.timeout))
+        self._app = app
+
+    def on_start(self, callback):
+        """Run `callback()` (in an app context) in each owner process before it accepts requests."""
+        self._on_start.append(callback)
+
+    def on_stop(self, callback):
+        """Run `callback()` (in an app context) when an owner process shuts down."""
+        self._on_stop.append(callback)
+
+    @property
+    def forwarding(self):
+        return self.count > 0 and self.owner_index is None
+
+    def shard_of(self, market_id):
+        return market_id % self.count
+
+    def socket_path(self, index):
+        return os.path.join(self.directory, f"shard-{index}.sock")
+
+    # --- web worker side ---
+
+    def call(self, index, message):
+        """Send `message` to owner `index` and return its reply (one retry on a stale connection)."""
+        connections = self._local.__dict__.setdefault("connections", {})
+        for attempt in (1, 2):
+            sock = connections.get(index)
+            try:
+                if sock is None:
+                    sock = connections[index] = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    sock.settimeout(self.timeout)
+                    sock.connect(self.socket_path(index))
+                _send(sock, message)
+                reply = _receive(sock)
+                if reply is None:
+                    raise ConnectionError("owner closed the connection")
+                return reply
+            except OSError as error:
+                connections.pop(index, None)
+                sock.close()
+                if attempt == 2 or isinstance(error, socket.timeout):
+                    raise ShardUnavailable(f"market shard {index}: {error}") from error
+
+    def forward(self, index, view_name, kwargs, body=None):
+        """Run `view_name` for the current request in owner `index`; returns the reply dict."""
+        return self.call(index, {
+            "view": view_name,
+            "kwargs": kwargs,
+            "method": request.method,
+            "path": request.path,
+            "query_string": request.query_string.decode("latin-1"),
+            "content_type": request.content_type,
+            "body": (request.get_data() if body is None else body).decode("latin-1"),
+            "remote_addr": request.remote_addr,
+            "claims": g.get('token_claims')
+        })
+
+    def respond(self, reply):
+        """Turn an owner's reply into this worker's response, replaying its side effects."""
+        for name, value in reply["g"].items():
+            setattr(g, name, value)
+        if reply["invalidate"]:
+            market_listing_cache.invalidate()
+        price_feed.merge(reply["feed"])
+        return Response(reply["body"].encode("latin-1"), status=reply["status"], headers=reply["headers"])
+
+    # --- owner side ---
+
+    def serve(self, index):
+        """Run owner `index` until terminated (called in a fresh process by `flask market-shards`)."""
+        self.owner_index = index
+        price_feed.relaying = True
+        path = self.socket_path(index)
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+        with self._app.app_context():
+            for callback in self._on_start:
+                callback()
+        mailbox = queue.Queue()
+        threading.Thread(target=self._run_actor, args=(mailbox,), name=f"shard-{index}", daemon=True).start()
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    message = _receive(self.request)
+                    if message is None:
+                        return
+                    done = threading.Event()
+                    slot = [message, None, done]
+                    mailbox.put(slot)
+                    done.wait()
+                    _send(self.request, slot[1])
+
+        server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        server.daemon_threads = True
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+        logger.info("Market shard %d/%d serving on %s", index, self.count, path)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.remove(path)
+            # Forked processes exit without running atexit handlers
+            with self._app.app_context():
+                for callback in self._on_stop:
+                    callback()
+            trade_journal.close()
+
+    def _run_actor(self, mailbox):
+        while True:
+            slot = mailbox.get()
+            try:
+                slot[1] = self._handle(slot[0])
+            except Exception:
+                logger.exception("Market shard %d failed on %s", self.owner_index, slot[0].get("view"))
+                slot[1] = _reply(500, "Internal error in market shard")
+            slot[2].set()
+
+    def _handle(self, message):
+        view = self.views[message["view"]]
+        generation = market_listing_cache.generation
+        with self._app.test_request_context(
+            message["path"], method=message["method"], query_string=message["query_string"],
+            content_type=message["content_type"], data=message["body"].encode("latin-1"),
+            environ_base={"REMOTE_ADDR": message["remote_addr"]}
+        ):
+            if message["claims"] is not None:
+                g.token_claims = message["claims"]
+            try:
+                response = self._app.make_response(view(**message["kwargs"]))
+            except Exception:
+                db.session.rollback()
+                raise
+            relayed = {name: g.get(name) for name in RELAYED_G if name in g}
+        return {
+            "status": response.status_code,
+            "headers": [(key, value) for key, value in response.headers.items()
+                        if key.lower() not in SKIPPED_HEADERS],
+            "body": response.get_data().decode("latin-1"),
+            "g": relayed,
+            "invalidate": market_listing_cache.generation != generation,
+            "feed": price_feed.take_pending()
+        }
+
+
+market_shards = MarketShards()
+
+
+def lock_markets(query):
+    """`query` with FOR UPDATE, unless this process is the markets' single writer."""
+    return query if market_shards.owner_index is not None else query.with_for_update()
+
+
+def owned(market_key):
+    """Run the view in the owner of the market `market_key(view_kwargs)` names.
+
+    Put it directly above the view function, below auth and rate limiting,
+    which run in the web worker. When `market_key` returns None the view runs
+    locally (it will reject the request itself).
+    """
+    def decorator(view):
+        name = f"{view.__module__}.{view.__qualname__}"
+        market_shards.views[name] = view
+
+        @wraps(view)
+        def wrapper(**kwargs):
+            if not market_shards.forwarding:
+                return view(**kwargs)
+            market_id = market_key(kwargs)
+            if market_id is None:
+                return view(**kwargs)
+            try:
+                reply = market_shards.forward(market_shards.shard_of(market_id), name, kwargs)
+            except ShardUnavailable as error:
+                logger.error("%s", error)
+                reply = _reply(503, "Market temporarily unavailable")
+            return market_shards.respond(reply)
+        return wrapper
+    return decorator
+
+
+def owned_batch(market_key, max_items, items_key="trades"):
+    """Like `owned`, for views taking a list of items that may span several markets.
+
+    Items are split by owner, each owner runs the view on its share, and the
+    per-item results (`{"results": [{"index": ...}, ...]}`) are merged back
+    in the original order. `market_key(item)` names an item's market. Bodies
+    the view rejects as a whole (not a list, empty, more than `max_items`)
+    are left to the local view.
+    """
+    def decorator(view):
+        name = f"{view.__module__}.{view.__qualname__}"
+        market_shards.views[name] = view
+
+        @wraps(view)
+        def wrapper(**kwargs):
+            if not market_shards.forwarding:
+                return view(**kwargs)
+            data = request.get_json(silent=True)
+            items = data.get(items_key) if isinstance(data, dict) else data
+            if not isinstance(items, list) or not items or len(items) > max_items:
+                return view(**kwargs)
+            groups = defaultdict(list)
+            for index, item in enumerate(items):
+                market_id = market_key(item)
+                groups[0 if market_id is None else market_shards.shard_of(market_id)].append(index)
+
+            results = []
+            for shard, indexes in groups.items():
+                body = json.dumps({items_key: [items[i] for i in indexes]}).encode("utf-8")
+                try:
+                    reply = market_shards.forward(shard, name, kwargs, body=body)
+                except ShardUnavailable as error:
+                    logger.error("%s", error)
+                    reply = _reply(503, "Market temporarily unavailable")
+                if len(groups) == 1:
+                    return market_shards.respond(reply)
+                if reply["status"] != 200:
+                    error = json.loads(reply["body"]).get("error")
+                    results.extend({"index": i, "status": reply["status"], "error": error} for i in indexes)
+                    continue
+                market_shards.respond(reply)  # replay side effects; the results are merged below
+                for result in json.loads(reply["body"])["results"]:
+                    result["index"] = indexes[result["index"]]
+                    results.append(result)
+            results.sort(key=lambda result: result["index"])
+            return jsonify({"results": results}), 200
+        return wrapper
+    return decorator
+
+
+def run_owners(app, count):
+    """Start `count` owner processes and restart any that die, until SIGTERM/SIGINT."""
+    import multiprocessing  # Only the supervisor needs it
+
+    context = multiprocessing.get_context("fork")
+    processes = {}
+    stopping = threading.Event()
+
+    def start(index):
+        process = context.Process(target=market_shards.serve, args=(index,), name=f"market-shard-{index}")
+        process.start()
+        processes[index] = process
+
+    def stop(*_):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    with app.app_context():
+        db.engine.dispose()  # children must not share the parent's pooled connections
+    for index in range(count):
+        start(index)
+    while not stopping.wait(1.0):
+        for index, process in list(processes.items()):
+            if not process.is_alive():
+                logger.warning("Market shard %d exited with %s; restarting", index, process.exitcode)
+                start(index)
+    for process in processes.values():
+        process.terminate()
+    deadline = time.monotonic() + 10
+    for process in processes.values():
+        process.join(max(0.0, deadline - time.monotonic()))
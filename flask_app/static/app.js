@@ -25,22 +25,35 @@ async function login() {
     }
 }
 
+// Markets come a page at a time; follow X-Next-Cursor until the last page
+async function fetchAllMarkets(headers = {}) {
+    let markets = [];
+    let after = 0;
+    while (after !== null) {
+        const response = await fetch(`/api/market/markets?limit=500&after=${after}`, { method: "GET", headers });
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        markets = markets.concat(await response.json());
+        after = response.headers.get("X-Next-Cursor");
+    }
+    return markets;
+}
+
 async function fetchMarkets() {
     const token = localStorage.getItem("token");
 
-    const response = await fetch("/api/market/markets", {
-        method: "GET",
-        headers: {
-            "Authorization": `Bearer ${token}`
-        }
-    });
-
-    const data = await response.json();
+    let data;
+    try {
+        data = await fetchAllMarkets({ "Authorization": `Bearer ${token}` });
+    } catch (error) {
+        data = null;
+    }
 
-    if (response.ok) {
+    if (data) {
         const marketsList = document.getElementById("markets-list");
         marketsList.innerHTML = "";
-        data.markets.forEach(market => {
+        data.forEach(market => {
             let listItem = document.createElement("li");
             listItem.textContent = market.name + " - " + market.odds;
             marketsList.appendChild(listItem);
@@ -53,8 +66,7 @@ async function fetchMarkets() {
 
 document.getElementById("view-markets").addEventListener("click", function(e) {
     e.preventDefault();
-    fetch("/api/markets/markets")
-        .then(response => response.json())
+    fetchAllMarkets()
         .then(data => {
             let content = "<h2>Available Markets</h2><ul>";
             data.forEach(market => {
@@ -0,0 +1,212 @@
+# flask_app/tokens.py
+"""Single issuer/verifier for API access tokens.
+
+Login issues tokens here and every protected route checks them through
+`token_required`, so there is one token format (HS256, `iss`/`aud`, string
+`sub`, `jti`). Verified tokens are remembered in a bounded LRU keyed by a hash
+of the token until they expire, so repeat requests skip the decode and claim
+validation. Revoked `jti`s are written to the `revoked_tokens` table and
+mirrored into a per-process bloom filter + exact set that each worker refreshes
+from the table every few seconds, so revocation checks never query per request.
+
+A refresh reads rows with an id above the last one seen, minus ID_OVERLAP.
+Ids are allocated before commit, so a revocation can become visible after
+higher ids already have. Re-reading the last ID_OVERLAP ids catches those
+within a refresh or two. Every JWT_REVOCATION_RESYNC seconds the whole
+unexpired set is read again, which catches any commit that was later still.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+import jwt
+from flask import g, jsonify, request
+from sqlalchemy.exc import SQLAlchemyError
+
+from flask_app.models import db, RevokedToken
+
+ID_OVERLAP = 100  # ids below the highest seen that each refresh reads again
+
+
+class TokenRevoked(jwt.InvalidTokenError):
+    pass
+
+
+class BloomFilter:
+    def __init__(self, bits=1 << 16, hashes=4):
+        self.bits = bits
+        self.hashes = hashes
+        self._array = bytearray(bits // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self._array[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self._array[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class RevocationSet:
+    """Bloom filter in front of an exact jti -> expiry map.
+
+    Almost every lookup is a token that was never revoked and stops at the
+    bloom filter; only probable hits consult the exact map.
+    """
+
+    def __init__(self, bits=1 << 16, hashes=4):
+        self._bits = bits
+        self._hashes = hashes
+        self._bloom = BloomFilter(bits, hashes)
+        self._exact = {}
+
+    def add(self, jti, expires_at):
+        self._exact[jti] = expires_at
+        self._bloom.add(jti)
+
+    def __contains__(self, jti):
+        return jti in self._bloom and jti in self._exact
+
+    def __len__(self):
+        return len(self._exact)
+
+    def purge(self, now):
+        """Forget expired entries; the bloom filter is rebuilt since it can't delete."""
+        live = {jti: exp for jti, exp in self._exact.items() if exp > now}
+        if len(live) == len(self._exact):
+            return
+        bloom = BloomFilter(self._bits, self._hashes)
+        for jti in live:
+            bloom.add(jti)
+        self._exact, self._bloom = live, bloom
+
+
+class TokenService:
+    def __init__(self, cache_size=10000, sync_interval=5.0, resync_interval=60.0):
+        self.cache_size = cache_size
+        self.sync_interval = sync_interval
+        self.resync_interval = resync_interval
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._revoked = RevocationSet()
+        self._sync_lock = threading.Lock()
+        self._last_sync = 0.0
+        self._last_resync = 0.0
+        self._last_revoked_id = 0
+
+    def init_app(self, app):
+        self.secret = app.config['JWT_SECRET_KEY']
+        self.issuer = app.config.get('JWT_ISSUER', 'your-app-name')
+        self.audience = app.config.get('JWT_AUDIENCE', 'your-app-client')
+        self.expires = int(app.config.get('JWT_ACCESS_TOKEN_EXPIRES', 3600))
+        self.cache_size = int(app.config.get('JWT_VERIFY_CACHE_SIZE', self.cache_size))
+        self.resync_interval = float(app.config.get('JWT_REVOCATION_RESYNC', self.resync_interval))
+
+    def issue(self, user_id):
+        """Returns (token, expires_in)."""
+        if not self.secret:
+            raise ValueError("Missing JWT secret in environment")
+        now = datetime.now(timezone.utc)
+        token = jwt.encode({
+            'sub': str(user_id),
+            'jti': uuid.uuid4().hex,
+            'iat': now,
+            'exp': int(now.timestamp()) + self.expires,
+            'iss': self.issuer,
+            'aud': self.audience
+        }, self.secret, algorithm='HS256')
+        return token, self.expires
+
+    def verify(self, token):
+        """Return the token's claims or raise a jwt.InvalidTokenError."""
+        now = time.time()
+        if now - self._last_sync > self.sync_interval:
+            self._sync(now)
+
+        key = hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+        with self._cache_lock:
+            claims = self._cache.get(key)
+            if claims is not None:
+                self._cache.move_to_end(key)
+
+        if claims is None:
+            claims = jwt.decode(token, self.secret, algorithms=['HS256'],
+                                audience=self.audience, issuer=self.issuer,
+                                options={'require': ['exp', 'sub', 'jti']})
+            with self._cache_lock:
+                self._cache[key] = claims
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        elif claims['exp'] <= now:
+            with self._cache_lock:
+                self._cache.pop(key, None)
+            raise jwt.ExpiredSignatureError("Signature has expired")
+
+        if claims['jti'] in self._revoked:
+            raise TokenRevoked("Token has been revoked")
+        return claims
+
+    def revoke(self, claims):
+        expires_at = datetime.fromtimestamp(claims['exp'], timezone.utc).replace(tzinfo=None)
+        db.session.add(RevokedToken(jti=claims['jti'], expires_at=expires_at))
+        RevokedToken.query.filter(RevokedToken.expires_at < datetime.utcnow()).delete(synchronize_session=False)
+        db.session.commit()
+        self._revoked.add(claims['jti'], claims['exp'])
+
+    def _sync(self, now):
+        """Pull revocations made by other workers since the last sync (all of them now and then)."""
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            query = db.session.query(RevokedToken.id, RevokedToken.jti, RevokedToken.expires_at)
+            resync = now - self._last_resync > self.resync_interval
+            if resync:
+                query = query.filter(RevokedToken.expires_at > datetime.utcnow())
+            else:
+                query = query.filter(RevokedToken.id > self._last_revoked_id - ID_OVERLAP)
+            for row_id, jti, expires_at in query.order_by(RevokedToken.id).all():
+                self._revoked.add(jti, expires_at.replace(tzinfo=timezone.utc).timestamp())
+                self._last_revoked_id = max(self._last_revoked_id, row_id)
+            self._revoked.purge(now)
+            self._last_sync = now
+            if resync:
+                self._last_resync = now
+        except SQLAlchemyError:
+            db.session.rollback()  # keep serving from the last known set
+        finally:
+            self._sync_lock.release()
+
+
+token_service = TokenService()
+
+
+def token_required(fn):
+    """Require a valid bearer token; its claims are stored on `g.token_claims`."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        header = request.headers.get('Authorization', '')
+        if not header.startswith('Bearer '):
+            return jsonify({"error": "Missing bearer token"}), 401
+        try:
+            g.token_claims = token_service.verify(header[7:])
+        except TokenRevoked:
+            return jsonify({"error": "Token has been revoked"}), 401
+        except jwt.ExpiredSignatureError:
+            return jsonify({"error": "Token has expired"}), 401
+        except jwt.InvalidTokenError:
+            return jsonify({"error": "Invalid token"}), 401
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def get_token_identity():
+    return int(g.token_claims['sub'])
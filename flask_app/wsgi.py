@@ -0,0 +1,13 @@
+# flask_app/wsgi.py
+"""WSGI entry point: `waitress-serve flask_app.wsgi:app` or `gunicorn flask_app.wsgi:app`.
+
+Importing it claims this process's order books and opens its trade journal
+once, at worker startup, so no request pays for it. `flask_app.app` itself
+stays free of that, so CLI commands and scripts can import it against a
+database that has not been migrated yet. A worker forked after the import
+(gunicorn --preload) starts its own on its first book order or fill.
+"""
+from flask_app.app import app
+from flask_app.orders import resting_orders
+
+resting_orders.ensure_started()